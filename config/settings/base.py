@@ -328,3 +328,38 @@ SOCIALACCOUNT_FORMS = {"signup": "urban_performance.users.forms.UserSocialSignup
 
 # Your stuff...
 # ------------------------------------------------------------------------------
+# Maximum memory kept by the per-worker spatial layer registry
+# (urban_performance.projects.layers).
+LAYER_REGISTRY_MAX_BYTES = env.int(
+    "LAYER_REGISTRY_MAX_BYTES", default=512 * 1024 * 1024
+)
+# How process_project_controls runs its per-file units: "serial", "process"
+# (billiard pool) or "thread". PREPROCESSING_WORKERS=0 uses every core.
+PREPROCESSING_PARALLEL_MODE = env(
+    "PREPROCESSING_PARALLEL_MODE", default="serial"
+)
+PREPROCESSING_WORKERS = env.int("PREPROCESSING_WORKERS", default=0)
+# Scenarios evaluated and written by each process_scenario_chunk task, and
+# chunk tasks queued at a time per project (the next batch is only sent once
+# the previous one finished).
+SCENARIO_CHUNK_SIZE = env.int("SCENARIO_CHUNK_SIZE", default=1000)
+SCENARIO_BATCH_CHUNKS = env.int("SCENARIO_BATCH_CHUNKS", default=32)
+# Compiled scenario evaluators kept per process
+# (urban_performance.projects.evaluator_cache).
+EVALUATOR_CACHE_SIZE = env.int("EVALUATOR_CACHE_SIZE", default=8)
+# Also store every scenario in a memory-mapped cube read by the scenario
+# lookups (urban_performance.projects.cube).
+SCENARIO_CUBE = env.bool("SCENARIO_CUBE", default=False)
+# Also store the scenarios factorized by the controls each indicator depends
+# on, read first by the scenario lookups (urban_performance.projects.factors).
+SCENARIO_FACTORS = env.bool("SCENARIO_FACTORS", default=False)
+# Centroids of the per-indicator quantile sketch stored in Proyecto.niveles,
+# 0 to only keep min, max, mean and count (urban_performance.projects.niveles).
+NIVELES_SKETCH_SIZE = env.int("NIVELES_SKETCH_SIZE", default=0)
+# Seconds the scenarios evaluated by the lookups (not stored yet) stay in the
+# cache (urban_performance.projects.result_cache).
+SCENARIO_RESULT_CACHE_TIMEOUT = env.int("SCENARIO_RESULT_CACHE_TIMEOUT", default=60 * 60)
+# Scenarios one control away from a looked up one that are evaluated into
+# that cache in the background, 0 to disable the prefetch
+# (urban_performance.projects.prefetch).
+SCENARIO_PREFETCH_BUDGET = env.int("SCENARIO_PREFETCH_BUDGET", default=0)
@@ -1,5 +1,7 @@
+create sequence public.urban_performance_controls_row_id as integer;
+
 create table public.urban_performance_controls (
-    id integer generated always as identity unique,
+    id integer not null default nextval('public.urban_performance_controls_row_id'),
     project_id uuid not null,
     population_ text not null,
     footprint text not null,
@@ -77,60 +79,25 @@ create table public.urban_performance_controls (
     pc_residencial_hu double precision not null,
     water_consumption double precision not null,
     energy_consumption_water_supply double precision not null,
-    constraint urban_performance_controls_project_id_population__footprint_transit_nbs_en_key unique (
-        project_id,
-        population_,
-        footprint,
-        transit,
-        nbs,
-        energy_efficiency,
-        solar_energy,
-        rwh,
-        hospitals,
-        schools,
-        sport_centers,
-        clinics,
-        daycare,
-        green_areas,
-        infrastructure,
-        jobs,
-        permeable_areas
-    )
-);
+    scenario_key bigint not null
+) partition by list (project_id);
+
+alter sequence public.urban_performance_controls_row_id owned by public.urban_performance_controls.id;
 
 alter table
     public.urban_performance_controls owner to postgres;
 
-create index idx_urban_performance_controls_project_id on public.urban_performance_controls (project_id);
-
-create index idx_urban_performance_controls_population_ on public.urban_performance_controls (population_);
-
-create index idx_urban_performance_controls_footprint on public.urban_performance_controls (footprint);
-
-create index idx_urban_performance_controls_transit on public.urban_performance_controls (transit);
-
-create index idx_urban_performance_controls_nbs on public.urban_performance_controls (nbs);
-
-create index idx_urban_performance_controls_hospitals on public.urban_performance_controls (hospitals);
-
-create index idx_urban_performance_controls_schools on public.urban_performance_controls (schools);
-
-create index idx_urban_performance_controls_sports_centers on public.urban_performance_controls (sport_centers);
-
-create index idx_urban_performance_controls_clinics on public.urban_performance_controls (clinics);
-
-create index idx_urban_performance_controls_daycare on public.urban_performance_controls (daycare);
-
-create index idx_urban_performance_controls_green_areas on public.urban_performance_controls (green_areas);
-
-create index idx_urban_performance_controls_infrastructure on public.urban_performance_controls (infrastructure);
-
-create index idx_urban_performance_controls_jobs on public.urban_performance_controls (jobs);
-
-create index idx_urban_performance_controls_permeable_areas on public.urban_performance_controls (permeable_areas);
-
-create index idx_urban_performance_controls_energy_efficiency on public.urban_performance_controls (energy_efficiency);
-
-create index idx_urban_performance_controls_solar_energy on public.urban_performance_controls (solar_energy);
-
-create index idx_urban_performance_controls_rwh on public.urban_performance_controls (rwh);
\ No newline at end of file
+-- One key per scenario: the mixed-radix combination of the project's
+-- ControlOption codes (migration 0022)
+create unique index urban_performance_controls_scenario_key on public.urban_performance_controls (project_id, scenario_key);
+
+-- One partition per project: its active result set, named
+-- scenarios_<uuid hex>_v<Proyecto.scenarios_version>. Runs build the next
+-- version unlogged and detached, then index, cluster and attach it in place
+-- of the previous one (migrations 0023 and 0024, projects/partitions.py):
+--
+-- create unlogged table public.scenarios_<uuid hex>_v<version> (like public.urban_performance_controls including defaults);
+-- ... copy rows ...
+-- alter table public.scenarios_<uuid hex>_v<version> set logged;
+-- create unique index scenarios_<uuid hex>_v<version>_key on public.scenarios_<uuid hex>_v<version> (project_id, scenario_key);
+-- alter table public.urban_performance_controls attach partition public.scenarios_<uuid hex>_v<version> for values in ('<uuid>');
@@ -1,2 +1,81 @@
+import json
 
-# Create your tests here.
+import pytest
+from django.core.cache import cache
+from django.http import Http404
+from django.test import RequestFactory
+
+from urban_performance.api.views import ProgressStreamView
+from urban_performance.api.views import queue_processing
+from urban_performance.projects.models import Proyecto
+from urban_performance.projects.models import ProyectoStatus
+from urban_performance.projects.progress import finish_progress
+from urban_performance.projects.progress import get_progress
+from urban_performance.projects.progress import set_progress
+from urban_performance.projects.progress import start_progress
+from urban_performance.users.tests.factories import UserFactory
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture(autouse=True)
+def _cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
+class TestProgressStreamView:
+    def test_sends_one_event(self, proyecto, rf: RequestFactory):
+        start_progress(proyecto.pk, "scenarios")
+        set_progress(proyecto.pk, 40)
+        request = rf.get("/fake-url/")
+        request.user = proyecto.creado_por
+
+        response = ProgressStreamView.as_view()(request, proyecto_pk=proyecto.pk)
+
+        retry, event = response.content.decode().strip().split("\n\n")
+        assert retry == "retry: 2000"
+        name, data = event.split("\n")
+        assert name == "event: progress"
+        assert json.loads(data.removeprefix("data: ")) == {
+            "estatus": "PR",
+            "stage": "scenarios",
+            "percent": 40,
+        }
+
+    def test_other_users_get_404(self, proyecto, rf: RequestFactory):
+        request = rf.get("/fake-url/")
+        request.user = UserFactory()
+
+        with pytest.raises(Http404):
+            ProgressStreamView.as_view()(request, proyecto_pk=proyecto.pk)
+
+
+class _Signature:
+    def __init__(self):
+        self.calls = 0
+
+    def delay(self):
+        self.calls += 1
+
+
+def test_queue_processing_marks_project_before_the_task(
+    proyecto,
+    django_capture_on_commit_callbacks,
+):
+    Proyecto.objects.filter(pk=proyecto.pk).update(estatus=ProyectoStatus.READY)
+    finish_progress(proyecto.pk)
+    signature = _Signature()
+
+    with django_capture_on_commit_callbacks(execute=True):
+        queue_processing(proyecto.pk, signature)
+        # Queued only once the request commits
+        assert signature.calls == 0
+
+    assert signature.calls == 1
+    proyecto.refresh_from_db()
+    assert proyecto.estatus == ProyectoStatus.PROCESSING
+    state = get_progress(proyecto.pk)
+    assert state["estatus"] == ProyectoStatus.PROCESSING
+    assert state["percent"] == 0
@@ -8,6 +8,8 @@ from .views import (
     OpcionesView,
     BaseEscenarioViewSet,
     FilterUpControlsView,
+    FilterUpControlsBatchView,
+    ProgressStreamView,
 )
 
 app_name = "api"
@@ -30,6 +32,11 @@ urlpatterns = [
         ),
         name="proyecto-detail",
     ),
+    path(
+        "proyectos/<uuid:proyecto_pk>/progress/stream/",
+        ProgressStreamView.as_view(),
+        name="proyecto-progress-stream",
+    ),
     path(
         "proyectos/<uuid:proyecto_pk>/archivos-espaciales/",
         SpatialFileViewSet.as_view({"get": "list", "post": "create"}),
@@ -88,4 +95,9 @@ urlpatterns = [
         FilterUpControlsView.as_view(),
         name="filter-controls",
     ),
+    path(
+        "filter-controls/<uuid:proyecto_pk>/batch/",
+        FilterUpControlsBatchView.as_view(),
+        name="filter-controls-batch",
+    ),
 ]
@@ -1,7 +1,6 @@
 import csv
 import json
 import pandas as pd
-from celery import chain
 from rest_framework import viewsets
 from urban_performance.projects.models import (
     Proyecto,
@@ -19,22 +18,52 @@ from urban_performance.projects.serializers import (
     AssumptionsSerializer,
 )
 from urban_performance.projects.tasks import (
-    process_project_controls,
+    apply_assumptions,
+    ingest_and_process,
+    prefetch_scenarios,
+    reprocess_stale_partials,
     save_values,
     create_niveles,
-    urban_performance_partial,
 )
+from urban_performance.projects.cube import open_cube
+from urban_performance.projects.evaluator_cache import StalePartials, get_evaluator
+from urban_performance.projects.factors import open_factors
+from urban_performance.projects.lookup import (
+    InvalidLookup,
+    evaluate_key,
+    fetch_by_key,
+    fetch_filtered,
+    lookup_context,
+    parse_fields,
+    project_row,
+    resolve_scenarios,
+    scenario_deltas,
+    typed_conditions,
+)
+from urban_performance.projects.prefetch import should_prefetch
+from urban_performance.projects.result_cache import peek_result
+from urban_performance.projects.progress import get_progress, reset_progress
 from urban_performance.projects.utils import validate_assumptions_df
 from urban_performance.up_geo.serializers import SpatialFileSerializer
 from django.contrib import messages
-from django.db import connections
+from django.db import transaction
 from django.db.models import Q
-from django.http import HttpResponse, JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse
 from django.views.generic import View
 from rest_framework import status, response
 from django.utils.translation import gettext_lazy as _
 
 
+def queue_processing(proyecto_pk, signature):
+    """
+    Marks a project as processing and queues ``signature`` (a task or a
+    chain) once the request's transaction commits.
+    """
+    Proyecto.objects.filter(pk=proyecto_pk).update(estatus=ProyectoStatus.PROCESSING)
+    reset_progress(proyecto_pk)
+    transaction.on_commit(signature.delay)
+
+
 class ProyectoViewSet(viewsets.ModelViewSet):
     serializer_class = ProyectoSerializer
 
@@ -70,10 +99,10 @@ class ProyectoViewSet(viewsets.ModelViewSet):
                 csv_writer = csv.writer(csvfile)
                 csv_writer.writerows(row_list)
 
-            proyecto.estatus = ProyectoStatus.PROCESSING
-            proyecto.save()
-
-            chain(process_project_controls.s(proyecto_pk=proyecto.pk))()
+            # No geometry work: assumptions are applied at evaluation time
+            queue_processing(
+                proyecto.pk, apply_assumptions.si(proyecto_pk=proyecto.pk)
+            )
         return HttpResponse()
 
     def update(self, request, *args, **kwargs):
@@ -184,8 +213,12 @@ class ProyectoViewSet(viewsets.ModelViewSet):
                             )
                 else:
                     messages.error(request, "A valid zip file must be uploaded.")
-            if request.data.get("assumptions") or request.data.get("spatial_zip_file"):
-                chain(process_project_controls.s(proyecto_pk=proyecto.pk))()
+            if request.data.get("spatial_zip_file"):
+                queue_processing(proyecto.pk, ingest_and_process(proyecto.pk))
+            elif request.data.get("assumptions"):
+                queue_processing(
+                    proyecto.pk, apply_assumptions.si(proyecto_pk=proyecto.pk)
+                )
 
             messages.success(
                 request,
@@ -207,6 +240,62 @@ class SpatialFileViewSet(viewsets.ModelViewSet):
         else:
             return SpatialFile.objects.none()
 
+    def reprocess(self, proyecto):
+        # Only the partial results depending on the changed file are
+        # recomputed, see urban_performance.projects.incremental
+        queue_processing(proyecto.pk, ingest_and_process(proyecto.pk))
+
+    def perform_create(self, serializer):
+        spatial_file = serializer.save()
+        self.reprocess(spatial_file.proyecto)
+
+    def perform_update(self, serializer):
+        spatial_file = serializer.save()
+        self.reprocess(spatial_file.proyecto)
+
+    def perform_destroy(self, instance):
+        proyecto = instance.proyecto
+        # The option files are discovered from the project folder
+        instance.archivo.delete(save=False)
+        instance.delete()
+        self.reprocess(proyecto)
+
+
+class ProgressStreamView(View):
+    """
+    Server-Sent Events stream of the processing progress of a project.
+
+    Every response carries one ``progress`` event (``{"estatus", "stage",
+    "percent"}``) and ends, so it never holds a worker: the browser's
+    EventSource reconnects after ``retry_seconds`` by itself, and stops once
+    the project is no longer processing.
+    """
+
+    retry_seconds = 2
+
+    def get(self, request, *args, **kwargs):
+        proyecto_pk = kwargs["proyecto_pk"]
+        if not (
+            request.user.is_authenticated
+            and Proyecto.objects.filter(
+                pk=proyecto_pk, creado_por=request.user
+            ).exists()
+        ):
+            raise Http404
+        state = get_progress(proyecto_pk)
+        current = {
+            "estatus": state["estatus"],
+            "stage": state["stage"],
+            "percent": state["percent"],
+        }
+        response = HttpResponse(
+            f"retry: {self.retry_seconds * 1000}\n\n"
+            f"event: progress\ndata: {json.dumps(current)}\n\n",
+            content_type="text/event-stream",
+        )
+        response["Cache-Control"] = "no-cache"
+        return response
+
 
 class OpcionesView(viewsets.GenericViewSet):
     def get(self, *args, **kwargs):
@@ -280,30 +369,52 @@ class FilterUpControlsView(View):
             # Parse the JSON request body
             data = json.loads(request.body)
             proyecto_pk = kwargs.get("proyecto_pk")
+            fields = parse_fields(request.GET.get("fields"))
+
+            # Answered from the factor tables or the scenario cube when the
+            # project has them, without touching the database
+            store = open_factors(proyecto_pk) or open_cube(proyecto_pk)
+            store_key = store.key(data) if store else None
+            if store_key is not None:
+                row = store.row(store_key)
+                if row == []:
+                    return JsonResponse(
+                        {"error": "Scenario not in the project options"}, status=400
+                    )
+                if row is not None:
+                    return JsonResponse(
+                        {"results": [project_row(row, fields)]}, status=200
+                    )
 
-            # Start building the SQL query
-            sql_query = f"SELECT * FROM urban_performance_controls WHERE project_id='{proyecto_pk}' AND "
-            sql_conditions = []
-
-            # Add each dictionary element as a filter (key='value')
-            for key, value in data.items():
-                sql_conditions.append(f"""{key} = { f"'{value}'" }""")
-
-            # Combine the conditions with 'AND'
-            sql_query += " AND ".join(sql_conditions)
-            print(sql_query)
-
-            # Execute the raw SQL query
-            with connections["default"].cursor() as cursor:
-                cursor.execute(sql_query)
-                columns = [col[0] for col in cursor.description]
-                rows = cursor.fetchall()
-                [
-                    [],
-                ]
-
-            # Convert the result to a list of dictionaries
-            if not rows:
+            # Typed lookup: a complete scenario by its scenario_key (unique
+            # index), otherwise by the given controls. The controls and
+            # option codes are cached per project version
+            context = lookup_context(proyecto_pk)
+            conditions = typed_conditions(proyecto_pk, data, context.campos)
+            scenario_key = context.key(data)
+            if scenario_key is not None:
+                # Evaluated before (not stored then): no query at all
+                row = peek_result(proyecto_pk, scenario_key, context.version)
+                if row is None:
+                    results = fetch_by_key(proyecto_pk, scenario_key, fields)
+                elif row:
+                    results = [project_row(row, fields)]
+                else:
+                    return JsonResponse(
+                        {"error": "Scenario not in the project options"}, status=400
+                    )
+            else:
+                results = fetch_filtered(proyecto_pk, conditions, fields)
+
+            if not results and scenario_key is not None:
+                # Not stored yet: evaluated once, then served from the cache
+                row = evaluate_key(proyecto_pk, scenario_key, context.version)
+                if not row:
+                    return JsonResponse(
+                        {"error": "Scenario not in the project options"}, status=400
+                    )
+                results = [project_row(row, fields)]
+            elif not results:
                 scenario = (
                     data["population_"],
                     data["footprint"],
@@ -322,22 +433,65 @@ class FilterUpControlsView(View):
                     data["jobs"],
                     data["permeable_areas"],
                 )
-                proyecto = Proyecto.objects.get(pk=proyecto_pk)
-                assumptions = pd.read_csv(proyecto.assumptions.path)
-                assumptions = dict(zip(assumptions["code"], assumptions["value"]))
-                rows = [
-                    [0, proyecto_pk]
-                    + urban_performance_partial(
-                        scenario=scenario,
-                        proyecto_pk=proyecto_pk,
-                        proyecto=proyecto,
-                        assumptions=assumptions,
-                    )
+                evaluator = get_evaluator(proyecto_pk)
+                results = [
+                    project_row([0, proyecto_pk, *row, scenario_key], fields)
+                    for row in evaluator.scenario_rows([scenario])
                 ]
-            results = [dict(zip(columns, row)) for row in rows]
+                if not results:
+                    return JsonResponse(
+                        {"error": "Scenario not in the project options"}, status=400
+                    )
+            # The next lookup is most likely one control away
+            if scenario_key is not None and should_prefetch(
+                proyecto_pk, scenario_key, context.version
+            ):
+                prefetch_scenarios.delay(str(proyecto_pk), scenario_key)
             # Return the results as a JSON response
             return JsonResponse({"results": results}, status=200)
+        except InvalidLookup as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        except StalePartials:
+            # Answered again once the project is processed
+            reprocess_stale_partials(proyecto_pk)
+            return JsonResponse({"status": "processing"}, status=409)
+        except json.JSONDecodeError:
+            return JsonResponse({"error": "Invalid JSON"}, status=400)
+        except Exception as e:
+            return JsonResponse({"error": str(e)}, status=500)
+
+
+class FilterUpControlsBatchView(View):
+    """
+    Looks up several scenarios in one request, e.g. every scenario panel of
+    a project.
+
+    Body: ``{"scenarios": [controls, ...], "baseline": 0}``. Answers the rows
+    in order (``null`` for scenarios not in the project options) and the
+    difference of their indicators to the baseline scenario.
+    """
+
+    def post(self, request, *args, **kwargs):
+        try:
+            data = json.loads(request.body)
+            proyecto_pk = kwargs.get("proyecto_pk")
+            fields = parse_fields(request.GET.get("fields"))
+            scenarios = data.get("scenarios") if isinstance(data, dict) else None
+            if not isinstance(scenarios, list) or not scenarios:
+                return JsonResponse({"error": "Expected a list of scenarios"}, status=400)
+
+            results, keys = resolve_scenarios(proyecto_pk, scenarios, fields)
+            deltas = scenario_deltas(results, int(data.get("baseline", 0)))
+            for scenario_key in keys:
+                if scenario_key is not None and should_prefetch(proyecto_pk, scenario_key):
+                    prefetch_scenarios.delay(str(proyecto_pk), scenario_key)
+            return JsonResponse({"results": results, "deltas": deltas}, status=200)
         except json.JSONDecodeError:
             return JsonResponse({"error": "Invalid JSON"}, status=400)
+        except (InvalidLookup, TypeError, ValueError) as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        except StalePartials:
+            reprocess_stale_partials(proyecto_pk)
+            return JsonResponse({"status": "processing"}, status=409)
         except Exception as e:
             return JsonResponse({"error": str(e)}, status=500)
@@ -1,5 +1,6 @@
 import pytest
 
+from urban_performance.projects.models import Proyecto
 from urban_performance.users.models import User
 from urban_performance.users.tests.factories import UserFactory
 
@@ -12,3 +13,14 @@ def _media_storage(settings, tmpdir) -> None:
 @pytest.fixture()
 def user(db) -> User:
     return UserFactory()
+
+
+@pytest.fixture()
+def proyecto(user) -> Proyecto:
+    return Proyecto.objects.create(
+        creado_por=user,
+        nombre="Test",
+        descripcion="",
+        ciudad="Test",
+        assumptions="assumptions_SP.csv",
+    )
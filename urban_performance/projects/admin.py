@@ -1,9 +1,102 @@
+import json
+
 from django.contrib import admin
-from .models import Proyecto, Control, Indicador, Escenario
+from django.http import HttpResponse
+from django.utils.html import format_html_join
+from .models import (
+    Proyecto,
+    ProyectoStatus,
+    ProcessingRun,
+    ControlOption,
+    Control,
+    Indicador,
+    Escenario,
+)
+from .progress import reset_progress
+from .tasks import ingest_and_process
 
 
 class ProyectoAdmin(admin.ModelAdmin):
-    pass
+    actions = ["apply_geometry_settings"]
+
+    @admin.action(description="Apply geometry settings and reprocess")
+    def apply_geometry_settings(self, request, queryset):
+        for proyecto in queryset:
+            Proyecto.objects.filter(pk=proyecto.pk).update(
+                estatus=ProyectoStatus.PROCESSING
+            )
+            reset_progress(proyecto.pk)
+            ingest_and_process(proyecto.pk).delay()
+
+
+class ProcessingRunAdmin(admin.ModelAdmin):
+    list_display = [
+        "proyecto",
+        "creado_el",
+        "wall_time",
+        "cpu_time",
+        "computed",
+        "reused",
+        "hottest_stage",
+    ]
+    list_filter = ["proyecto"]
+    readonly_fields = [
+        "proyecto",
+        "creado_el",
+        "wall_time",
+        "cpu_time",
+        "computed",
+        "reused",
+        "stages_table",
+        "nodes_table",
+    ]
+    exclude = ["stages", "nodes"]
+    actions = ["export_json"]
+
+    @admin.display(description="Hottest stage")
+    def hottest_stage(self, obj):
+        for name, total in obj.stages.items():
+            return f"{name} ({total['wall']:.1f}s)"
+        return "-"
+
+    @admin.display(description="Stages")
+    def stages_table(self, obj):
+        return format_html_join(
+            "\n",
+            "<div>{}: {} calls, {:.2f}s wall, {:.2f}s cpu</div>",
+            (
+                (name, total["count"], total["wall"], total["cpu"])
+                for name, total in obj.stages.items()
+            ),
+        )
+
+    @admin.display(description="Slowest nodes")
+    def nodes_table(self, obj):
+        nodes = sorted(obj.nodes, key=lambda node: node["wall"], reverse=True)
+        return format_html_join(
+            "\n",
+            "<div>{:.2f}s wall, {:.2f}s cpu: {}</div>",
+            ((node["wall"], node["cpu"], node["name"]) for node in nodes[:20]),
+        )
+
+    @admin.action(description="Export as JSON")
+    def export_json(self, request, queryset):
+        runs = [
+            {
+                "proyecto": str(run.proyecto_id),
+                "creado_el": run.creado_el.isoformat(),
+                "wall_time": run.wall_time,
+                "cpu_time": run.cpu_time,
+                "reused": run.reused,
+                "computed": run.computed,
+                "stages": run.stages,
+                "nodes": run.nodes,
+            }
+            for run in queryset
+        ]
+        response = HttpResponse(json.dumps(runs), content_type="application/json")
+        response["Content-Disposition"] = 'attachment; filename="processing_runs.json"'
+        return response
 
 
 class ControlAdmin(admin.ModelAdmin):
@@ -18,7 +111,14 @@ class EscenarioAdmin(admin.ModelAdmin):
     pass
 
 
+class ControlOptionAdmin(admin.ModelAdmin):
+    list_display = ["proyecto", "campo", "codigo", "valor"]
+    list_filter = ["campo"]
+
+
 admin.site.register(Proyecto, ProyectoAdmin)
+admin.site.register(ProcessingRun, ProcessingRunAdmin)
+admin.site.register(ControlOption, ControlOptionAdmin)
 admin.site.register(Control, ControlAdmin)
 admin.site.register(Indicador, IndicadorAdmin)
 admin.site.register(Escenario, EscenarioAdmin)
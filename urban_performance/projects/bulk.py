@@ -0,0 +1,109 @@
+import time
+from uuid import UUID
+
+from django.db import connection, transaction
+from psycopg import sql
+
+from urban_performance.projects.evaluator import CONTROL_COLUMNS, INDICATOR_COLUMNS
+
+# Scenario rows are written to urban_performance_controls in two statements:
+# a binary COPY into a temporary staging table (no SQL parsing per row and no
+# index maintenance) and a single INSERT ... SELECT ... ON CONFLICT merging
+# the staging rows into the target, or into the result set being built by a
+# run (see partitions.py). Rows of a chunk delivered twice are merged, never
+# duplicated. Values are sent typed, never formatted into the SQL.
+
+TARGET_TABLE = "urban_performance_controls"
+STAGING_TABLE = "urban_performance_controls_staging"
+
+# Column types of urban_performance_controls, see ddl.sql
+COLUMNS = [
+    ("project_id", "uuid"),
+    ("scenario_key", "int8"),
+    *[
+        (name, "float8" if name in ["energy_efficiency", "solar_energy"] else "text")
+        for name in CONTROL_COLUMNS
+    ],
+    *[(name, "float8") for name in INDICATOR_COLUMNS],
+]
+
+# The unique index the merge resolves conflicts on (result sets have it too)
+CONFLICT_COLUMNS = ["project_id", "scenario_key"]
+
+
+def _identifiers(names):
+    return sql.SQL(", ").join(sql.Identifier(name) for name in names)
+
+
+def _create_staging(cursor):
+    # Kept for the whole session, emptied at the end of every transaction
+    cursor.execute(
+        sql.SQL(
+            "CREATE TEMP TABLE IF NOT EXISTS {} ({}) ON COMMIT DELETE ROWS"
+        ).format(
+            sql.Identifier(STAGING_TABLE),
+            sql.SQL(", ").join(
+                sql.SQL("{} {}").format(sql.Identifier(name), sql.SQL(type_name))
+                for name, type_name in COLUMNS
+            ),
+        )
+    )
+
+
+def _merge_query(table: str):
+    names = [name for name, _ in COLUMNS]
+    updates = [name for name in names if name not in CONFLICT_COLUMNS]
+    return sql.SQL(
+        "INSERT INTO {target} ({columns}) SELECT {columns} FROM {staging} "
+        "ON CONFLICT ({conflict}) DO UPDATE SET {updates}"
+    ).format(
+        target=sql.Identifier(table),
+        staging=sql.Identifier(STAGING_TABLE),
+        columns=_identifiers(names),
+        conflict=_identifiers(CONFLICT_COLUMNS),
+        updates=sql.SQL(", ").join(
+            sql.SQL("{0} = EXCLUDED.{0}").format(sql.Identifier(name))
+            for name in updates
+        ),
+    )
+
+
+def _typed(proyecto_pk, row) -> list:
+    values = [UUID(str(proyecto_pk)), int(row[0])]
+    for (_, type_name), value in zip(COLUMNS[2:], row[1:], strict=True):
+        values.append(float(value) if type_name == "float8" else str(value))
+    return values
+
+
+def copy_controls(proyecto_pk, rows, table: str = None) -> dict:
+    """
+    Upserts scenario rows (as built by ``CompiledEvaluator.rows`` with keys,
+    without the project id) into urban_performance_controls, or into the
+    result set ``table``.
+
+    Returns:
+        ``{"rows", "seconds", "rows_per_second"}``.
+    """
+    started = time.perf_counter()
+    count = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        _create_staging(cursor)
+        # The psycopg cursor behind Django's wrapper
+        raw = cursor.cursor
+        copy_query = sql.SQL("COPY {} ({}) FROM STDIN (FORMAT BINARY)").format(
+            sql.Identifier(STAGING_TABLE),
+            _identifiers(name for name, _ in COLUMNS),
+        )
+        with raw.copy(copy_query) as copy:
+            copy.set_types([type_name for _, type_name in COLUMNS])
+            for row in rows:
+                copy.write_row(_typed(proyecto_pk, row))
+                count += 1
+        if count:
+            raw.execute(_merge_query(table or TARGET_TABLE))
+    seconds = time.perf_counter() - started
+    return {
+        "rows": count,
+        "seconds": seconds,
+        "rows_per_second": count / seconds if seconds else 0.0,
+    }
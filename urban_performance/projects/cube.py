@@ -0,0 +1,185 @@
+import json
+import os
+import threading
+
+import numpy as np
+from django.conf import settings
+
+from urban_performance.projects.evaluator import (
+    INDICATOR_COLUMNS,
+    INTEGER_COLUMNS,
+    encode_scenario,
+    option_codes,
+)
+
+# Optional dense storage of every scenario of a project (SCENARIO_CUBE
+# setting), next to urban_performance_controls:
+#
+#   projects/<uuid>/.scenarios/<name>.values.npy   (scenarios, indicators) float64
+#   projects/<uuid>/.scenarios/<name>.state.npy    (scenarios,) uint8, see below
+#   projects/<uuid>/.scenarios/current.json        name and option lists
+#
+# Rows are ordered by scenario_key, so a lookup is index arithmetic on a
+# read-only memory map: the pages are shared by every process reading the
+# project through the OS page cache. Chunk tasks write their slice as they
+# finish; rows not written yet read as NOT_WRITTEN and are answered from the
+# database as before.
+
+CUBE_DIR = ".scenarios"
+POINTER = "current.json"
+
+# state.npy values
+NOT_WRITTEN = 0
+VALID = 1
+REJECTED = 2
+
+
+def cube_folder(proyecto_pk) -> str:
+    # Same folder as Proyecto.get_folder_path, without a query
+    return os.path.join(settings.MEDIA_ROOT, "projects", str(proyecto_pk), CUBE_DIR)
+
+
+def _paths(folder: str, name: str):
+    return (
+        os.path.join(folder, f"{name}.values.npy"),
+        os.path.join(folder, f"{name}.state.npy"),
+    )
+
+
+def create_cube(proyecto_pk, name: str, options: list) -> str:
+    """
+    Allocates an empty cube for ``options`` and points readers to it.
+
+    The files are created sparse (zero filled), older cubes of the project
+    are removed. Returns ``name``, or ``None`` when there are no scenarios.
+    """
+    folder = cube_folder(proyecto_pk)
+    total = int(np.prod([len(values) for values in options]))
+    if not total:
+        return None
+    os.makedirs(folder, exist_ok=True)
+    values_path, state_path = _paths(folder, name)
+    np.lib.format.open_memmap(
+        values_path, mode="w+", dtype=np.float64, shape=(total, len(INDICATOR_COLUMNS))
+    ).flush()
+    np.lib.format.open_memmap(state_path, mode="w+", dtype=np.uint8, shape=(total,)).flush()
+
+    pointer = os.path.join(folder, POINTER)
+    with open(pointer + ".tmp", "w") as f:
+        json.dump({"name": name, "options": options, "columns": INDICATOR_COLUMNS}, f)
+    os.replace(pointer + ".tmp", pointer)
+
+    keep = {os.path.basename(path) for path in _paths(folder, name)}
+    for filename in os.listdir(folder):
+        if filename.endswith(".npy") and filename not in keep:
+            os.remove(os.path.join(folder, filename))
+    return name
+
+
+def write_block(proyecto_pk, name: str, start: int, values, valid):
+    """
+    Stores the indicators of the scenarios numbered from ``start`` on
+    (``values`` as returned by CompiledEvaluator.block).
+    """
+    values_path, state_path = _paths(cube_folder(proyecto_pk), name)
+    if not os.path.exists(values_path):
+        # Replaced by a newer run
+        return
+    stop = start + len(valid)
+    cube = np.load(values_path, mmap_mode="r+")
+    cube[start:stop] = values
+    cube.flush()
+    state = np.load(state_path, mmap_mode="r+")
+    state[start:stop] = np.where(valid, VALID, REJECTED)
+    state.flush()
+
+
+def discard_cube(proyecto_pk):
+    """
+    Stops serving the project from its cube, e.g. when its partial results
+    or assumptions changed.
+    """
+    try:
+        os.remove(os.path.join(cube_folder(proyecto_pk), POINTER))
+    except FileNotFoundError:
+        pass
+
+
+class ScenarioCube:
+    """
+    Read-only view of a project's cube.
+    """
+
+    def __init__(self, proyecto_pk, folder: str, pointer: dict):
+        self.proyecto_pk = str(proyecto_pk)
+        self.options = pointer["options"]
+        self.radices = [len(values) for values in self.options]
+        self.codes = option_codes(self.options)
+        values_path, state_path = _paths(folder, pointer["name"])
+        self.values = np.load(values_path, mmap_mode="r")
+        self.state = np.load(state_path, mmap_mode="r")
+
+    def key(self, data: dict):
+        """
+        Returns the scenario_key of ``data`` (control column -> option), or
+        ``None`` if it is not a complete scenario of the options.
+        """
+        return encode_scenario(self.options, self.codes, data)
+
+    def row(self, key: int):
+        """
+        Returns the scenario as a urban_performance_controls row (``id`` is
+        0), ``[]`` if the scalar path rejects it, or ``None`` if it was not
+        written yet.
+        """
+        state = self.state[key]
+        if state == NOT_WRITTEN:
+            return None
+        if state == REJECTED:
+            return []
+        labels = []
+        rest = key
+        for d in range(len(self.radices) - 1, -1, -1):
+            rest, code = divmod(rest, self.radices[d])
+            labels.append(self.options[d][code])
+        indicators = [
+            int(value) if name in INTEGER_COLUMNS else value
+            for name, value in zip(
+                INDICATOR_COLUMNS, self.values[key].tolist(), strict=True
+            )
+        ]
+        return [0, self.proyecto_pk, *reversed(labels), *indicators, key]
+
+
+_cubes = {}
+_lock = threading.Lock()
+
+
+def open_cube(proyecto_pk):
+    """
+    Returns the project's ScenarioCube, or ``None`` if it has none.
+
+    Maps are kept per process and reopened when the pointer file changes, so
+    checking for a new cube costs one ``stat``.
+    """
+    if not settings.SCENARIO_CUBE:
+        return None
+    folder = cube_folder(proyecto_pk)
+    pointer = os.path.join(folder, POINTER)
+    try:
+        mtime = os.stat(pointer).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    with _lock:
+        cached = _cubes.get(str(proyecto_pk))
+        if cached and cached[0] == mtime:
+            return cached[1]
+    try:
+        with open(pointer) as f:
+            cube = ScenarioCube(proyecto_pk, folder, json.load(f))
+    except (OSError, ValueError):
+        # Replaced while reading
+        return None
+    with _lock:
+        _cubes[str(proyecto_pk)] = (mtime, cube)
+    return cube
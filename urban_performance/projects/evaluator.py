@@ -0,0 +1,897 @@
+import numpy as np
+
+# Scenario dimensions, in the order of the scenario tuples and of the
+# urban_performance_controls columns.
+CONTROL_COLUMNS = [
+    "population_",
+    "footprint",
+    "transit",
+    "nbs",
+    "energy_efficiency",
+    "solar_energy",
+    "rwh",
+    "hospitals",
+    "schools",
+    "sport_centers",
+    "clinics",
+    "daycare",
+    "green_areas",
+    "infrastructure",
+    "jobs",
+    "permeable_areas",
+]
+
+# Values returned by indicators(), in order.
+INDICATOR_COLUMNS = [
+    "fp_area",
+    "fp_base_area",
+    "pop_2050",
+    "pop_base",
+    "exposed_area",
+    "pc_exposed_tr",
+    "pc_exposed_hp",
+    "pc_exposed_sc",
+    "pc_exposed_infra",
+    "inter_pop",
+    "pc_exposed_pop",
+    "pc_pop_hp",
+    "pc_pop_sc",
+    "pc_pop_sp",
+    "pc_pop_cl",
+    "pc_pop_dc",
+    "pc_pop_uga",
+    "pop_density",
+    "urban_expansion_area",
+    "jobs_density",
+    "vg_area_loss",
+    "permeable_area",
+    "change_electricity_consumption",
+    "electricity_consumption",
+    "electricity_consumption_buildings",
+    "electricity_consumption_ee",
+    "electricity_consumption_ee_per_capita",
+    "emissions_tot_tr",
+    "transport_emissions_per_capita",
+    "solar_energy_generation",
+    "public_lighting_energy_consumption",
+    "maintenance_fp",
+    "maintenance_tr",
+    "maintenance_cost",
+    "school_c_cost",
+    "new_sc",
+    "hospital_c_cost",
+    "new_hp",
+    "sp_c_cost",
+    "new_sp",
+    "clinic_c_cost",
+    "new_cl",
+    "daycare_c_cost",
+    "new_dc",
+    "ga_c_cost",
+    "capital_cost",
+    "capital_solar_1",
+    "capital_solar",
+    "uga_area",
+    "uga_per_capita",
+    "increased_kvr",
+    "expected_vmt",
+    "increase_bicycle",
+    "increase_private",
+    "increase_public_transport",
+    "pc_media_hu",
+    "pc_popular_hu",
+    "pc_residencial_hu",
+    "water_consumption",
+    "energy_consumption_water_supply",
+]
+
+# Counts, returned as int like the scalar path does
+INTEGER_COLUMNS = {"new_sc", "new_hp", "new_sp", "new_cl", "new_dc"}
+
+# Parameters for simulation
+ENERGY_EFFICIENCY = [0, 20, 40]
+SOLAR_ENERGY = [0, 8.4, 5]
+RWH = [0, 50]
+
+# Dimensions holding a number instead of an option file
+NUMERIC_DIMENSIONS = {4, 5, 6}
+
+HOUSING_TYPES = ["Media_hu", "Popular_hu", "Residencial_hu"]
+
+# Assumptions used as divisors by indicators()
+ZERO_DIVISORS = ["return_period", "mw_capacity", "distance_between_lamps"]
+
+
+def indicators(m: dict, base: dict, assumptions: dict) -> list:
+    """
+    Derives every indicator of a scenario from its measurements.
+
+    Shared by the scalar path (urban_performance_partial, one scenario of
+    Python numbers) and the compiled evaluator (NumPy arrays holding a block
+    of scenarios), so both run the very same operations in the same order.
+
+    Args:
+        m: Measurements of the scenario, see CompiledEvaluator.measurements.
+        base: ``density_base``, ``fp_base_area``, ``pop_base`` and
+            ``base_counts`` from partial_processing.
+        assumptions: assumptions_SP.csv as a code -> value dict.
+
+    Returns:
+        The values of INDICATOR_COLUMNS.
+    """
+    pop_2050 = m["pop_2050"]
+    fp_area = m["fp_area"]
+    uga_area = m["uga_area"]
+    total_hp = m["total_hp"]
+    total_sc = m["total_sc"]
+    total_sp = m["total_sp"]
+    total_cl = m["total_cl"]
+    total_dc = m["total_dc"]
+    density_base = base["density_base"]
+    base_counts = base["base_counts"]
+
+    # ASSUMPTIONS  |||||||||||||||||||||||||||||||||||||||||
+    # The partial results only hold measurements, everything depending on
+    # assumptions_SP.csv is derived here.
+
+    # Flooding risk
+    exposure_factor = assumptions["recontruction_cost"]
+    return_period = assumptions["return_period"]
+    reconstruction_cost = (m["exposed_pop"] * exposure_factor) / return_period
+
+    # Green areas
+    ga_c_cost = uga_area * assumptions["ga_c_cost"] * 1e6
+    ga_m_cost = uga_area * assumptions["ga_m_cost"] * 1e6
+
+    # Amenities: new facilities over the base layers and their costs
+    new_hp = total_hp - base_counts["hospitals"]
+    hospital_c_cost = new_hp * assumptions["hp_c_cost"]
+    hospital_m_cost = total_hp * assumptions["hp_m_cost"]
+    new_sc = total_sc - base_counts["schools"]
+    school_c_cost = new_sc * assumptions["sc_c_cost"]
+    school_m_cost = total_sc * assumptions["sc_m_cost"]
+    new_sp = total_sp - base_counts["sports"]
+    sport_c_cost = new_sp * assumptions["pk_c_cost"]
+    sport_m_cost = total_sp * assumptions["pk_m_cost"]
+    new_cl = total_cl - base_counts["clinics"]
+    clinic_c_cost = new_cl * assumptions["hp_c_cost"]  # CAMBIAR clinics
+    clinic_m_cost = total_cl * assumptions["hp_m_cost"]
+    new_dc = total_dc - base_counts["daycare"]
+    daycare_c_cost = new_dc * assumptions["dc_c_cost"]
+    daycare_m_cost = total_dc * assumptions["dc_m_cost"]
+
+    # Solar energy
+    fp_solar_area = (fp_area * (m["solar_energy"] / 100)) * 1000000
+    # Installed capacity
+    installed_capacity = assumptions["solar_panel_factor"] * fp_solar_area
+    # Calculate the potential solar energy generation
+    solar_energy_generation = (
+        installed_capacity * assumptions["solar_energy"]
+    )  # kWh/year
+    sol_gen_GWh = solar_energy_generation / 1000000
+    energy_capacity = sol_gen_GWh / (assumptions["mw_capacity"] * 1000)
+    capital_solar_1 = assumptions["mw_cost"] * energy_capacity
+    # Total capital cost for solar energy
+    capital_solar = (assumptions["pv_incentive"] / 100) * capital_solar_1
+
+    # Public lighting
+    public_lighting_energy_consumption = (
+        m["roads_length"]
+        / assumptions["distance_between_lamps"]
+        * assumptions["consumption_per_lamp"]
+    )  # total consumption for public lightning
+    cost_public_lighting = (
+        public_lighting_energy_consumption * assumptions["cost_per_kW"]
+    )  # total cost for public lightning
+
+    # Footprint costs
+    maintenance_fp = fp_area * assumptions["mantainance_expansion_cost_a"]
+    maintenance_fp = (maintenance_fp * (2050 - 2025)) / 1e6
+    capital_fp = m["urban_expansion_area"] * assumptions["expansion_cost_a"]
+
+    # Transit costs
+    maintenance_tr = m["tr_length"] * assumptions["mantainance_transit_cost_a"]
+    maintenance_tr = maintenance_tr * (2050 - 2025) / 1e6
+    capital_tr = m["dif_tr_length"] * assumptions["transit_cost_a"]
+
+    # Water consumption and energy to supply what rain water harvesting
+    # does not cover
+    water_assumptions = {
+        "Media_hu": assumptions["media_hu_water_cons"],
+        "Popular_hu": assumptions["popular_hu_water_cons"],
+        "Residencial_hu": assumptions["residencial_hu_water_cons"],
+    }
+    water_consumption = 0
+    energy_consumption_water_supply = 0
+    for housing_type in sorted(water_assumptions):
+        housing_water = m["housing_units"][housing_type] * water_assumptions[housing_type]
+        other_sources = housing_water - housing_water * (m["rwh"] / 100)
+        water_consumption += housing_water
+        energy_consumption_water_supply += other_sources * assumptions["water_energy"]
+    water_consumption = water_consumption * 4 * 1000 / (pop_2050 * 365)
+
+    # Calculate intermediary results
+    density = pop_2050 / fp_area
+    density_change = (density - density_base) / density_base
+
+    # Electricity consumption
+    elasticity_energy = assumptions["elasticity_energy"]
+    energy_consumption_base = assumptions["energy_consumption_base"]
+    energy_buildings_percentage = assumptions["energy_buildings_percentage"]
+    change_electricity_consumption = -density_change * elasticity_energy
+    electricity_consumption = energy_consumption_base * (
+        1 + change_electricity_consumption / 100
+    )
+    electricity_consumption_buildings = electricity_consumption * (
+        energy_buildings_percentage / 100
+    )
+
+    energy_used_ee = 100 - m["energy_efficiency"]
+    electricity_consumption_ee_b = electricity_consumption_buildings * (
+        energy_used_ee / 100
+    )
+    electricity_consumption_ee = electricity_consumption_ee_b + (
+        electricity_consumption - electricity_consumption_buildings
+    )
+    electricity_consumption_ee_per_capita = electricity_consumption_ee / pop_2050
+
+    # GHG emissions
+    emissions_factor = assumptions["emissions_factor"]
+    elasticity_emission = assumptions["elasticity_emissions"]
+    emissions_transport_percentage = assumptions["emissions_transport_percentage"]
+    ec_base_with_ee = energy_consumption_base * (energy_used_ee / 100)
+    emissions_base_ee = ec_base_with_ee * emissions_factor
+    change_in_emissions = -density_change * elasticity_emission
+    emissions = emissions_base_ee * (1 + change_in_emissions / 100)
+    emissions_tr = emissions * emissions_transport_percentage / 21
+    # emissions_tr = emissions * (emissions_transport_percentage / 100)
+    emissions_pc = emissions_tr / pop_2050
+    pop_tr_adjust = pop_2050 * (m["dif_tr_buffer_area"] / fp_area)
+    pop_other_adjust = pop_2050 - pop_tr_adjust
+    emissions_tot_tr = (pop_tr_adjust * (emissions_pc * 0.75)) + (
+        pop_other_adjust * emissions_pc
+    )
+    # emissions_tot_tr = (pop_2050 - tr_buffer_area / fp_area * pop_2050 * 0.15) * emissions_pc + tr_buffer_area / fp_area * pop_2050 * emissions_pc * 0.85
+    transport_emissions_per_capita = emissions_tot_tr / pop_2050
+
+    # VMT
+    kvr_factor = assumptions["kvr"]
+    VMT = assumptions["vmt"]
+    expected_change = -density_change * VMT
+    expected_vmt = kvr_factor * (1 + expected_change / 100)
+
+    # Modal Distribution (KVR)
+    modal_distribution_elasticity = assumptions["md_elasticity"]
+    md_private = assumptions["md_tr"]
+    md_public_transport = assumptions["md_w"]
+    md_bicycle = assumptions["md_b"]
+    expected_change_modal_distribution = density_change * modal_distribution_elasticity
+    increase_public_transport = (
+        md_public_transport - expected_change_modal_distribution * md_public_transport
+    )
+    public_tra_change = md_public_transport - increase_public_transport
+    increase_bicycle = md_bicycle - expected_change_modal_distribution * md_bicycle
+    increase_private = md_private - public_tra_change - increase_bicycle
+
+    # Maintenance and Capital Costs
+    maintenance_cost = (
+        maintenance_fp
+        + maintenance_tr
+        + hospital_m_cost
+        + school_m_cost
+        + sport_m_cost
+        + clinic_m_cost
+        + daycare_m_cost
+        + ga_m_cost
+        + cost_public_lighting
+        + reconstruction_cost
+    ) / 1e6
+    capital_cost = (
+        capital_fp
+        + capital_tr
+        + capital_solar
+        + hospital_c_cost
+        + school_c_cost
+        + sport_c_cost
+        + clinic_c_cost
+        + daycare_c_cost
+        + ga_c_cost
+    ) / 1e6
+
+    return [
+        fp_area,  # footprint area
+        base["fp_base_area"],  # base footprint area
+        pop_2050,  # population 2050
+        base["pop_base"],  # base population
+        m["exposed_area"],  # area exposed to hazards #CHANGE
+        m["pc_exposed_tr"],  # percentage of roads exposed to hazards
+        m["count_hp_exposed"] * 100 / total_hp,  # percentage of hospitals exposed to hazards
+        m["count_sc_exposed"] * 100 / total_sc,  # percentage of schools exposed to hazards
+        m["pc_exposed_infra"],  # percentage of infrastructure exposed to hazards
+        m["exposed_pop"],  # total population exposed to hazards #CHANGE
+        m["pc_exposed_pop"],  # percentage of population exposed to hazards
+        m["pc_pop_hp"],  # percentage of population near a hospital
+        m["pc_pop_sc"],  # percentage of population near a school
+        m["pc_pop_sp"],  # percentage of population near a sport center
+        m["pc_pop_cl"],  # percentage of population near a clinic
+        m["pc_pop_dc"],  # percentage of population near a daycare
+        m["pc_pop_uga"],  # percentage of population near a green area
+        density,  # hab/km2
+        m["urban_expansion_area"],  # urban expansion area
+        m["jobs_density"],  # jobs/km2
+        m["vg_area_loss"],  # vegetation cover loss #CHANGE
+        m["permeable_area"],  # permeable areas
+        change_electricity_consumption,  # expected change in electricity consumption due to population density
+        electricity_consumption,  # electricity consumption
+        electricity_consumption_buildings,  # electricity consumption with buildings #CHANGE
+        electricity_consumption_ee,  # electricity consumption with EE #CHANGE
+        electricity_consumption_ee_per_capita,  # electricity consumption with EE per capita #CHANGE
+        emissions_tot_tr,  # GHG emissions transport sector
+        transport_emissions_per_capita,  # GHG emissions transport sector per capita #CHANGE
+        solar_energy_generation / 1e6,  # potential solar energy generation
+        public_lighting_energy_consumption / 1e6,  # public lighting energy consumption
+        maintenance_fp / 1e6,  # maintenance cost footprint
+        maintenance_tr / 1e6,  # maintenance cost transit
+        maintenance_cost,  # maintenance cost total
+        school_c_cost / 1e6,  # school capital cost
+        new_sc,  # total number of new schools
+        hospital_c_cost / 1e6,  # hospital capital cost
+        new_hp,  # total number of new hospitals
+        sport_c_cost / 1e6,  # sport center capital cost
+        new_sp,  # total number of new sport centers
+        clinic_c_cost / 1e6,  # clinic capital cost
+        new_cl,  # total number of new clinics
+        daycare_c_cost / 1e6,  # daycare center capital cost
+        new_dc,  # total number of new daycare
+        ga_c_cost / 1e6,  # green area capital cost
+        capital_cost,  # capital cost total
+        capital_solar_1,
+        capital_solar,
+        uga_area,  # total green area
+        m["uga_per_capita"],  # green area per capita #CHANGE
+        kvr_factor * (1 + expected_change / 100),  # expected Modal Distribution (KVR)
+        expected_vmt,  # VKT #CHANGE
+        increase_bicycle,  # bicycle modal distribution
+        increase_private,  # private vehicles modal distribution
+        increase_public_transport,  # public transport modal distribution
+        m["pc_media_hu"],  # percentage of media housing type
+        m["pc_popular_hu"],  # percentage of popular housing type
+        m["pc_residencial_hu"],  # percentage of residential housing type
+        water_consumption,  # total water consumption
+        energy_consumption_water_supply,  # total energy water supply
+    ]
+
+
+def scenario_key(radices, codes) -> int:
+    """
+    Combines the option codes (positions) of a scenario into its number,
+    last dimension varying fastest.
+    """
+    key = 0
+    for radix, code in zip(radices, codes, strict=True):
+        key = key * radix + code
+    return key
+
+
+def option_codes(options: list) -> list:
+    """
+    Maps every option (as text) to its code, per dimension.
+    """
+    return [{str(value): code for code, value in enumerate(values)} for values in options]
+
+
+def encode_scenario(options: list, codes: list, data: dict):
+    """
+    Returns the scenario_key of ``data`` (control column -> option), or
+    ``None`` if it is not a complete scenario of ``options``.
+
+    Args:
+        options: Option lists in CONTROL_COLUMNS order.
+        codes: ``option_codes(options)``.
+        data: Request data; numeric controls may come as text or numbers.
+    """
+    scenario = []
+    for d, campo in enumerate(CONTROL_COLUMNS):
+        if campo not in data:
+            return None
+        value = data[campo]
+        if d in NUMERIC_DIMENSIONS:
+            # 8.4, "8.4" and "8.40" are the same option
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                return None
+            code = next((c for v, c in codes[d].items() if float(v) == value), None)
+        else:
+            code = codes[d].get(str(value))
+        if code is None:
+            return None
+        scenario.append(code)
+    return scenario_key([len(values) for values in options], scenario)
+
+
+def scenario_measurements(partial_processing: dict, scenario) -> dict:
+    """
+    Looks up the measurements of one scenario tuple in partial_processing.
+
+    Raises ``KeyError`` when an option of the scenario was not preprocessed.
+    """
+    partial_pop = partial_processing["partial_pop"]
+    partial_fp = partial_processing["partial_fp"]
+    partial_tr = partial_processing["partial_tr"]
+    partial_perm = partial_processing["partial_perm"]
+    (pop, fp, tr, nbs, EE, solar, rwh, hp, sc, sp, cl, dc, uga, inf, jobs, perm) = (
+        scenario
+    )
+
+    (
+        pop_2050,
+        partial_nbs,
+        partial_hp,
+        partial_sc,
+        partial_sp,
+        partial_cl,
+        partial_dc,
+        partial_UGA,
+        partial_ht,
+    ) = partial_pop[pop]
+    (
+        exposed_area,
+        exposed_pop,
+        partial_nbs_tr,
+        partial_nbs_hp,
+        partial_nbs_sc,
+        partial_nbs_infra,
+        pc_exposed_pop,
+        nbs_area,
+    ) = partial_nbs[nbs]
+    uga_area, uga_per_capita, pc_pop_uga = partial_UGA[uga]
+    (
+        fp_area,
+        fp_sc,
+        fp_hp,
+        fp_sp,
+        fp_cl,
+        fp_dc,
+        urban_expansion_area,
+        fp_jobs,
+        vg_area_loss,
+        roads_length,
+    ) = partial_fp[fp]
+    dif_tr_buffer_area, tr_buffer_area, tr_length, dif_tr_length = partial_tr[tr]
+    return {
+        "pop_2050": pop_2050,
+        "exposed_area": exposed_area,
+        "exposed_pop": exposed_pop,
+        "pc_exposed_pop": pc_exposed_pop,
+        "pc_exposed_tr": partial_nbs_tr[tr],
+        "count_hp_exposed": partial_nbs_hp[hp],
+        "count_sc_exposed": partial_nbs_sc[sc],
+        "pc_exposed_infra": partial_nbs_infra[inf],
+        "pc_pop_hp": partial_hp[hp],
+        "pc_pop_sc": partial_sc[sc],
+        "pc_pop_sp": partial_sp[sp],
+        "pc_pop_cl": partial_cl[cl],
+        "pc_pop_dc": partial_dc[dc],
+        "uga_area": uga_area,
+        "uga_per_capita": uga_per_capita,
+        "pc_pop_uga": pc_pop_uga,
+        "pc_media_hu": partial_ht["Media_hu"],
+        "pc_popular_hu": partial_ht["Popular_hu"],
+        "pc_residencial_hu": partial_ht["Residencial_hu"],
+        "housing_units": partial_ht["units"],
+        "fp_area": fp_area,
+        "total_sc": fp_sc[sc],
+        "total_hp": fp_hp[hp],
+        "total_sp": fp_sp[sp],
+        "total_cl": fp_cl[cl],
+        "total_dc": fp_dc[dc],
+        "urban_expansion_area": urban_expansion_area,
+        "jobs_density": fp_jobs[jobs],
+        "vg_area_loss": vg_area_loss,
+        "roads_length": roads_length,
+        "dif_tr_buffer_area": dif_tr_buffer_area,
+        "tr_length": tr_length,
+        "dif_tr_length": dif_tr_length,
+        "permeable_area": partial_perm[perm],
+        "energy_efficiency": EE,
+        "solar_energy": float(solar),
+        "rwh": float(rwh),
+    }
+
+
+def base_values(partial_processing: dict) -> dict:
+    return {
+        key: partial_processing[key]
+        for key in ["density_base", "fp_base_area", "pop_base", "base_counts"]
+    }
+
+
+class _Table:
+    """
+    A measurement indexed by option positions, with a mask of the
+    combinations present in partial_processing.
+    """
+
+    def __init__(self, shape):
+        self.values = np.full(shape, np.nan)
+        self.present = np.zeros(shape, dtype=bool)
+
+    def set(self, index, value):
+        self.values[index] = value
+        self.present[index] = True
+
+
+class CompiledEvaluator:
+    """
+    Evaluates blocks of scenarios with NumPy.
+
+    ``partial_processing`` is compiled once into one array per measurement,
+    indexed by the positions of the options it depends on (e.g. the
+    percentage of transit exposed to hazards is a (population, nbs, transit)
+    array). A block of scenarios is then a gather per measurement followed by
+    indicators() over whole arrays.
+
+    Scenarios are numbered in mixed radix over ``options`` with the last
+    dimension varying fastest, i.e. in ``itertools.product(*options)`` order.
+    Scenarios the scalar path would reject (an option missing from the
+    partial results, or a zero hospitals/schools count or footprint area in a
+    division) are left out.
+
+    Args:
+        partial_processing: The project's preprocessed partial results.
+        assumptions: assumptions_SP.csv as a code -> value dict.
+    """
+
+    def __init__(self, partial_processing: dict, assumptions: dict):
+        self.assumptions = assumptions
+        self.base = base_values(partial_processing)
+        self.options = partial_processing["options"]
+        self.radices = np.array([len(options) for options in self.options], dtype=np.int64)
+        self.total = int(np.prod(self.radices)) if len(self.radices) else 0
+        self.positions = [
+            {option: i for i, option in enumerate(options)} for options in self.options
+        ]
+        self.numeric = [
+            np.asarray(options, dtype=float) if d in NUMERIC_DIMENSIONS else None
+            for d, options in enumerate(self.options)
+        ]
+        self._compile(partial_processing)
+
+    def _compile(self, partial_processing):
+        (pop, fp, tr, nbs, _, _, _, hp, sc, sp, cl, dc, uga, inf, jobs, perm) = (
+            self.positions
+        )
+        n = [len(options) for options in self.positions]
+        nP, nF, nT, nN = n[0], n[1], n[2], n[3]
+        tables = {}
+
+        def table(name, *shape):
+            tables[name] = _Table(shape)
+            return tables[name]
+
+        pop_2050 = table("pop_2050", nP)
+        exposed_area = table("exposed_area", nP, nN)
+        exposed_pop = table("exposed_pop", nP, nN)
+        pc_exposed_pop = table("pc_exposed_pop", nP, nN)
+        pc_exposed_tr = table("pc_exposed_tr", nP, nN, nT)
+        count_hp_exposed = table("count_hp_exposed", nP, nN, len(hp))
+        count_sc_exposed = table("count_sc_exposed", nP, nN, len(sc))
+        pc_exposed_infra = table("pc_exposed_infra", nP, nN, len(inf))
+        near = [
+            (table("pc_pop_hp", nP, len(hp)), hp),
+            (table("pc_pop_sc", nP, len(sc)), sc),
+            (table("pc_pop_sp", nP, len(sp)), sp),
+            (table("pc_pop_cl", nP, len(cl)), cl),
+            (table("pc_pop_dc", nP, len(dc)), dc),
+        ]
+        uga_tables = [
+            table(name, nP, len(uga)) for name in ["uga_area", "uga_per_capita", "pc_pop_uga"]
+        ]
+        housing_pc = {
+            housing_type: table(f"pc_{housing_type.lower()}", nP)
+            for housing_type in HOUSING_TYPES
+        }
+        housing_units = {
+            housing_type: table(f"units_{housing_type}", nP)
+            for housing_type in HOUSING_TYPES
+        }
+        for p_name, p in pop.items():
+            values = partial_processing["partial_pop"].get(p_name)
+            if values is None:
+                continue
+            pop_2050.set(p, values[0])
+            for n_name, nbs_values in values[1].items():
+                if n_name not in nbs:
+                    continue
+                i = (p, nbs[n_name])
+                exposed_area.set(i, nbs_values[0])
+                exposed_pop.set(i, nbs_values[1])
+                pc_exposed_pop.set(i, nbs_values[6])
+                for target, positions, partial in [
+                    (pc_exposed_tr, tr, nbs_values[2]),
+                    (count_hp_exposed, hp, nbs_values[3]),
+                    (count_sc_exposed, sc, nbs_values[4]),
+                    (pc_exposed_infra, inf, nbs_values[5]),
+                ]:
+                    for name, value in partial.items():
+                        if name in positions:
+                            target.set((*i, positions[name]), value)
+            for (target, positions), partial in zip(near, values[2:7], strict=True):
+                for name, value in partial.items():
+                    if name in positions:
+                        target.set((p, positions[name]), value)
+            for name, uga_values in values[7].items():
+                if name in uga:
+                    for target, value in zip(uga_tables, uga_values):
+                        target.set((p, uga[name]), value)
+            partial_ht = values[8]
+            if all(h in partial_ht and h in partial_ht["units"] for h in HOUSING_TYPES):
+                for housing_type in HOUSING_TYPES:
+                    housing_pc[housing_type].set(p, partial_ht[housing_type])
+                    housing_units[housing_type].set(p, partial_ht["units"][housing_type])
+
+        fp_names = [
+            "fp_area",
+            "urban_expansion_area",
+            "vg_area_loss",
+            "roads_length",
+        ]
+        fp_tables = {name: table(name, nF) for name in fp_names}
+        totals = [
+            (table("total_sc", nF, len(sc)), sc),
+            (table("total_hp", nF, len(hp)), hp),
+            (table("total_sp", nF, len(sp)), sp),
+            (table("total_cl", nF, len(cl)), cl),
+            (table("total_dc", nF, len(dc)), dc),
+        ]
+        jobs_density = table("jobs_density", nF, len(jobs))
+        for f_name, f in fp.items():
+            values = partial_processing["partial_fp"].get(f_name)
+            if values is None:
+                continue
+            for name, value in zip(
+                fp_names, [values[0], values[6], values[8], values[9]], strict=True
+            ):
+                fp_tables[name].set(f, value)
+            for (target, positions), partial in zip(totals, values[1:6], strict=True):
+                for name, value in partial.items():
+                    if name in positions:
+                        target.set((f, positions[name]), value)
+            for name, value in values[7].items():
+                if name in jobs:
+                    jobs_density.set((f, jobs[name]), value)
+
+        tr_names = ["dif_tr_buffer_area", "tr_buffer_area", "tr_length", "dif_tr_length"]
+        tr_tables = [table(name, nT) for name in tr_names]
+        for t_name, t in tr.items():
+            values = partial_processing["partial_tr"].get(t_name)
+            if values is not None:
+                for target, value in zip(tr_tables, values):
+                    target.set(t, value)
+
+        permeable_area = table("permeable_area", len(perm))
+        for name, value in partial_processing["partial_perm"].items():
+            if name in perm:
+                permeable_area.set(perm[name], value)
+
+        # Shared between threads by the evaluator cache
+        for table in tables.values():
+            table.values.setflags(write=False)
+            table.present.setflags(write=False)
+        self.tables = tables
+
+    # Dimensions each table is indexed by, see CONTROL_COLUMNS
+    TABLE_DIMENSIONS = {
+        "pop_2050": (0,),
+        "exposed_area": (0, 3),
+        "exposed_pop": (0, 3),
+        "pc_exposed_pop": (0, 3),
+        "pc_exposed_tr": (0, 3, 2),
+        "count_hp_exposed": (0, 3, 7),
+        "count_sc_exposed": (0, 3, 8),
+        "pc_exposed_infra": (0, 3, 13),
+        "pc_pop_hp": (0, 7),
+        "pc_pop_sc": (0, 8),
+        "pc_pop_sp": (0, 9),
+        "pc_pop_cl": (0, 10),
+        "pc_pop_dc": (0, 11),
+        "uga_area": (0, 12),
+        "uga_per_capita": (0, 12),
+        "pc_pop_uga": (0, 12),
+        "pc_media_hu": (0,),
+        "pc_popular_hu": (0,),
+        "pc_residencial_hu": (0,),
+        "units_Media_hu": (0,),
+        "units_Popular_hu": (0,),
+        "units_Residencial_hu": (0,),
+        "fp_area": (1,),
+        "urban_expansion_area": (1,),
+        "vg_area_loss": (1,),
+        "roads_length": (1,),
+        "total_sc": (1, 8),
+        "total_hp": (1, 7),
+        "total_sp": (1, 9),
+        "total_cl": (1, 10),
+        "total_dc": (1, 11),
+        "jobs_density": (1, 14),
+        "dif_tr_buffer_area": (2,),
+        "tr_buffer_area": (2,),
+        "tr_length": (2,),
+        "dif_tr_length": (2,),
+        "permeable_area": (15,),
+    }
+
+    def decode(self, start: int, stop: int) -> list:
+        """
+        Returns the option position of every dimension for the scenarios
+        numbered ``start`` to ``stop`` (excluded).
+        """
+        return self.decode_keys(np.arange(start, min(stop, self.total), dtype=np.int64))
+
+    def decode_keys(self, keys) -> list:
+        """
+        Same as decode, for arbitrary scenario numbers.
+        """
+        index = np.asarray(keys, dtype=np.int64)
+        digits = [None] * len(self.radices)
+        for d in range(len(self.radices) - 1, -1, -1):
+            index, digits[d] = np.divmod(index, self.radices[d])
+        return digits
+
+    def measurements(self, digits: list):
+        """
+        Gathers the measurements of a block of scenarios.
+
+        Args:
+            digits: Option position per dimension (see decode). Numeric
+                dimensions may instead hold the values themselves as float
+                arrays.
+
+        Returns:
+            A tuple ``(m, valid)``: the arrays expected by indicators() and
+            the mask of the scenarios the scalar path would accept.
+        """
+        m = {}
+        valid = np.ones(len(digits[0]), dtype=bool)
+        for name, dimensions in self.TABLE_DIMENSIONS.items():
+            table = self.tables[name]
+            index = tuple(digits[d] for d in dimensions)
+            m[name] = table.values[index]
+            valid &= table.present[index]
+        m["housing_units"] = {
+            housing_type: m.pop(f"units_{housing_type}") for housing_type in HOUSING_TYPES
+        }
+        for d, name in [(4, "energy_efficiency"), (5, "solar_energy"), (6, "rwh")]:
+            values = digits[d]
+            m[name] = self.numeric[d][values] if values.dtype.kind in "iu" else values
+        # Python divisions by zero raise in the scalar path
+        for name in ["total_hp", "total_sc", "fp_area", "pop_2050"]:
+            valid &= m[name] != 0
+        if self.base["density_base"] == 0 or any(
+            self.assumptions[name] == 0 for name in ZERO_DIVISORS
+        ):
+            valid[:] = False
+        return m, valid
+
+    def evaluate(self, digits: list):
+        """
+        Returns ``(columns, valid)``: one array per INDICATOR_COLUMNS entry
+        and the mask of the valid scenarios.
+        """
+        m, valid = self.measurements(digits)
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            values = indicators(m, self.base, self.assumptions)
+        size = len(valid)
+        return [np.broadcast_to(value, size) for value in values], valid
+
+    def block(self, start: int, stop: int):
+        """
+        Returns ``(values, valid)`` for the scenarios numbered ``start`` to
+        ``stop``: a (scenarios, INDICATOR_COLUMNS) float array, zero for the
+        rejected scenarios, and their validity mask.
+        """
+        columns, valid = self.evaluate(self.decode(start, stop))
+        values = np.column_stack(columns).astype(np.float64)
+        values[~valid] = 0
+        return values, valid
+
+    def block_rows(self, start: int, values, valid) -> list:
+        """
+        Builds the keyed rows (as ``rows(..., keys=True)``) of a block
+        returned by block(), without evaluating it again.
+        """
+        stop = start + len(valid)
+        digits = self.decode(start, stop)
+        labels = zip(
+            *[
+                [self.options[d][i] for i in digits[d].tolist()]
+                for d in range(len(digits))
+            ],
+            strict=True,
+        )
+        return self._rows(labels, list(values.T), valid, range(start, stop))
+
+    def _rows(self, labels, columns, valid, keys=None) -> list:
+        values = [
+            column.astype(np.int64).tolist()
+            if name in INTEGER_COLUMNS
+            else column.tolist()
+            for name, column in zip(INDICATOR_COLUMNS, columns, strict=True)
+        ]
+        rows = zip(labels, zip(*values, strict=True), valid.tolist(), strict=True)
+        if keys is not None:
+            return [
+                [key, *scenario, *row]
+                for key, (scenario, row, ok) in zip(keys, rows, strict=True)
+                if ok
+            ]
+        return [[*scenario, *row] for scenario, row, ok in rows if ok]
+
+    def rows(self, start: int, stop: int, keys: bool = False) -> list:
+        """
+        Returns the rows of the valid scenarios numbered ``start`` to
+        ``stop``, as urban_performance_partial builds them.
+
+        With ``keys`` every row starts with its scenario number, the
+        ``scenario_key`` of urban_performance_controls.
+        """
+        digits = self.decode(start, stop)
+        columns, valid = self.evaluate(digits)
+        labels = zip(
+            *[
+                [self.options[d][i] for i in digits[d].tolist()]
+                for d in range(len(digits))
+            ],
+            strict=True,
+        )
+        numbers = range(start, start + len(valid)) if keys else None
+        return self._rows(labels, columns, valid, numbers)
+
+    def key_rows(self, keys) -> list:
+        """
+        Returns the keyed rows (as ``rows(..., keys=True)``) of the valid
+        scenarios among ``keys``, evaluated together.
+        """
+        keys = [int(key) for key in keys]
+        if not keys:
+            return []
+        digits = self.decode_keys(keys)
+        columns, valid = self.evaluate(digits)
+        labels = zip(
+            *[
+                [self.options[d][i] for i in digits[d].tolist()]
+                for d in range(len(digits))
+            ],
+            strict=True,
+        )
+        return self._rows(labels, columns, valid, keys)
+
+    def scenario_rows(self, scenarios) -> list:
+        """
+        Returns the rows of the given scenario tuples. Options that are not
+        in the partial results leave the scenario out; numeric dimensions
+        accept any value.
+        """
+        scenarios = [tuple(scenario) for scenario in scenarios]
+        known = [
+            all(
+                d in NUMERIC_DIMENSIONS or value in self.positions[d]
+                for d, value in enumerate(scenario)
+            )
+            for scenario in scenarios
+        ]
+        scenarios = [scenario for scenario, ok in zip(scenarios, known, strict=True) if ok]
+        if not scenarios:
+            return []
+        digits = []
+        for d in range(len(self.options)):
+            values = [scenario[d] for scenario in scenarios]
+            if d in NUMERIC_DIMENSIONS:
+                digits.append(np.asarray(values, dtype=float))
+            else:
+                digits.append(
+                    np.array([self.positions[d][v] for v in values], dtype=np.int64)
+                )
+        columns, valid = self.evaluate(digits)
+        return self._rows(scenarios, columns, valid)
@@ -0,0 +1,166 @@
+import os
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+
+from urban_performance.projects.evaluator import CompiledEvaluator
+from urban_performance.projects.incremental import PARTIALS_VERSION
+from urban_performance.projects.models import Proyecto
+
+
+class StalePartials(Exception):
+    """
+    The project's partial results were stored by an older version and have
+    to be processed again (see tasks.reprocess_stale_partials).
+    """
+
+
+def _version_key(proyecto_pk) -> str:
+    return f"projects:content-version:{proyecto_pk}"
+
+
+def content_version(proyecto_pk) -> int:
+    """
+    Returns the project's content_version, from the shared cache when
+    possible so lookups need no query for it. invalidate_evaluator
+    publishes every new version.
+    """
+    version = cache.get(_version_key(proyecto_pk))
+    if version is None:
+        version = Proyecto.objects.values_list("content_version", flat=True).get(
+            pk=proyecto_pk
+        )
+        # Never replaces a newer version published meanwhile
+        cache.add(_version_key(proyecto_pk), version, timeout=None)
+    return version
+
+
+def evaluator_key(proyecto_pk) -> tuple:
+    """
+    Builds the cache key of a project's evaluator.
+
+    Reads only ``content_version`` and the assumptions path, never the
+    partial results. The assumptions file modification time is part of the
+    key so an edited file is picked up even before apply_assumptions bumps
+    the version.
+    """
+    proyecto = Proyecto.objects.only("uuid", "content_version", "assumptions").get(
+        pk=proyecto_pk
+    )
+    path = proyecto.assumptions.path
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        mtime = None
+    return (str(proyecto.pk), proyecto.content_version, path, mtime)
+
+
+def compile_evaluator(key: tuple) -> CompiledEvaluator:
+    proyecto_pk, _, path, _ = key
+    partial_processing = Proyecto.objects.values_list(
+        "partial_processing", flat=True
+    ).get(pk=proyecto_pk)
+    partial_processing = partial_processing or {}
+    if (
+        partial_processing.get("version") != PARTIALS_VERSION
+        or "options" not in partial_processing
+    ):
+        raise StalePartials(proyecto_pk)
+    assumptions = pd.read_csv(path)
+    assumptions = dict(zip(assumptions["code"], assumptions["value"], strict=True))
+    return CompiledEvaluator(partial_processing, assumptions)
+
+
+class EvaluatorCache:
+    """
+    Process-wide cache of compiled evaluators, one per project.
+
+    Entries are keyed by (project, content_version, assumptions path and
+    mtime) and evicted in least recently used order beyond ``max_entries``.
+    A new version of a project replaces the older one. Only one thread
+    compiles a given key, the others wait for its result.
+
+    Other per-project values derived from a version (see
+    lookup.lookup_context) are cached the same way with their own ``key``
+    (starting with the project) and ``build`` functions.
+    """
+
+    def __init__(self, max_entries: int, key=evaluator_key, build=compile_evaluator):
+        self.max_entries = max_entries
+        self._make_key = key
+        self._build = build
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self._key_locks = {}
+
+    def get(self, proyecto_pk):
+        key = self._make_key(proyecto_pk)
+        with self._lock:
+            evaluator = self._entries.get(key)
+            if evaluator is not None:
+                self._entries.move_to_end(key)
+                return evaluator
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                evaluator = self._entries.get(key)
+                if evaluator is not None:
+                    return evaluator
+            try:
+                evaluator = self._build(key)
+            finally:
+                with self._lock:
+                    self._key_locks.pop(key, None)
+            with self._lock:
+                self.discard(proyecto_pk)
+                self._entries[key] = evaluator
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return evaluator
+
+    def discard(self, proyecto_pk):
+        with self._lock:
+            for stale in [k for k in self._entries if k[0] == str(proyecto_pk)]:
+                del self._entries[stale]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+evaluators = EvaluatorCache(max_entries=settings.EVALUATOR_CACHE_SIZE)
+
+
+def get_evaluator(proyecto_pk) -> CompiledEvaluator:
+    """
+    Returns the compiled evaluator of a project, compiling it on first use.
+
+    Raises:
+        StalePartials: The partial results are from an older version.
+    """
+    return evaluators.get(proyecto_pk)
+
+
+def invalidate_evaluator(proyecto_pk):
+    """
+    Bumps the project's content version, so every process compiles its
+    evaluator again on next use.
+    """
+    Proyecto.objects.filter(pk=proyecto_pk).update(
+        content_version=F("content_version") + 1
+    )
+    version = (
+        Proyecto.objects.filter(pk=proyecto_pk)
+        .values_list("content_version", flat=True)
+        .first()
+    )
+    if version is None:
+        cache.delete(_version_key(proyecto_pk))
+    else:
+        cache.set(_version_key(proyecto_pk), version, timeout=None)
+    evaluators.discard(proyecto_pk)
@@ -0,0 +1,406 @@
+import json
+import os
+import threading
+from collections import defaultdict
+
+import numpy as np
+from django.conf import settings
+
+from urban_performance.projects.cube import cube_folder
+from urban_performance.projects.evaluator import (
+    HOUSING_TYPES,
+    INDICATOR_COLUMNS,
+    INTEGER_COLUMNS,
+    ZERO_DIVISORS,
+    CompiledEvaluator,
+    encode_scenario,
+    indicators,
+    option_codes,
+)
+
+# Optional factorized storage of a project's scenarios (SCENARIO_FACTORS
+# setting). Every indicator depends on a few controls only (pc_pop_hp on
+# population and hospitals, permeable_area on permeable areas...), so
+# instead of the full product the indicators are stored in one table per
+# dependency set, over the product of those controls only, plus the
+# validity masks of the measurements. Sums of terms over different controls
+# (capital_cost, maintenance_cost) are stored as one table per term, added
+# up on lookup. A scenario is read back by indexing every table with its
+# codes:
+#
+#   projects/<uuid>/.scenarios/factors.npz
+#
+# Size and build time grow with the sum of the tables instead of the
+# product of every control.
+
+FACTORS_FILE = "factors.npz"
+
+
+class _Dependencies:
+    """
+    Stand-in for a measurement that records which controls flow into the
+    result of any arithmetic it takes part in, as the controls of each
+    additive term: sums and scaling by constants keep the terms apart, any
+    other operation between measurements merges them.
+    """
+
+    def __init__(self, dimensions=(), terms=None):
+        self.terms = terms if terms is not None else (frozenset(dimensions),)
+        self.dimensions = frozenset().union(*self.terms)
+
+    def _add(self, other):
+        if isinstance(other, _Dependencies):
+            return _Dependencies(terms=self.terms + other.terms)
+        return self
+
+    def _multiply(self, other):
+        if isinstance(other, _Dependencies):
+            return _Dependencies(self.dimensions | other.dimensions)
+        return self
+
+    def _divide(self, other):
+        return _Dependencies(self.dimensions)
+
+    __add__ = __radd__ = __sub__ = __rsub__ = _add
+    __mul__ = __rmul__ = __truediv__ = _multiply
+    __rtruediv__ = _divide
+
+    def __neg__(self):
+        return self
+
+
+def _trace() -> list:
+    """
+    Runs indicators() over _Dependencies, returning one per indicator
+    (or a constant).
+    """
+    m = {
+        name: _Dependencies(dimensions)
+        for name, dimensions in CompiledEvaluator.TABLE_DIMENSIONS.items()
+        if not name.startswith("units_")
+    }
+    m["housing_units"] = {
+        housing_type: _Dependencies(
+            CompiledEvaluator.TABLE_DIMENSIONS[f"units_{housing_type}"]
+        )
+        for housing_type in HOUSING_TYPES
+    }
+    for d, name in [(4, "energy_efficiency"), (5, "solar_energy"), (6, "rwh")]:
+        m[name] = _Dependencies([d])
+    base = {
+        "density_base": 1.0,
+        "fp_base_area": 1.0,
+        "pop_base": 1.0,
+        "base_counts": defaultdict(lambda: 1),
+    }
+    return indicators(m, base, defaultdict(lambda: 1.0))
+
+
+def dependency_sets() -> dict:
+    """
+    Returns the controls (CONTROL_COLUMNS positions) every indicator depends
+    on, traced through indicators() itself so it follows the formulas.
+    """
+    return {
+        name: tuple(sorted(value.dimensions)) if isinstance(value, _Dependencies) else ()
+        for name, value in zip(INDICATOR_COLUMNS, _trace(), strict=True)
+    }
+
+
+def factor_tables() -> dict:
+    """
+    Returns, for every indicator, the tables it is stored in as
+    ``(dimensions, relative_to)`` pairs, see build_factors.
+
+    An indicator that is not a sum is one table over its dependency set.
+    A sum is split into groups of terms sharing controls (disjoint from
+    each other). A group of one term is a table over its controls; in a
+    larger group, the controls used by several terms (``shared``) get a
+    table of their own and every term a table over ``shared`` and its other
+    controls, relative to the values over ``shared`` alone.
+    """
+    tables = {}
+    for name, value in zip(INDICATOR_COLUMNS, _trace(), strict=True):
+        if not isinstance(value, _Dependencies):
+            tables[name] = [((), None)]
+            continue
+        # Terms within a larger one are part of it
+        terms = set(value.terms)
+        terms = [term for term in terms if not any(term < other for other in terms)]
+        if len(terms) == 1:
+            tables[name] = [(tuple(sorted(terms[0])), None)]
+            continue
+        groups = []
+        for term in terms:
+            group = [term]
+            for other in [other for other in groups if any(term & t for t in other)]:
+                groups.remove(other)
+                group += other
+            groups.append(group)
+        tables[name] = []
+        for group in groups:
+            if len(group) == 1:
+                tables[name].append((tuple(sorted(group[0])), ()))
+                continue
+            shared = frozenset(
+                d for d in frozenset().union(*group) if sum(d in t for t in group) > 1
+            )
+            tables[name].append((tuple(sorted(shared)), ()))
+            for term in group:
+                if term - shared:
+                    tables[name].append(
+                        (tuple(sorted(term | shared)), tuple(sorted(shared)))
+                    )
+    return tables
+
+
+def _grid(radices: list, dimensions: tuple) -> list:
+    """
+    Option codes of every combination of ``dimensions`` (row-major), the
+    other dimensions at code 0.
+    """
+    size = int(np.prod([radices[d] for d in dimensions]))
+    digits = [np.zeros(size, dtype=np.int64) for _ in radices]
+    if dimensions:
+        mesh = np.indices([radices[d] for d in dimensions]).reshape(len(dimensions), -1)
+        for d, codes in zip(dimensions, mesh, strict=True):
+            digits[d] = codes
+    return digits
+
+
+class _Grids:
+    """
+    Indicator values of a compiled project over the product of some
+    dimensions, the others at code 0, evaluated once per dimension set.
+    """
+
+    def __init__(self, evaluator: CompiledEvaluator):
+        self.evaluator = evaluator
+        self.radices = evaluator.radices.tolist()
+        self._grids = {}
+
+    def over(self, dimensions: tuple) -> dict:
+        """
+        Returns the values of every indicator, one axis per dimension.
+        """
+        if dimensions not in self._grids:
+            columns, _ = self.evaluator.evaluate(_grid(self.radices, dimensions))
+            shape = [self.radices[d] for d in dimensions]
+            self._grids[dimensions] = {
+                name: np.asarray(column, dtype=np.float64).reshape(shape)
+                for name, column in zip(INDICATOR_COLUMNS, columns, strict=True)
+            }
+        return self._grids[dimensions]
+
+    def relative(self, name: str, dimensions: tuple, base: tuple):
+        """
+        Returns f(x_dimensions, x0) - f(x_base, x0), ``base`` being a subset
+        of ``dimensions``.
+        """
+        shape = [self.radices[d] if d in base else 1 for d in dimensions]
+        return self.over(dimensions)[name] - self.over(base)[name].reshape(shape)
+
+
+def build_factors(evaluator: CompiledEvaluator) -> dict:
+    """
+    Computes the factor tables of a compiled project.
+
+    Every table is evaluated over the product of its dimensions only, the
+    other controls at code 0 (x0). An indicator that is a sum of terms,
+    f(x) = t1(x1) + t2(x2) + ..., is stored as tables holding
+    f(x_i, x0) - f(x_s, x0), the terms over their controls ``i`` relative to
+    the controls ``s`` they share with other terms (see factor_tables),
+    plus the offset f(x0): their sum is f(x) up to rounding. Indicators
+    whose split tables are not finite are stored whole.
+
+    Returns:
+        Arrays for ``np.savez``: ``values_<i>`` (one axis per dimension of
+        table i, then its columns), ``offsets`` (added to every scenario, in
+        INDICATOR_COLUMNS order) and ``valid_<j>`` (validity of the
+        measurements over dimension set j), with their layout in ``layout``
+        (JSON).
+    """
+    grids = _Grids(evaluator)
+    dependencies = dependency_sets()
+    offsets = np.zeros(len(INDICATOR_COLUMNS))
+    # dimensions -> [(indicator, table)]
+    groups = defaultdict(list)
+    for i, (name, specs) in enumerate(factor_tables().items()):
+        if specs[0][1] is not None:
+            tables = [
+                (dimensions, grids.relative(name, dimensions, base))
+                for dimensions, base in specs
+            ]
+            offset = grids.over(())[name]
+            if np.isfinite(offset) and all(
+                np.isfinite(table).all() for _, table in tables
+            ):
+                offsets[i] = offset
+                for dimensions, table in tables:
+                    groups[dimensions].append((name, table))
+                continue
+        dimensions = dependencies[name]
+        groups[dimensions].append((name, grids.over(dimensions)[name]))
+
+    arrays = {"offsets": offsets}
+    layout = {"options": evaluator.options, "values": [], "valid": []}
+    for i, (dimensions, entries) in enumerate(sorted(groups.items())):
+        # The group's columns (or their terms) depend on these dimensions
+        # only, so their values do not depend on the codes chosen for the
+        # others (the validity of the row does, and is stored apart).
+        arrays[f"values_{i}"] = np.stack([table for _, table in entries], axis=-1)
+        layout["values"].append(
+            {"dimensions": list(dimensions), "columns": [name for name, _ in entries]}
+        )
+
+    # Same rules as CompiledEvaluator.measurements
+    masks = {}
+    for name, dimensions in CompiledEvaluator.TABLE_DIMENSIONS.items():
+        table = evaluator.tables[name]
+        mask = table.present
+        if name in ["total_hp", "total_sc", "fp_area", "pop_2050"]:
+            mask = mask & (table.values != 0)
+        # Stored over sorted dimensions so equal sets are merged
+        order = np.argsort(dimensions)
+        key = tuple(sorted(dimensions))
+        mask = np.transpose(mask, order)
+        masks[key] = masks[key] & mask if key in masks else mask
+    for j, (dimensions, mask) in enumerate(sorted(masks.items())):
+        arrays[f"valid_{j}"] = mask
+        layout["valid"].append(list(dimensions))
+    layout["invalid"] = bool(
+        evaluator.base["density_base"] == 0
+        or any(evaluator.assumptions[name] == 0 for name in ZERO_DIVISORS)
+    )
+    arrays["layout"] = np.array(json.dumps(layout))
+    return arrays
+
+
+def save_factors(proyecto_pk, evaluator: CompiledEvaluator):
+    """
+    Builds and stores the factor tables of a project, replacing the
+    previous ones atomically.
+    """
+    folder = cube_folder(proyecto_pk)
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, FACTORS_FILE)
+    temporary = path + ".tmp.npz"
+    np.savez(temporary, **build_factors(evaluator))
+    os.replace(temporary, path)
+
+
+def discard_factors(proyecto_pk):
+    try:
+        os.remove(os.path.join(cube_folder(proyecto_pk), FACTORS_FILE))
+    except FileNotFoundError:
+        pass
+
+
+class FactorStore:
+    """
+    Reads scenarios back from the factor tables of a project.
+    """
+
+    def __init__(self, proyecto_pk, data):
+        layout = json.loads(str(data["layout"]))
+        self.proyecto_pk = str(proyecto_pk)
+        self.options = layout["options"]
+        self.codes = option_codes(self.options)
+        self.radices = np.array([len(values) for values in self.options], dtype=np.int64)
+        self.invalid = layout["invalid"]
+        position = {name: i for i, name in enumerate(INDICATOR_COLUMNS)}
+        # (dimensions, INDICATOR_COLUMNS positions of the columns, table)
+        self.values = [
+            (
+                tuple(group["dimensions"]),
+                np.array([position[name] for name in group["columns"]]),
+                data[f"values_{i}"],
+            )
+            for i, group in enumerate(layout["values"])
+        ]
+        self.offsets = data["offsets"]
+        self.valid = [
+            (tuple(dimensions), data[f"valid_{j}"])
+            for j, dimensions in enumerate(layout["valid"])
+        ]
+
+    def key(self, data: dict):
+        return encode_scenario(self.options, self.codes, data)
+
+    def decode(self, keys) -> list:
+        keys = np.asarray(keys, dtype=np.int64)
+        digits = [None] * len(self.radices)
+        for d in range(len(self.radices) - 1, -1, -1):
+            keys, digits[d] = np.divmod(keys, self.radices[d])
+        return digits
+
+    def gather(self, keys):
+        """
+        Returns ``(values, valid)`` for the given scenario keys, as
+        CompiledEvaluator.block does for a range: the tables are indexed
+        with the codes of each scenario and added to the offsets, in
+        INDICATOR_COLUMNS order.
+        """
+        digits = self.decode(keys)
+        size = len(digits[0])
+        values = np.tile(self.offsets, (size, 1))
+        for dimensions, columns, table in self.values:
+            if dimensions:
+                values[:, columns] += table[tuple(digits[d] for d in dimensions)]
+            else:
+                values[:, columns] += table
+        valid = np.full(size, not self.invalid)
+        for dimensions, mask in self.valid:
+            valid &= mask[tuple(digits[d] for d in dimensions)]
+        values[~valid] = 0
+        return values, valid
+
+    def block(self, start: int, stop: int):
+        total = int(np.prod(self.radices))
+        return self.gather(np.arange(start, min(stop, total), dtype=np.int64))
+
+    def row(self, key: int):
+        """
+        Returns the scenario as a urban_performance_controls row (``id`` is
+        0), or ``[]`` if the scalar path rejects it.
+        """
+        values, valid = self.gather([key])
+        if not valid[0]:
+            return []
+        labels = [self.options[d][int(code[0])] for d, code in enumerate(self.decode([key]))]
+        indicators = [
+            int(value) if name in INTEGER_COLUMNS else value
+            for name, value in zip(INDICATOR_COLUMNS, values[0].tolist(), strict=True)
+        ]
+        return [0, self.proyecto_pk, *labels, *indicators, key]
+
+
+_stores = {}
+_lock = threading.Lock()
+
+
+def open_factors(proyecto_pk):
+    """
+    Returns the project's FactorStore, or ``None`` if it has none. Stores
+    are kept per process and reloaded when the file changes.
+    """
+    if not settings.SCENARIO_FACTORS:
+        return None
+    path = os.path.join(cube_folder(proyecto_pk), FACTORS_FILE)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    with _lock:
+        cached = _stores.get(str(proyecto_pk))
+        if cached and cached[0] == mtime:
+            return cached[1]
+    try:
+        with np.load(path) as data:
+            store = FactorStore(proyecto_pk, data)
+    except (OSError, ValueError, KeyError):
+        # Unreadable, or written by an older layout: rebuilt on next run
+        return None
+    with _lock:
+        _stores[str(proyecto_pk)] = (mtime, store)
+    return store
@@ -0,0 +1,108 @@
+import numpy as np
+import shapely
+
+POLYGONAL_TYPES = (shapely.GeometryType.POLYGON, shapely.GeometryType.MULTIPOLYGON)
+
+
+def as_geometry_array(geometries) -> np.ndarray:
+    """
+    Returns a plain numpy array of shapely geometries from a GeoSeries,
+    GeoDataFrame, GeometryArray or sequence.
+    """
+    if hasattr(geometries, "geometry"):
+        geometries = geometries.geometry
+    return np.asarray(getattr(geometries, "values", geometries), dtype=object)
+
+
+def keep_polygonal(geometries: np.ndarray) -> np.ndarray:
+    """
+    Replaces geometry collections by the union of their polygonal parts,
+    as ``gpd.overlay`` does when ``keep_geom_type`` is set.
+    """
+    geometries = geometries.copy()
+    collections = np.flatnonzero(
+        shapely.get_type_id(geometries) == shapely.GeometryType.GEOMETRYCOLLECTION
+    )
+    for i in collections:
+        parts = shapely.get_parts(geometries[i])
+        polygons = parts[np.isin(shapely.get_type_id(parts), POLYGONAL_TYPES)]
+        geometries[i] = shapely.union_all(polygons)
+    return geometries
+
+
+def dissolved_buffer(geometries, distance: float) -> np.ndarray:
+    """
+    Buffers ``geometries`` and dissolves the result, returning the disjoint
+    parts of the union so they can be queried individually.
+    """
+    buffers = shapely.buffer(as_geometry_array(geometries), distance)
+    return shapely.get_parts(shapely.union_all(buffers))
+
+
+class ArealWeights:
+    """
+    Areal-weighting kernel over a polygon layer (e.g. census blocks).
+
+    The polygons are indexed once with an STRtree and can then be intersected
+    with any number of cover layers (facility buffers, green areas, hazards)
+    using vectorized shapely operations, without building attribute-merged
+    GeoDataFrames as ``gpd.overlay`` does.
+
+    Args:
+        polygons: Polygon layer in a projected CRS.
+        values: Optional per-polygon quantity (e.g. ``Pop_total``) that is
+            assumed uniformly distributed over each polygon's area.
+    """
+
+    def __init__(self, polygons, values=None):
+        self.polygons = as_geometry_array(polygons)
+        self.areas = shapely.area(self.polygons)
+        self.values = None if values is None else np.asarray(values, dtype=float)
+        self.tree = shapely.STRtree(self.polygons)
+
+    def intersections(self, covers):
+        """
+        Intersects every polygon with every cover geometry it touches.
+
+        Covers are expected to be disjoint (dissolve them first) so that the
+        areas of the pieces of a polygon add up without double counting.
+
+        Returns:
+            A tuple ``(polygon_index, pieces, areas)`` with one entry per
+            intersecting (polygon, cover) pair.
+        """
+        covers = as_geometry_array(covers)
+        shapely.prepare(covers)
+        cover_index, polygon_index = self.tree.query(covers, predicate="intersects")
+        pair_covers = covers[cover_index]
+        pair_polygons = self.polygons[polygon_index]
+        # Polygons strictly inside a cover are kept whole: no clipping needed.
+        inside = shapely.contains_properly(pair_covers, pair_polygons)
+        pieces = pair_polygons.copy()
+        pieces[~inside] = shapely.intersection(
+            pair_polygons[~inside], pair_covers[~inside]
+        )
+        areas = shapely.area(pieces)
+        return polygon_index, pieces, areas
+
+    def piece_values(self, polygon_index, areas) -> np.ndarray:
+        """
+        Returns the share of ``values`` falling in each intersection piece.
+        """
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self.values[polygon_index] * areas / self.areas[polygon_index]
+
+    def covered_fraction(self, covers) -> np.ndarray:
+        """
+        Returns, per polygon, the fraction of its area inside ``covers``.
+        """
+        polygon_index, _, areas = self.intersections(covers)
+        covered = np.bincount(polygon_index, weights=areas, minlength=len(self.polygons))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return covered / self.areas
+
+    def weighted_sum(self, covers) -> float:
+        """
+        Returns the amount of ``values`` located inside ``covers``.
+        """
+        return float(np.nansum(self.values * self.covered_fraction(covers)))
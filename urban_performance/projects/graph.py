@@ -0,0 +1,236 @@
+import os
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from billiard import Pool
+
+from urban_performance.projects.incremental import MISSING
+from urban_performance.projects.instrumentation import collect
+
+
+class Node:
+    """
+    A named computation: ``function(*args, *dependency values)``.
+
+    Args:
+        name: Unique name, derived from the function, arguments and deps.
+        function: Module-level callable (it may run in another process).
+        args: Picklable arguments, usually file paths.
+        deps: Names of the nodes whose values are appended to ``args``.
+        files: Input files read by this node itself.
+    """
+
+    def __init__(self, name, function, args, deps, files):
+        self.name = name
+        self.function = function
+        self.args = args
+        self.deps = deps
+        self.files = files
+
+
+def _call(function, args, dep_values):
+    with collect() as spans:
+        started, cpu_started = time.perf_counter(), time.thread_time()
+        value = function(*args, *dep_values)
+    timing = {
+        "wall": time.perf_counter() - started,
+        "cpu": time.thread_time() - cpu_started,
+        "spans": spans,
+    }
+    return value, timing
+
+
+class Graph:
+    """
+    Dependency graph of memoized computation nodes.
+
+    Nodes are identified by their function, arguments and dependencies, so
+    declaring the same computation twice (e.g. the 800m buffer of a hospitals file, once
+    per population file) yields a single node that is evaluated once per
+    run. Some nodes are also *entries*: values stored in
+    ``partial_processing`` under a key. Entries whose input files did not
+    change are taken from the previous run (see ``incremental.Reuse``) and
+    only the nodes needed by the remaining entries are evaluated.
+
+    The input files of an entry are collected automatically from the nodes
+    it depends on. The wall and CPU time of every evaluated node, with the
+    spans of the geometry operations it ran (see ``instrumentation``), are
+    kept in ``timings``.
+
+    Args:
+        root: Project folder; file arguments are named relative to it.
+    """
+
+    def __init__(self, root=None):
+        self.root = root
+        self.nodes = {}
+        self.entries = {}
+        self.values = {}
+        self.timings = {}
+
+    def node(self, function, *args, deps=(), files=()):
+        """
+        Declares a node and returns its name.
+
+        Args:
+            function: Callable receiving ``*args`` followed by the values of
+                ``deps``.
+            args: Arguments identifying the computation.
+            deps: Names of the nodes it depends on.
+            files: Files read by the function; defaults to ``args``.
+        """
+        parts = [self._label(arg) for arg in args] + list(deps)
+        name = f"{function.__name__}({', '.join(parts)})"
+        if name not in self.nodes:
+            self.nodes[name] = Node(
+                name, function, args, tuple(deps), tuple(files or args)
+            )
+        return name
+
+    def _label(self, arg):
+        if self.root and isinstance(arg, str) and arg.startswith(self.root):
+            return os.path.relpath(arg, self.root)
+        return str(arg)
+
+    def entry(self, key: tuple, name: str):
+        """
+        Stores the value of node ``name`` at ``key`` of the results.
+        """
+        self.entries[key] = name
+
+    def input_files(self, name: str) -> list:
+        """
+        Returns every file node ``name`` depends on, directly or through
+        its dependencies.
+        """
+        files, pending, seen = [], [name], set()
+        while pending:
+            node = self.nodes[pending.pop()]
+            if node.name in seen:
+                continue
+            seen.add(node.name)
+            files.extend(f for f in node.files if f not in files)
+            pending.extend(node.deps)
+        return files
+
+    def plan(self, reuse) -> list:
+        """
+        Seeds the values of reusable entries and returns the names of the
+        nodes that still have to be evaluated, in dependency order.
+        """
+        targets = []
+        for key, name in self.entries.items():
+            value = reuse.previous(key, self.input_files(name))
+            if value is MISSING:
+                targets.append(name)
+            else:
+                self.values.setdefault(name, value)
+        for name in self.entries.values():
+            # A node shared by a reused and a recomputed entry is evaluated.
+            if name in targets:
+                self.values.pop(name, None)
+
+        order, visited = [], set()
+
+        def visit(name):
+            if name in visited or name in self.values:
+                return
+            visited.add(name)
+            for dep in self.nodes[name].deps:
+                visit(dep)
+            order.append(name)
+
+        for name in targets:
+            visit(name)
+        return order
+
+    def run(self, reuse, mode="serial", workers=1, on_node_done=None) -> dict:
+        """
+        Evaluates the graph.
+
+        Args:
+            reuse: ``incremental.Reuse`` deciding which entries are reused.
+            mode: ``"serial"``, ``"thread"`` or ``"process"``. In process
+                mode the values of the dependencies are pickled to the
+                worker that evaluates a node.
+            workers: Pool size.
+            on_node_done: Optional callback receiving (done, total).
+
+        Returns:
+            The value of every entry, by key.
+        """
+        order = self.plan(reuse)
+        total = len(order)
+        if mode in ("thread", "process") and workers > 1 and total > 1:
+            self._run_pool(order, mode, workers, on_node_done)
+        else:
+            for done, name in enumerate(order, start=1):
+                self._store(name, *self._evaluate(name))
+                if on_node_done:
+                    on_node_done(done, total)
+        return {key: self.values[name] for key, name in self.entries.items()}
+
+    def _evaluate(self, name):
+        node = self.nodes[name]
+        return _call(node.function, node.args, [self.values[d] for d in node.deps])
+
+    def _store(self, name, value, timing):
+        self.values[name] = value
+        self.timings[name] = timing
+
+    def _run_pool(self, order, mode, workers, on_node_done):
+        pending = set(order)
+        waiting = {
+            name: {d for d in self.nodes[name].deps if d in pending} for name in order
+        }
+        dependants = {name: [] for name in order}
+        for name, deps in waiting.items():
+            for dep in deps:
+                dependants[dep].append(name)
+        completed = queue.Queue()
+
+        if mode == "process":
+            pool = Pool(processes=workers)
+
+            def submit(name):
+                node = self.nodes[name]
+                pool.apply_async(
+                    _call,
+                    (node.function, node.args, [self.values[d] for d in node.deps]),
+                    callback=lambda result: completed.put((name, result, None)),
+                    error_callback=lambda error: completed.put((name, None, error)),
+                )
+
+        else:
+            pool = ThreadPoolExecutor(max_workers=workers)
+
+            def submit(name):
+                def done(future):
+                    error = future.exception()
+                    completed.put((name, None if error else future.result(), error))
+
+                pool.submit(self._evaluate, name).add_done_callback(done)
+
+        try:
+            for name in order:
+                if not waiting[name]:
+                    submit(name)
+            done = 0
+            while done < len(order):
+                name, result, error = completed.get()
+                if error is not None:
+                    raise error
+                self._store(name, *result)
+                done += 1
+                if on_node_done:
+                    on_node_done(done, len(order))
+                for dependant in dependants[name]:
+                    waiting[dependant].discard(name)
+                    if not waiting[dependant]:
+                        submit(dependant)
+        finally:
+            if mode == "process":
+                pool.terminate()
+            else:
+                pool.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,104 @@
+import hashlib
+import os
+
+# Bump whenever the layout or the meaning of the stored partial results
+# changes, so results computed by an older version are never reused.
+PARTIALS_VERSION = 3
+
+# Returned by Reuse.previous when an entry has to be recomputed.
+MISSING = object()
+
+
+def file_fingerprint(path: str, previous=None) -> list:
+    """
+    Returns ``[mtime_ns, size, sha1]`` for a file.
+
+    The content hash is only recomputed when the modification time or size
+    differ from ``previous``. Hashing the content (instead of trusting the
+    mtime) lets re-uploads of identical files, e.g. a project zip uploaded
+    again with one layer changed, keep their previous results.
+    """
+    stat = os.stat(path)
+    if previous and previous[:2] == [stat.st_mtime_ns, stat.st_size]:
+        return list(previous)
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            sha1.update(block)
+    return [stat.st_mtime_ns, stat.st_size, sha1.hexdigest()]
+
+
+def fingerprint_files(root: str, paths, previous=None) -> dict:
+    """
+    Fingerprints every existing file in ``paths``, keyed by its path relative
+    to ``root`` (the project folder).
+    """
+    previous = previous or {}
+    fingerprints = {}
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        name = os.path.relpath(path, root)
+        fingerprints[name] = file_fingerprint(path, previous.get(name))
+    return fingerprints
+
+
+def lookup(data, key):
+    """
+    Follows ``key`` (dict keys and tuple/list positions) inside ``data``.
+    """
+    for part in key:
+        data = data[part]
+    return data
+
+
+class Reuse:
+    """
+    Decides, entry by entry, whether a partial result can be taken from the
+    previous run of process_project_controls.
+
+    Every entry is identified by its position inside ``partial_processing``
+    (e.g. ``("partial_pop", "P1.geojson", 2, "H1.geojson")`` is the
+    percentage of population near hospitals file H1 for population file P1)
+    and declares the input files it was computed from. Its value is reused
+    only if all of those files still have the same content.
+
+    Args:
+        context: Preprocessing context with ``root``, ``fingerprints``
+            (relative path -> sha1) and ``previous`` (the stored
+            ``partial_processing``, may be empty).
+    """
+
+    def __init__(self, context: dict):
+        self.root = context["root"]
+        self.fingerprints = context["fingerprints"]
+        previous = context.get("previous") or {}
+        if previous.get("version") != PARTIALS_VERSION:
+            previous = {}
+        self._previous = previous
+        self.previous_dependencies = previous.get("dependencies", {})
+        self.dependencies = {}
+        self.reused = 0
+        self.computed = 0
+
+    def previous(self, key: tuple, files):
+        """
+        Returns the previous value stored at ``key`` if ``files`` did not
+        change since it was computed, otherwise ``MISSING``.
+        """
+        name = "/".join(str(part) for part in key)
+        dependencies = {}
+        for path in files:
+            relative = os.path.relpath(path, self.root)
+            dependencies[relative] = self.fingerprints.get(relative)
+        self.dependencies[name] = dependencies
+        if self.previous_dependencies.get(name) == dependencies:
+            try:
+                value = lookup(self._previous, key)
+            except (KeyError, IndexError, TypeError):
+                pass
+            else:
+                self.reused += 1
+                return value
+        self.computed += 1
+        return MISSING
@@ -0,0 +1,121 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import geopandas as gpd
+import numpy as np
+import shapely
+
+from urban_performance.projects.geometry import as_geometry_array
+
+# Spans are recorded around the expensive geometry operations of the
+# preprocessing (reads, reprojections, buffers, dissolves, overlays and
+# spatial joins) and collected per graph node, see Graph._call. They end up
+# in ProcessingRun.spans. Outside of a collect() block span() is a no-op
+# apart from the timing.
+
+_local = threading.local()
+
+
+def geometry_size(data) -> tuple:
+    """
+    Returns ``(features, vertices)`` of a layer or geometry array.
+    """
+    if data is None:
+        return 0, 0
+    geometries = as_geometry_array(data)
+    return len(geometries), int(shapely.get_num_coordinates(geometries).sum())
+
+
+class Span:
+    def __init__(self, name: str, inputs, detail: str):
+        self.record = {"name": name}
+        if detail:
+            self.record["detail"] = detail
+        if inputs:
+            sizes = np.array([geometry_size(data) for data in inputs])
+            self.record["input_features"] = int(sizes[:, 0].sum())
+            self.record["input_vertices"] = int(sizes[:, 1].sum())
+
+    def output(self, data):
+        """
+        Records the size of ``data`` and returns it unchanged.
+        """
+        features, vertices = geometry_size(data)
+        self.record["output_features"] = features
+        self.record["output_vertices"] = vertices
+        return data
+
+
+@contextmanager
+def span(name: str, *inputs, detail: str = ""):
+    """
+    Times a geometry operation.
+
+    Args:
+        name: Operation, e.g. ``"overlay"`` or ``"buffer"``.
+        inputs: Layers or geometry arrays whose feature and vertex counts
+            are recorded.
+        detail: Free text, e.g. the file or the overlay mode.
+
+    Yields:
+        A ``Span``; call ``span.output(result)`` to record the output size.
+    """
+    current = Span(name, inputs, detail)
+    started, cpu_started = time.perf_counter(), time.thread_time()
+    try:
+        yield current
+    finally:
+        current.record["wall"] = time.perf_counter() - started
+        current.record["cpu"] = time.thread_time() - cpu_started
+        spans = getattr(_local, "spans", None)
+        if spans is not None:
+            spans.append(current.record)
+
+
+@contextmanager
+def collect():
+    """
+    Collects the spans recorded by the current thread inside the block.
+    """
+    previous = getattr(_local, "spans", None)
+    _local.spans = spans = []
+    try:
+        yield spans
+    finally:
+        _local.spans = previous
+
+
+def stage_totals(spans) -> dict:
+    """
+    Sums wall and CPU time per operation name.
+    """
+    totals = {}
+    for record in spans:
+        total = totals.setdefault(record["name"], {"count": 0, "wall": 0.0, "cpu": 0.0})
+        total["count"] += 1
+        total["wall"] += record["wall"]
+        total["cpu"] += record["cpu"]
+    return dict(sorted(totals.items(), key=lambda item: item[1]["wall"], reverse=True))
+
+
+# Instrumented geometry operations ¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬
+
+
+def overlay(df1, df2, how, **kwargs) -> gpd.GeoDataFrame:
+    with span("overlay", df1, df2, detail=how) as current:
+        return current.output(gpd.overlay(df1, df2, how=how, **kwargs))
+
+
+def sjoin(left, right, **kwargs) -> gpd.GeoDataFrame:
+    with span("sjoin", left, right, detail=kwargs.get("predicate", "")) as current:
+        return current.output(gpd.sjoin(left, right, **kwargs))
+
+
+def buffer(layer, distance) -> gpd.GeoDataFrame:
+    """
+    Buffers every geometry of ``layer`` into a new GeoDataFrame.
+    """
+    with span("buffer", layer, detail=f"{distance}m") as current:
+        buffered = gpd.GeoDataFrame(geometry=gpd.GeoSeries(layer.buffer(distance)))
+        return current.output(buffered)
@@ -0,0 +1,287 @@
+import gzip
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import geopandas as gpd
+import shapely
+from django.conf import settings
+
+try:
+    import brotli
+except ImportError:  # optional, only gzip variants are written without it
+    brotli = None
+
+from urban_performance.projects.instrumentation import span
+
+# Equal-area projection used for every area/length measurement.
+ANALYSIS_CRS = "World_Mollweide"
+DISPLAY_CRS = "EPSG:4326"
+
+ARTIFACTS_DIR = ".artifacts"
+ARTIFACT_TAGS = {
+    ANALYSIS_CRS: "analysis",
+    DISPLAY_CRS: "4326",
+}
+
+
+def artifact_path(path: str, crs: str) -> str:
+    """
+    Returns where the normalized GeoParquet artifact of ``path`` lives.
+
+    Artifacts sit in a hidden folder next to the source file, e.g.
+    ``hospitals/.artifacts/HO_nuevos.analysis.parquet``.
+    """
+    folder, filename = os.path.split(path)
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(folder, ARTIFACTS_DIR, f"{stem}.{ARTIFACT_TAGS[crs]}.parquet")
+
+
+def fresh_artifact(path: str, crs: str):
+    """
+    Returns the artifact path for ``path`` if it exists and is not older
+    than the source file, otherwise ``None``.
+    """
+    if crs not in ARTIFACT_TAGS:
+        return None
+    artifact = artifact_path(path, crs)
+    try:
+        if os.path.getmtime(artifact) >= os.path.getmtime(path):
+            return artifact
+    except OSError:
+        pass
+    return None
+
+
+# Display-ready GeoJSON of a layer, served as-is by the map endpoint, with
+# pre-compressed variants by Content-Encoding:
+#   hospitals/.artifacts/HO_nuevos.4326.geojson(.gz|.br)
+GEOJSON_ENCODINGS = {"br": ".br", "gzip": ".gz"}
+
+
+def geojson_artifact_path(path: str) -> str:
+    folder, filename = os.path.split(path)
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(
+        folder, ARTIFACTS_DIR, f"{stem}.{ARTIFACT_TAGS[DISPLAY_CRS]}.geojson"
+    )
+
+
+def write_atomically(path: str, write):
+    """
+    Calls ``write`` with a temporary path next to ``path`` and moves the
+    result into place. Every call gets its own temporary file, so concurrent
+    builds of the same artifact never write into each other.
+    """
+    folder, filename = os.path.split(path)
+    with tempfile.NamedTemporaryFile(
+        dir=folder, prefix=f".{filename}.", suffix=".tmp", delete=False
+    ) as f:
+        tmp_path = f.name
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _write_bytes(path: str, data: bytes):
+    def write(tmp_path):
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+
+    write_atomically(path, write)
+
+
+def write_geojson_artifacts(gdf: gpd.GeoDataFrame, path: str) -> str:
+    """
+    Writes the display GeoJSON of ``path`` from ``gdf`` (already in
+    EPSG:4326) and its compressed variants.
+
+    The plain file is written last, so a fresh plain file means its
+    variants are from the same build.
+
+    Returns:
+        The path of the plain GeoJSON artifact.
+    """
+    artifact = geojson_artifact_path(path)
+    os.makedirs(os.path.dirname(artifact), exist_ok=True)
+    data = gdf.to_json().encode()
+    _write_bytes(artifact + GEOJSON_ENCODINGS["gzip"], gzip.compress(data, mtime=0))
+    if brotli is not None:
+        _write_bytes(artifact + GEOJSON_ENCODINGS["br"], brotli.compress(data))
+    elif os.path.exists(artifact + GEOJSON_ENCODINGS["br"]):
+        # Left by an older build
+        os.remove(artifact + GEOJSON_ENCODINGS["br"])
+    _write_bytes(artifact, data)
+    return artifact
+
+
+def display_geojson(path: str) -> str:
+    """
+    Returns the display GeoJSON artifact of ``path``, building it first if
+    it is missing or older than the source file (e.g. not ingested).
+    """
+    artifact = geojson_artifact_path(path)
+    try:
+        if os.path.getmtime(artifact) >= os.path.getmtime(path):
+            return artifact
+    except OSError:
+        pass
+    return write_geojson_artifacts(read_layer(path, crs=DISPLAY_CRS), path)
+
+
+def geojson_variant(artifact: str, encoding: str):
+    """
+    Returns the ``encoding`` variant of a GeoJSON artifact if it belongs to
+    the current build, otherwise ``None``.
+    """
+    variant = artifact + GEOJSON_ENCODINGS[encoding]
+    try:
+        if os.path.getmtime(variant) <= os.path.getmtime(artifact):
+            return variant
+    except OSError:
+        pass
+    return None
+
+
+def layer_key(path: str, crs: str):
+    """
+    Builds the registry key for a spatial file.
+
+    The key changes whenever the file is replaced on disk or its ingest
+    artifact is (re)written, so a re-uploaded layer is never served from a
+    stale entry.
+
+    Args:
+        path: Path of the spatial file.
+        crs: CRS the layer is requested in.
+
+    Returns:
+        A hashable tuple identifying the file version and projection.
+    """
+    real_path = os.path.realpath(path)
+    stat = os.stat(real_path)
+    artifact = fresh_artifact(real_path, crs)
+    artifact_mtime = os.stat(artifact).st_mtime_ns if artifact else None
+    return (real_path, stat.st_mtime_ns, stat.st_size, crs, artifact_mtime)
+
+
+def estimate_layer_size(gdf: gpd.GeoDataFrame) -> int:
+    """
+    Approximates the memory used by a GeoDataFrame in bytes.
+
+    Attribute columns are measured by pandas; geometries are estimated from
+    their coordinate count (two float64 per vertex) plus object overhead.
+    """
+    attributes = gdf.drop(columns=gdf.geometry.name).memory_usage(deep=True).sum()
+    coordinates = int(shapely.get_num_coordinates(gdf.geometry.values).sum())
+    return int(attributes) + coordinates * 16 + len(gdf) * 100
+
+
+def load_layer(path: str, crs: str = ANALYSIS_CRS) -> gpd.GeoDataFrame:
+    """
+    Reads a spatial file from disk and reprojects it to ``crs``.
+
+    When the upload-time ingest (``up_geo.ingest``) already produced a
+    normalized artifact for this projection, it is read instead of the
+    GeoJSON.
+    """
+    artifact = fresh_artifact(path, crs)
+    with span("read", detail=os.path.basename(path)) as current:
+        if artifact:
+            return current.output(gpd.read_parquet(artifact))
+        gdf = current.output(gpd.read_file(path))
+    if gdf.crs is None or gdf.crs != crs:
+        with span("reproject", gdf, detail=crs) as current:
+            gdf = current.output(gdf.to_crs(crs))
+    return gdf
+
+
+class LayerRegistry:
+    """
+    Worker-resident cache of parsed and reprojected spatial layers.
+
+    Entries are keyed by (path, mtime, size, crs, artifact mtime) and evicted in least
+    recently used order once ``max_bytes`` is exceeded. A single layer bigger
+    than the cap is returned but never kept.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self._key_locks = {}
+
+    def get(self, path: str, crs: str = ANALYSIS_CRS) -> gpd.GeoDataFrame:
+        """
+        Returns the layer at ``path`` projected to ``crs``.
+
+        The returned frame is a shallow copy: callers may add columns to it,
+        but must not modify existing columns in place.
+        """
+        key = layer_key(path, crs)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry[0].copy(deep=False)
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # Only one thread parses a given file; the others wait for its result.
+        with key_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    return entry[0].copy(deep=False)
+            try:
+                gdf = load_layer(path, crs)
+            finally:
+                # Also when loading fails, so broken files do not leak locks
+                with self._lock:
+                    self._key_locks.pop(key, None)
+            size = estimate_layer_size(gdf)
+            with self._lock:
+                if size <= self.max_bytes:
+                    self._discard_versions(key)
+                    self._entries[key] = (gdf, size)
+                    self.current_bytes += size
+                    self._evict()
+        return gdf.copy(deep=False)
+
+    def _discard_versions(self, key):
+        # Drop older versions of the same file in the same projection.
+        for stale in [k for k in self._entries if k[0] == key[0] and k[3] == key[3]]:
+            self.current_bytes -= self._entries.pop(stale)[1]
+
+    def _evict(self):
+        while self.current_bytes > self.max_bytes and self._entries:
+            _, (_, size) = self._entries.popitem(last=False)
+            self.current_bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+
+registry = LayerRegistry(max_bytes=settings.LAYER_REGISTRY_MAX_BYTES)
+
+
+def read_layer(path: str, crs: str = ANALYSIS_CRS) -> gpd.GeoDataFrame:
+    """
+    Reads a spatial layer through the process-wide registry.
+
+    Args:
+        path: Path of the spatial file.
+        crs: CRS to project the layer to, ``World_Mollweide`` by default.
+
+    Returns:
+        The projected GeoDataFrame.
+    """
+    return registry.get(path, crs)
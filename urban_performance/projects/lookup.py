@@ -0,0 +1,304 @@
+from uuid import UUID
+
+from django.conf import settings
+from django.db import connection
+from psycopg import sql
+
+from urban_performance.projects.bulk import COLUMNS, TARGET_TABLE
+from urban_performance.projects.cube import open_cube
+from urban_performance.projects.evaluator import (
+    CONTROL_COLUMNS,
+    INDICATOR_COLUMNS,
+    encode_scenario,
+    option_codes,
+)
+from urban_performance.projects.evaluator_cache import (
+    EvaluatorCache,
+    content_version,
+    get_evaluator,
+)
+from urban_performance.projects.factors import open_factors
+from urban_performance.projects.models import Control
+from urban_performance.projects.result_cache import cached_result, cached_results
+from urban_performance.projects.utils import get_control_options
+
+# Typed reads of urban_performance_controls for FilterUpControlsView. Control
+# names are checked against the project's Control rows and only then used as
+# identifiers; values are bound with the column's type (energy_efficiency and
+# solar_energy are double precision), never formatted into the SQL. Lookups
+# by scenario_key go through the (project_id, scenario_key) unique index with
+# a statement prepared once per connection and column list; several
+# scenarios (resolve_scenarios) share one query and one evaluation.
+# Scenarios evaluated because they are not stored yet are cached, see
+# result_cache.
+#
+# The project's controls and option codes are read once per content_version
+# and process (lookup_context), so a lookup only makes the indexed fetch, or
+# no query at all when its scenario is in the result cache.
+
+# Columns of a row, in table order
+ROW_COLUMNS = ["id", "project_id", *CONTROL_COLUMNS, *INDICATOR_COLUMNS, "scenario_key"]
+
+_TYPES = dict(COLUMNS)
+
+
+class InvalidLookup(ValueError):
+    pass
+
+
+def parse_fields(value: str = None) -> list:
+    """
+    Columns requested with ``?fields=a,b``, every column when empty.
+    """
+    if not value:
+        return ROW_COLUMNS
+    fields = [field.strip() for field in value.split(",") if field.strip()]
+    unknown = [field for field in fields if field not in ROW_COLUMNS]
+    if unknown:
+        raise InvalidLookup(f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+
+def project_row(row, fields: list) -> dict:
+    """
+    ``fields`` of a full row (ROW_COLUMNS order).
+    """
+    values = dict(zip(ROW_COLUMNS, row, strict=True))
+    return {field: values[field] for field in fields}
+
+
+def project_controls(proyecto_pk) -> set:
+    return {
+        campo.lower()
+        for campo in Control.objects.filter(proyecto_id=proyecto_pk).values_list(
+            "campo", flat=True
+        )
+    }
+
+
+class LookupContext:
+    """
+    What a lookup needs to know about a project at one content_version:
+    its controls (``campos``) and option codes.
+    """
+
+    def __init__(self, proyecto_pk, version: int):
+        self.version = version
+        self.campos = project_controls(proyecto_pk)
+        self.options = get_control_options(proyecto_pk)
+        self.codes = option_codes(self.options)
+
+    def key(self, data: dict):
+        """
+        The scenario_key of ``data``, see encode_scenario.
+        """
+        return encode_scenario(self.options, self.codes, data)
+
+
+def _context_key(proyecto_pk) -> tuple:
+    return (str(proyecto_pk), content_version(proyecto_pk))
+
+
+contexts = EvaluatorCache(
+    max_entries=settings.EVALUATOR_CACHE_SIZE,
+    key=_context_key,
+    build=lambda key: LookupContext(*key),
+)
+
+
+def lookup_context(proyecto_pk) -> LookupContext:
+    """
+    Returns the project's LookupContext at its current content_version.
+    """
+    return contexts.get(proyecto_pk)
+
+
+def typed_conditions(proyecto_pk, data: dict, campos: set = None) -> list:
+    """
+    Returns ``data`` (control column -> option) as ``(column, value)`` pairs
+    of the column's type.
+
+    Args:
+        campos: The project's controls, read when not given.
+
+    Raises:
+        InvalidLookup: A name is not a control of the project, or a value
+            does not fit its column.
+    """
+    if campos is None:
+        campos = project_controls(proyecto_pk)
+    conditions = []
+    for name, value in data.items():
+        if name not in CONTROL_COLUMNS or name not in campos:
+            raise InvalidLookup(f"Unknown control: {name}")
+        if _TYPES[name] == "float8":
+            try:
+                value = float(value)
+            except (TypeError, ValueError) as exc:
+                raise InvalidLookup(f"Invalid value for {name}: {value}") from exc
+        else:
+            value = str(value)
+        conditions.append((name, value))
+    return conditions
+
+
+def _select(fields: list, conditions: list):
+    return sql.SQL("SELECT {} FROM {} WHERE {}").format(
+        sql.SQL(", ").join(sql.Identifier(field) for field in fields),
+        sql.Identifier(TARGET_TABLE),
+        sql.SQL(" AND ").join(
+            sql.SQL("{} = %s").format(sql.Identifier(name)) for name in conditions
+        ),
+    )
+
+
+def _fetch(query, params: list, fields: list, prepare: bool = False) -> list:
+    with connection.cursor() as cursor:
+        # The psycopg cursor behind Django's wrapper, to keep the prepared
+        # statement on the connection
+        raw = cursor.cursor
+        raw.execute(query, params, prepare=prepare or None)
+        return [dict(zip(fields, row, strict=True)) for row in raw.fetchall()]
+
+
+def fetch_by_key(proyecto_pk, scenario_key: int, fields: list) -> list:
+    """
+    The row of the scenario ``scenario_key``, as dicts of ``fields``.
+    """
+    query = _select(fields, ["project_id", "scenario_key"])
+    return _fetch(query, [UUID(str(proyecto_pk)), scenario_key], fields, prepare=True)
+
+
+def fetch_filtered(proyecto_pk, conditions: list, fields: list) -> list:
+    """
+    Rows matching ``conditions`` (see typed_conditions), as dicts of
+    ``fields``.
+    """
+    query = _select(fields, ["project_id", *[name for name, _ in conditions]])
+    params = [UUID(str(proyecto_pk)), *[value for _, value in conditions]]
+    return _fetch(query, params, fields)
+
+
+def fetch_by_keys(proyecto_pk, keys, fields: list) -> dict:
+    """
+    Rows of several scenarios in one query, as dicts of ``fields`` (plus
+    ``scenario_key``) by scenario_key.
+    """
+    columns = fields if "scenario_key" in fields else [*fields, "scenario_key"]
+    query = sql.SQL(
+        "SELECT {} FROM {} WHERE project_id = %s AND scenario_key = ANY(%s)"
+    ).format(
+        sql.SQL(", ").join(sql.Identifier(column) for column in columns),
+        sql.Identifier(TARGET_TABLE),
+    )
+    params = [UUID(str(proyecto_pk)), [int(key) for key in keys]]
+    rows = _fetch(query, params, columns, prepare=True)
+    return {row["scenario_key"]: row for row in rows}
+
+
+def evaluate_keys(proyecto_pk, keys) -> dict:
+    """
+    Evaluates scenarios that are not stored, in one pass.
+
+    Returns:
+        Full rows (ROW_COLUMNS order, ``id`` 0) by scenario_key, ``[]`` for
+        the scenarios the scalar path rejects.
+    """
+    rows = {key: [] for key in keys}
+    for row in get_evaluator(proyecto_pk).key_rows(keys):
+        rows[row[0]] = [0, str(proyecto_pk), *row[1:], row[0]]
+    return rows
+
+
+def evaluate_key(proyecto_pk, scenario_key: int, version: int = None) -> list:
+    """
+    Same as evaluate_keys for one scenario, shared by concurrent lookups.
+    """
+    return cached_result(
+        proyecto_pk,
+        scenario_key,
+        lambda: evaluate_keys(proyecto_pk, [scenario_key])[scenario_key],
+        version,
+    )
+
+
+def resolve_scenarios(proyecto_pk, scenarios: list, fields: list) -> tuple:
+    """
+    Rows of several complete scenarios (control column -> option dicts), in
+    order, as dicts of ``fields``: from the factor tables or the scenario
+    cube when the project has them, then from one query by scenario_key,
+    and the scenarios not stored yet from one evaluation.
+
+    Returns:
+        ``(results, keys)``: one dict per scenario, ``None`` for scenarios
+        not in the project options, and their scenario_key.
+
+    Raises:
+        InvalidLookup: A scenario is not a complete set of the project's
+            controls.
+    """
+    context = lookup_context(proyecto_pk)
+    for data in scenarios:
+        if not isinstance(data, dict):
+            raise InvalidLookup("Every scenario must be an object")
+        typed_conditions(proyecto_pk, data, context.campos)
+        missing = [campo for campo in CONTROL_COLUMNS if campo not in data]
+        if missing:
+            raise InvalidLookup(f"Missing controls: {', '.join(missing)}")
+
+    store = open_factors(proyecto_pk) or open_cube(proyecto_pk)
+    keys = [(store or context).key(data) for data in scenarios]
+
+    results = [None] * len(scenarios)
+    # scenario_key -> positions still to answer
+    pending = {}
+    for i, key in enumerate(keys):
+        if key is None:
+            continue
+        row = store.row(key) if store else None
+        if row is None:
+            pending.setdefault(key, []).append(i)
+        elif row:
+            results[i] = project_row(row, fields)
+    if not pending:
+        return results, keys
+
+    found = fetch_by_keys(proyecto_pk, pending, fields)
+    missing = [key for key in pending if key not in found]
+    evaluated = {}
+    if missing:
+        evaluated = cached_results(
+            proyecto_pk,
+            missing,
+            lambda keys: evaluate_keys(proyecto_pk, keys),
+            version=context.version,
+        )
+    for key, positions in pending.items():
+        if key in found:
+            row = {field: found[key][field] for field in fields}
+        elif evaluated.get(key):
+            row = project_row(evaluated[key], fields)
+        else:
+            row = None
+        for i in positions:
+            results[i] = row
+    return results, keys
+
+
+def scenario_deltas(results: list, baseline: int = 0) -> list:
+    """
+    Differences of the indicators of every result to those of
+    ``results[baseline]``, ``None`` where either scenario is missing.
+    """
+    if not 0 <= baseline < len(results):
+        raise InvalidLookup(f"Invalid baseline: {baseline}")
+    base = results[baseline]
+    deltas = []
+    for row in results:
+        if row is None or base is None:
+            deltas.append(None)
+            continue
+        deltas.append(
+            {name: row[name] - base[name] for name in INDICATOR_COLUMNS if name in row}
+        )
+    return deltas
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.11 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0018_auto_20240918_1611'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='proyecto',
+            name='geometry_settings',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
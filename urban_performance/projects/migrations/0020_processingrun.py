@@ -0,0 +1,31 @@
+# Generated by Django 4.2.11 on 2026-10-18 12:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0019_proyecto_geometry_settings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessingRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('creado_el', models.DateTimeField(auto_now_add=True)),
+                ('wall_time', models.FloatField(default=0)),
+                ('cpu_time', models.FloatField(default=0)),
+                ('reused', models.IntegerField(default=0)),
+                ('computed', models.IntegerField(default=0)),
+                ('stages', models.JSONField(default=dict)),
+                ('nodes', models.JSONField(default=list)),
+                ('proyecto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='projects.proyecto')),
+            ],
+            options={
+                'ordering': ['-creado_el'],
+            },
+        ),
+    ]
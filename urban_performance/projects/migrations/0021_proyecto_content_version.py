@@ -0,0 +1,18 @@
+# Generated by Django 4.2.11 on 2026-10-18 13:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0020_processingrun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='proyecto',
+            name='content_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
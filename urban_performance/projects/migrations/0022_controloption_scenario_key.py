@@ -0,0 +1,214 @@
+# Generated by Django 4.2.11 on 2026-10-18 14:00
+
+import logging
+
+from django.db import migrations, models, transaction
+import django.db.models.deletion
+
+logger = logging.getLogger(__name__)
+
+# Kept as of this migration: later versions of the app may change them
+CONTROL_COLUMNS = [
+    "population_",
+    "footprint",
+    "transit",
+    "nbs",
+    "energy_efficiency",
+    "solar_energy",
+    "rwh",
+    "hospitals",
+    "schools",
+    "sport_centers",
+    "clinics",
+    "daycare",
+    "green_areas",
+    "infrastructure",
+    "jobs",
+    "permeable_areas",
+]
+NUMERIC_COLUMNS = ["energy_efficiency", "solar_energy"]
+PARTIALS_VERSION = 3
+
+
+def _reprocess(proyecto_pks):
+    from config.celery_app import app
+    from django.core.cache import cache
+
+    try:
+        # Progress readers fall back to the project row (processing) until
+        # the runs start, instead of the cached state of the last run
+        cache.delete_many([f"projects:progress:{pk}" for pk in proyecto_pks])
+        for pk in proyecto_pks:
+            app.send_task(
+                "urban_performance.projects.tasks.process_project_controls",
+                kwargs={"proyecto_pk": str(pk)},
+            )
+    except Exception:
+        # Lookups of these projects schedule it again (StalePartials)
+        logger.exception("Could not schedule the reprocessing of %s", proyecto_pks)
+
+
+def backfill_scenario_keys(apps, schema_editor):
+    """
+    Creates the ControlOption rows of the projects whose partial results
+    list their options and keys their stored rows. Rows of other projects
+    cannot be keyed: they are dropped and the projects are processed again.
+    """
+    Proyecto = apps.get_model("projects", "Proyecto")
+    ControlOption = apps.get_model("projects", "ControlOption")
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "select distinct project_id from public.urban_performance_controls"
+        )
+        stored = {project_id for (project_id,) in cursor.fetchall()}
+    stale = []
+    for pk, partial_processing in Proyecto.objects.values_list(
+        "pk", "partial_processing"
+    ):
+        partial_processing = partial_processing or {}
+        options = partial_processing.get("options")
+        if partial_processing.get("version") != PARTIALS_VERSION or not options:
+            if pk in stored:
+                stale.append(pk)
+            continue
+        ControlOption.objects.bulk_create(
+            ControlOption(proyecto_id=pk, campo=campo, codigo=codigo, valor=str(valor))
+            for campo, values in zip(CONTROL_COLUMNS, options)
+            for codigo, valor in enumerate(values)
+        )
+        if pk not in stored:
+            continue
+        # Mixed-radix number of the option codes, last control fastest. Rows
+        # with a value outside the options get null.
+        terms, params, weight = [], [], 1
+        for campo, values in reversed(list(zip(CONTROL_COLUMNS, options))):
+            if campo in NUMERIC_COLUMNS:
+                position = f"array_position(%s::float8[], {campo})"
+                params.append([float(value) for value in values])
+            else:
+                position = f"array_position(%s::text[], {campo})"
+                params.append([str(value) for value in values])
+            terms.append(f"({position} - 1)::bigint * {weight}")
+            weight *= len(values)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "update public.urban_performance_controls set scenario_key = "
+                + " + ".join(terms)
+                + " where project_id = %s",
+                [*params, pk],
+            )
+
+    with connection.cursor() as cursor:
+        # Scenarios outside the options (evaluated on lookup if still valid)
+        # and the rows of the stale projects
+        cursor.execute(
+            "delete from public.urban_performance_controls where scenario_key is null"
+        )
+    if stale:
+        Proyecto.objects.filter(pk__in=stale).update(estatus="PR")
+        transaction.on_commit(lambda: _reprocess(stale), using=connection.alias)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0021_proyecto_content_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ControlOption',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('campo', models.CharField(max_length=100)),
+                ('codigo', models.PositiveSmallIntegerField()),
+                ('valor', models.CharField(max_length=255)),
+                ('proyecto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='projects.proyecto')),
+            ],
+            options={
+                'ordering': ['campo', 'codigo'],
+                'unique_together': {('proyecto', 'campo', 'codigo')},
+            },
+        ),
+        # Scenarios are identified by one bigint (the mixed-radix combination
+        # of their ControlOption codes) instead of the 16 text columns, which
+        # are kept for reading only. Stored rows are keyed from the options
+        # in their project's partial results; projects processed before the
+        # options were stored are processed again.
+        migrations.RunSQL(
+            "alter table public.urban_performance_controls add column scenario_key bigint;",
+            reverse_sql="alter table public.urban_performance_controls drop column scenario_key;",
+        ),
+        migrations.RunPython(backfill_scenario_keys, migrations.RunPython.noop),
+        migrations.RunSQL(
+            """
+            alter table public.urban_performance_controls alter column scenario_key set not null;
+
+            alter table public.urban_performance_controls drop constraint if exists urban_performance_controls_project_id_population__footprint_transit_nbs_en_key;
+
+            drop index if exists idx_urban_performance_controls_project_id;
+            drop index if exists idx_urban_performance_controls_population_;
+            drop index if exists idx_urban_performance_controls_footprint;
+            drop index if exists idx_urban_performance_controls_transit;
+            drop index if exists idx_urban_performance_controls_nbs;
+            drop index if exists idx_urban_performance_controls_hospitals;
+            drop index if exists idx_urban_performance_controls_schools;
+            drop index if exists idx_urban_performance_controls_sports_centers;
+            drop index if exists idx_urban_performance_controls_clinics;
+            drop index if exists idx_urban_performance_controls_daycare;
+            drop index if exists idx_urban_performance_controls_green_areas;
+            drop index if exists idx_urban_performance_controls_infrastructure;
+            drop index if exists idx_urban_performance_controls_jobs;
+            drop index if exists idx_urban_performance_controls_permeable_areas;
+            drop index if exists idx_urban_performance_controls_energy_efficiency;
+            drop index if exists idx_urban_performance_controls_solar_energy;
+            drop index if exists idx_urban_performance_controls_rwh;
+
+            create unique index urban_performance_controls_scenario_key on public.urban_performance_controls (project_id, scenario_key);
+            """,
+            reverse_sql="""
+            drop index if exists urban_performance_controls_scenario_key;
+
+            alter table public.urban_performance_controls alter column scenario_key drop not null;
+
+            alter table public.urban_performance_controls add constraint urban_performance_controls_project_id_population__footprint_transit_nbs_en_key unique (
+                project_id,
+                population_,
+                footprint,
+                transit,
+                nbs,
+                energy_efficiency,
+                solar_energy,
+                rwh,
+                hospitals,
+                schools,
+                sport_centers,
+                clinics,
+                daycare,
+                green_areas,
+                infrastructure,
+                jobs,
+                permeable_areas
+            );
+
+            create index idx_urban_performance_controls_project_id on public.urban_performance_controls (project_id);
+            create index idx_urban_performance_controls_population_ on public.urban_performance_controls (population_);
+            create index idx_urban_performance_controls_footprint on public.urban_performance_controls (footprint);
+            create index idx_urban_performance_controls_transit on public.urban_performance_controls (transit);
+            create index idx_urban_performance_controls_nbs on public.urban_performance_controls (nbs);
+            create index idx_urban_performance_controls_hospitals on public.urban_performance_controls (hospitals);
+            create index idx_urban_performance_controls_schools on public.urban_performance_controls (schools);
+            create index idx_urban_performance_controls_sports_centers on public.urban_performance_controls (sport_centers);
+            create index idx_urban_performance_controls_clinics on public.urban_performance_controls (clinics);
+            create index idx_urban_performance_controls_daycare on public.urban_performance_controls (daycare);
+            create index idx_urban_performance_controls_green_areas on public.urban_performance_controls (green_areas);
+            create index idx_urban_performance_controls_infrastructure on public.urban_performance_controls (infrastructure);
+            create index idx_urban_performance_controls_jobs on public.urban_performance_controls (jobs);
+            create index idx_urban_performance_controls_permeable_areas on public.urban_performance_controls (permeable_areas);
+            create index idx_urban_performance_controls_energy_efficiency on public.urban_performance_controls (energy_efficiency);
+            create index idx_urban_performance_controls_solar_energy on public.urban_performance_controls (solar_energy);
+            create index idx_urban_performance_controls_rwh on public.urban_performance_controls (rwh);
+            """,
+        ),
+    ]
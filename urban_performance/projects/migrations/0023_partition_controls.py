@@ -0,0 +1,223 @@
+# Generated by Django 4.2.11 on 2026-10-18 16:00
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0022_controloption_scenario_key'),
+    ]
+
+    operations = [
+        # urban_performance_controls is list partitioned by project_id: one
+        # partition per project, created and attached by save_values and
+        # dropped instead of deleting rows (see projects/partitions.py).
+        # Partitioned tables cannot have identity columns or a unique id, so
+        # id takes its default from a sequence. Stored rows are moved to
+        # their project's partition.
+        migrations.RunSQL(
+            """
+            alter table public.urban_performance_controls rename to urban_performance_controls_unpartitioned;
+            alter index public.urban_performance_controls_scenario_key rename to urban_performance_controls_unpartitioned_scenario_key;
+
+            create sequence public.urban_performance_controls_row_id as integer;
+
+            create table public.urban_performance_controls (
+                id integer not null default nextval('public.urban_performance_controls_row_id'),
+                project_id uuid not null,
+                population_ text not null,
+                footprint text not null,
+                transit text not null,
+                nbs text not null,
+                energy_efficiency double precision not null,
+                solar_energy double precision not null,
+                rwh text not null,
+                hospitals text not null,
+                schools text not null,
+                sport_centers text not null,
+                clinics text not null,
+                daycare text not null,
+                green_areas text not null,
+                infrastructure text not null,
+                jobs text not null,
+                permeable_areas text not null,
+                fp_area double precision not null,
+                fp_base_area double precision not null,
+                pop_2050 double precision not null,
+                pop_base double precision not null,
+                exposed_area double precision not null,
+                pc_exposed_tr double precision not null,
+                pc_exposed_hp double precision not null,
+                pc_exposed_sc double precision not null,
+                pc_exposed_infra double precision not null,
+                inter_pop double precision not null,
+                pc_exposed_pop double precision not null,
+                pc_pop_hp double precision not null,
+                pc_pop_sc double precision not null,
+                pc_pop_sp double precision not null,
+                pc_pop_cl double precision not null,
+                pc_pop_dc double precision not null,
+                pc_pop_uga double precision not null,
+                pop_density double precision not null,
+                urban_expansion_area double precision not null,
+                jobs_density double precision not null,
+                vg_area_loss double precision not null,
+                permeable_area double precision not null,
+                change_electricity_consumption double precision not null,
+                electricity_consumption double precision not null,
+                electricity_consumption_buildings double precision not null,
+                electricity_consumption_ee double precision not null,
+                electricity_consumption_ee_per_capita double precision not null,
+                emissions_tot_tr double precision not null,
+                transport_emissions_per_capita double precision not null,
+                solar_energy_generation double precision not null,
+                public_lighting_energy_consumption double precision not null,
+                maintenance_fp double precision not null,
+                maintenance_tr double precision not null,
+                maintenance_cost double precision not null,
+                school_c_cost double precision not null,
+                new_sc double precision not null,
+                hospital_c_cost double precision not null,
+                new_hp double precision not null,
+                sp_c_cost double precision not null,
+                new_sp double precision not null,
+                clinic_c_cost double precision not null,
+                new_cl double precision not null,
+                daycare_c_cost double precision not null,
+                new_dc double precision not null,
+                ga_c_cost double precision not null,
+                capital_cost double precision not null,
+                capital_solar_1 double precision not null,
+                capital_solar double precision not null,
+                uga_area double precision not null,
+                uga_per_capita double precision not null,
+                increased_kvr double precision not null,
+                expected_vmt double precision not null,
+                increase_bicycle double precision not null,
+                increase_private double precision not null,
+                increase_public_transport double precision not null,
+                pc_media_hu double precision not null,
+                pc_popular_hu double precision not null,
+                pc_residencial_hu double precision not null,
+                water_consumption double precision not null,
+                energy_consumption_water_supply double precision not null,
+                scenario_key bigint not null
+            ) partition by list (project_id);
+
+            alter sequence public.urban_performance_controls_row_id owned by public.urban_performance_controls.id;
+
+            create unique index urban_performance_controls_scenario_key on public.urban_performance_controls (project_id, scenario_key);
+
+            do $$
+            declare
+                project uuid;
+            begin
+                for project in select distinct project_id from public.urban_performance_controls_unpartitioned loop
+                    execute format(
+                        'create table public.%I partition of public.urban_performance_controls for values in (%L)',
+                        'urban_performance_controls_p_' || replace(project::text, '-', ''),
+                        project
+                    );
+                end loop;
+            end $$;
+
+            insert into public.urban_performance_controls select * from public.urban_performance_controls_unpartitioned;
+
+            select setval('public.urban_performance_controls_row_id', coalesce(max(id), 0) + 1, false) from public.urban_performance_controls;
+
+            drop table public.urban_performance_controls_unpartitioned;
+            """,
+            reverse_sql="""
+            create table public.urban_performance_controls_unpartitioned (
+                id integer generated always as identity unique,
+                project_id uuid not null,
+                population_ text not null,
+                footprint text not null,
+                transit text not null,
+                nbs text not null,
+                energy_efficiency double precision not null,
+                solar_energy double precision not null,
+                rwh text not null,
+                hospitals text not null,
+                schools text not null,
+                sport_centers text not null,
+                clinics text not null,
+                daycare text not null,
+                green_areas text not null,
+                infrastructure text not null,
+                jobs text not null,
+                permeable_areas text not null,
+                fp_area double precision not null,
+                fp_base_area double precision not null,
+                pop_2050 double precision not null,
+                pop_base double precision not null,
+                exposed_area double precision not null,
+                pc_exposed_tr double precision not null,
+                pc_exposed_hp double precision not null,
+                pc_exposed_sc double precision not null,
+                pc_exposed_infra double precision not null,
+                inter_pop double precision not null,
+                pc_exposed_pop double precision not null,
+                pc_pop_hp double precision not null,
+                pc_pop_sc double precision not null,
+                pc_pop_sp double precision not null,
+                pc_pop_cl double precision not null,
+                pc_pop_dc double precision not null,
+                pc_pop_uga double precision not null,
+                pop_density double precision not null,
+                urban_expansion_area double precision not null,
+                jobs_density double precision not null,
+                vg_area_loss double precision not null,
+                permeable_area double precision not null,
+                change_electricity_consumption double precision not null,
+                electricity_consumption double precision not null,
+                electricity_consumption_buildings double precision not null,
+                electricity_consumption_ee double precision not null,
+                electricity_consumption_ee_per_capita double precision not null,
+                emissions_tot_tr double precision not null,
+                transport_emissions_per_capita double precision not null,
+                solar_energy_generation double precision not null,
+                public_lighting_energy_consumption double precision not null,
+                maintenance_fp double precision not null,
+                maintenance_tr double precision not null,
+                maintenance_cost double precision not null,
+                school_c_cost double precision not null,
+                new_sc double precision not null,
+                hospital_c_cost double precision not null,
+                new_hp double precision not null,
+                sp_c_cost double precision not null,
+                new_sp double precision not null,
+                clinic_c_cost double precision not null,
+                new_cl double precision not null,
+                daycare_c_cost double precision not null,
+                new_dc double precision not null,
+                ga_c_cost double precision not null,
+                capital_cost double precision not null,
+                capital_solar_1 double precision not null,
+                capital_solar double precision not null,
+                uga_area double precision not null,
+                uga_per_capita double precision not null,
+                increased_kvr double precision not null,
+                expected_vmt double precision not null,
+                increase_bicycle double precision not null,
+                increase_private double precision not null,
+                increase_public_transport double precision not null,
+                pc_media_hu double precision not null,
+                pc_popular_hu double precision not null,
+                pc_residencial_hu double precision not null,
+                water_consumption double precision not null,
+                energy_consumption_water_supply double precision not null,
+                scenario_key bigint not null
+            );
+
+            insert into public.urban_performance_controls_unpartitioned overriding system value select * from public.urban_performance_controls;
+
+            drop table public.urban_performance_controls;
+
+            alter table public.urban_performance_controls_unpartitioned rename to urban_performance_controls;
+
+            create unique index urban_performance_controls_scenario_key on public.urban_performance_controls (project_id, scenario_key);
+            """,
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 4.2.11 on 2026-10-18 17:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0023_partition_controls'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='proyecto',
+            name='scenarios_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        # Partitions are named after their result set version, see
+        # projects/partitions.py. The ones created by 0023 are version 0.
+        migrations.RunSQL(
+            """
+            do $$
+            declare
+                part text;
+            begin
+                for part in
+                    select c.relname from pg_inherits h join pg_class c on c.oid = h.inhrelid
+                    where h.inhparent = 'public.urban_performance_controls'::regclass
+                loop
+                    execute format(
+                        'alter table public.%I rename to %I',
+                        part,
+                        'scenarios_' || substr(part, 30) || '_v0'
+                    );
+                end loop;
+            end $$;
+            """,
+            reverse_sql="""
+            do $$
+            declare
+                part text;
+            begin
+                for part in
+                    select c.relname from pg_inherits h join pg_class c on c.oid = h.inhrelid
+                    where h.inhparent = 'public.urban_performance_controls'::regclass
+                loop
+                    execute format(
+                        'alter table public.%I rename to %I',
+                        part,
+                        'urban_performance_controls_p_' || substr(part, 11, 32)
+                    );
+                end loop;
+            end $$;
+            """,
+        ),
+    ]
@@ -60,6 +60,15 @@ class Proyecto(models.Model):
     niveles = models.JSONField(default=dict)
     partial_processing = models.JSONField(default=dict)
     progress = models.SmallIntegerField(default=0)
+    # Simplification applied at ingest to the analysis artifact of each
+    # layer type, e.g. {"HZ": {"tolerance": 5, "grid": 0.01}} (meters).
+    geometry_settings = models.JSONField(default=dict, blank=True)
+    # Bumped whenever the partial results or the assumptions change, keys the
+    # compiled scenario evaluators (projects.evaluator_cache).
+    content_version = models.PositiveIntegerField(default=0)
+    # Result set of urban_performance_controls the project reads from: runs
+    # build a new one and swap it in when done (projects.partitions).
+    scenarios_version = models.PositiveIntegerField(default=0)
 
     class Meta:
         unique_together = (
@@ -74,6 +83,53 @@ class Proyecto(models.Model):
         return f"{self.nombre}"
 
 
+class ProcessingRun(models.Model):
+    """
+    Timings of one process_project_controls run, see
+    urban_performance.projects.instrumentation.
+    """
+
+    proyecto = models.ForeignKey(Proyecto, on_delete=models.CASCADE)
+    creado_el = models.DateTimeField(auto_now_add=True)
+    wall_time = models.FloatField(default=0)
+    cpu_time = models.FloatField(default=0)
+    reused = models.IntegerField(default=0)
+    computed = models.IntegerField(default=0)
+    # Wall/CPU time, count per operation (overlay, sjoin, buffer...)
+    stages = models.JSONField(default=dict)
+    # Evaluated graph nodes with the spans of their geometry operations
+    nodes = models.JSONField(default=list)
+
+    class Meta:
+        ordering = ["-creado_el"]
+
+    def __str__(self):
+        return f"{self.proyecto.nombre} - {self.creado_el:%Y-%m-%d %H:%M}"
+
+
+class ControlOption(models.Model):
+    """
+    Integer code of one option (a file name or a numeric value) of a control
+    dimension. Codes are the option positions in
+    ``partial_processing["options"]``; ``scenario_key`` in
+    urban_performance_controls is their mixed-radix combination, see
+    urban_performance.projects.evaluator.
+    """
+
+    proyecto = models.ForeignKey(Proyecto, on_delete=models.CASCADE)
+    # urban_performance_controls column, as Control.campo
+    campo = models.CharField(max_length=100)
+    codigo = models.PositiveSmallIntegerField()
+    valor = models.CharField(max_length=255)
+
+    class Meta:
+        unique_together = ("proyecto", "campo", "codigo")
+        ordering = ["campo", "codigo"]
+
+    def __str__(self):
+        return f"{self.proyecto.nombre} - {self.campo}: {self.codigo} {self.valor}"
+
+
 class Control(models.Model):
     proyecto = models.ForeignKey(Proyecto, on_delete=models.CASCADE)
     nombre = models.CharField(max_length=100)
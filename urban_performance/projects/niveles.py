@@ -0,0 +1,157 @@
+import numpy as np
+
+from urban_performance.projects.evaluator import INDICATOR_COLUMNS
+
+# Per-indicator statistics of the evaluated scenarios, computed by every
+# chunk task from its vectorized block and merged along the chord that runs
+# the chunks, so Proyecto.niveles needs no scan of urban_performance_controls.
+# merge_stats is commutative and associative: chunks may finish in any order.
+#
+# Optionally (NIVELES_SKETCH_SIZE > 0) each indicator also keeps a quantile
+# sketch: at most that many (value, weight) centroids, recompressed on every
+# merge.
+
+QUANTILES = [0.1, 0.25, 0.5, 0.75, 0.9]
+
+
+def _compress(centroids, size: int) -> list:
+    """
+    Reduces ``(value, weight)`` centroids to at most ``size``, each holding
+    about the same weight.
+    """
+    if len(centroids) <= size:
+        return sorted(centroids)
+    centroids = np.array(sorted(centroids))
+    values, weights = centroids[:, 0], centroids[:, 1]
+    before = np.cumsum(weights) - weights
+    bins = np.minimum((before / weights.sum() * size).astype(np.int64), size - 1)
+    totals = np.bincount(bins, weights=weights, minlength=size)
+    sums = np.bincount(bins, weights=values * weights, minlength=size)
+    used = totals > 0
+    return [
+        [v, w]
+        for v, w in zip(
+            (sums[used] / totals[used]).tolist(), totals[used].tolist(), strict=True
+        )
+    ]
+
+
+def block_stats(values, valid, sketch_size: int = 0) -> dict:
+    """
+    Statistics of a block of scenarios.
+
+    Only finite values take part, so a NaN or infinite indicator of a
+    scenario (e.g. a division by zero) is left out of that indicator's
+    statistics but the scenario is still counted.
+
+    Args:
+        values: (scenarios, INDICATOR_COLUMNS) array, see
+            CompiledEvaluator.block.
+        valid: Mask of the scenarios that are stored.
+        sketch_size: Centroids kept per indicator, 0 for none.
+
+    Returns:
+        ``{"count", "counts", "min", "max", "sum"[, "sketch"]}``: the stored
+        scenarios, then lists in INDICATOR_COLUMNS order (finite values per
+        indicator, ``None`` for indicators without any).
+    """
+    values = values[valid]
+    count = len(values)
+    if not count:
+        return {"count": 0}
+    finite = np.isfinite(values)
+    counts = finite.sum(axis=0)
+    some = counts > 0
+    stats = {
+        "count": count,
+        "counts": counts.tolist(),
+        "min": _or_none(np.where(finite, values, np.inf).min(axis=0), some),
+        "max": _or_none(np.where(finite, values, -np.inf).max(axis=0), some),
+        "sum": np.where(finite, values, 0).sum(axis=0).tolist(),
+    }
+    if sketch_size:
+        stats["sketch"] = []
+        for column, ok in zip(values.T, finite.T, strict=True):
+            column = np.sort(column[ok])
+            groups = np.array_split(column, min(sketch_size, len(column)) or 1)
+            stats["sketch"].append(
+                [[float(g.mean()), len(g)] for g in groups if len(g)]
+            )
+    return stats
+
+
+def _or_none(values, some) -> list:
+    return [
+        value if ok else None
+        for value, ok in zip(values.tolist(), some.tolist(), strict=True)
+    ]
+
+
+def _pick(function, x, y):
+    if x is None or y is None:
+        return y if x is None else x
+    return function(x, y)
+
+
+def merge_stats(a: dict, b: dict, sketch_size: int = 0) -> dict:
+    """
+    Combines the statistics of two disjoint sets of scenarios. ``failed``
+    (chunks that could not be stored) is added up.
+    """
+    failed = (a or {}).get("failed", 0) + (b or {}).get("failed", 0)
+    merged = _merge(a, b, sketch_size)
+    return {**merged, "failed": failed} if failed else merged
+
+
+def _merge(a: dict, b: dict, sketch_size: int) -> dict:
+    if not a or not a.get("count"):
+        return b or {"count": 0}
+    if not b or not b.get("count"):
+        return a
+    merged = {
+        "count": a["count"] + b["count"],
+        "counts": [x + y for x, y in zip(a["counts"], b["counts"], strict=True)],
+        "min": [_pick(min, x, y) for x, y in zip(a["min"], b["min"], strict=True)],
+        "max": [_pick(max, x, y) for x, y in zip(a["max"], b["max"], strict=True)],
+        "sum": [x + y for x, y in zip(a["sum"], b["sum"], strict=True)],
+    }
+    if sketch_size and "sketch" in a and "sketch" in b:
+        merged["sketch"] = [
+            _compress(x + y, sketch_size)
+            for x, y in zip(a["sketch"], b["sketch"], strict=True)
+        ]
+    return merged
+
+
+def _quantile(centroids, q: float) -> float:
+    values = np.array([value for value, _ in centroids])
+    weights = np.array([weight for _, weight in centroids], dtype=float)
+    midpoints = (np.cumsum(weights) - weights / 2) / weights.sum()
+    return float(np.interp(q, midpoints, values))
+
+
+def niveles_from_stats(stats: dict, campos) -> dict:
+    """
+    Builds Proyecto.niveles for the indicator columns ``campos``.
+    """
+    niveles = {}
+    if not stats.get("count"):
+        return niveles
+    position = {name: i for i, name in enumerate(INDICATOR_COLUMNS)}
+    for campo in campos:
+        i = position.get(campo.lower())
+        if i is None:
+            continue
+        counted = stats["counts"][i]
+        nivel = {
+            "menor": stats["min"][i],
+            "mayor": stats["max"][i],
+            "promedio": stats["sum"][i] / counted if counted else None,
+            "conteo": stats["count"],
+        }
+        if "sketch" in stats and stats["sketch"][i]:
+            nivel["cuantiles"] = {
+                str(q): _quantile(stats["sketch"][i], q) for q in QUANTILES
+            }
+        niveles[campo.lower()] = nivel
+    return niveles
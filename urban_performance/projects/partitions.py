@@ -0,0 +1,208 @@
+from uuid import UUID
+
+from django.db import DatabaseError, connection, transaction
+from psycopg import sql
+
+from urban_performance.projects.bulk import TARGET_TABLE
+from urban_performance.projects.models import Proyecto
+
+# urban_performance_controls is list partitioned by project_id (migration
+# 0023). Each processing run writes a new result set of the project, one
+# table named after its version:
+#
+#   scenarios_<uuid hex>_v<version>
+#
+# The table is created unlogged and detached, so chunk tasks write to it
+# without WAL while readers keep using the attached (active) result set. Its
+# unique (project_id, scenario_key) index exists from the start, so a chunk
+# delivered twice (acks_late, a lost worker) is merged instead of duplicated
+# (see bulk.copy_controls). activate_result_set makes it durable, clusters it
+# in scenario_key order, and swaps it in as the project's partition, moving
+# Proyecto.scenarios_version in the same transaction. Previous result sets are then dropped by drop_result_sets,
+# so no row-level DELETE touches the indexes of other projects.
+#
+# Runs may overlap: a result set is only swapped in over older versions, so
+# an older run finishing late never replaces the results of a newer one.
+
+PARTITION_PREFIX = "scenarios_"
+
+
+def _prefix(proyecto_pk) -> str:
+    return f"{PARTITION_PREFIX}{UUID(str(proyecto_pk)).hex}_v"
+
+
+def partition_name(proyecto_pk, version: int) -> str:
+    return f"{_prefix(proyecto_pk)}{version}"
+
+
+def next_version(proyecto: Proyecto) -> int:
+    """
+    Version of the result set a new run of ``proyecto`` writes.
+    """
+    return max(proyecto.content_version, proyecto.scenarios_version + 1)
+
+
+def _exists(name: str) -> bool:
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [f"public.{name}"])
+        return cursor.fetchone()[0]
+
+
+def _drop(cursor, name: str):
+    cursor.execute(
+        "SELECT EXISTS (SELECT 1 FROM pg_inherits WHERE inhrelid = to_regclass(%s))",
+        [f"public.{name}"],
+    )
+    if cursor.fetchone()[0]:
+        cursor.execute(
+            sql.SQL("ALTER TABLE {} DETACH PARTITION {}").format(
+                sql.Identifier(TARGET_TABLE), sql.Identifier(name)
+            )
+        )
+    cursor.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(sql.Identifier(name)))
+
+
+def _index_name(name: str) -> str:
+    return f"{name}_key"
+
+
+def create_result_set(proyecto_pk, version: int) -> str:
+    """
+    Creates the empty table a run writes its scenarios to (see
+    bulk.copy_controls), with its unique index, replacing a leftover of the
+    same version.
+
+    Returns:
+        The table name.
+    """
+    name = partition_name(proyecto_pk, version)
+    with transaction.atomic(), connection.cursor() as cursor:
+        _drop(cursor, name)
+        cursor.execute(
+            sql.SQL("CREATE UNLOGGED TABLE {} (LIKE {} INCLUDING DEFAULTS)").format(
+                sql.Identifier(name), sql.Identifier(TARGET_TABLE)
+            )
+        )
+        cursor.execute(
+            sql.SQL("CREATE UNIQUE INDEX {} ON {} (project_id, scenario_key)").format(
+                sql.Identifier(_index_name(name)), sql.Identifier(name)
+            )
+        )
+    return name
+
+
+def _active_version(proyecto_pk, lock: bool = False):
+    """
+    Version the project reads, ``None`` if the project is gone.
+    """
+    queryset = Proyecto.objects.filter(pk=proyecto_pk)
+    if lock:
+        queryset = queryset.select_for_update()
+    return queryset.values_list("scenarios_version", flat=True).first()
+
+
+def discard_result_set(proyecto_pk, version: int):
+    """
+    Drops the result set ``version`` unless the project reads it.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        if _active_version(proyecto_pk, lock=True) != version:
+            _drop(cursor, partition_name(proyecto_pk, version))
+
+
+def activate_result_set(proyecto_pk, version: int) -> bool:
+    """
+    Finishes the result set ``version`` and makes it the one read by the
+    project.
+
+    Refused when the table is missing (dropped for a newer run) or the
+    project already reads this or a newer version; a refused older result
+    set is dropped.
+
+    Returns:
+        Whether the result set was swapped in.
+    """
+    name = partition_name(proyecto_pk, version)
+    active = _active_version(proyecto_pk)
+    if active is None or version <= active:
+        discard_result_set(proyecto_pk, version)
+        return False
+    if not _exists(name):
+        return False
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                sql.SQL("ALTER TABLE {} SET LOGGED").format(sql.Identifier(name))
+            )
+            # Lets ATTACH skip scanning the rows
+            cursor.execute(
+                sql.SQL("ALTER TABLE {} ADD CONSTRAINT {} CHECK (project_id = {})")
+                .format(
+                    sql.Identifier(name),
+                    sql.Identifier(f"{name}_project"),
+                    sql.Literal(str(proyecto_pk)),
+                )
+            )
+            cursor.execute(
+                sql.SQL("CLUSTER {} USING {}").format(
+                    sql.Identifier(name), sql.Identifier(_index_name(name))
+                )
+            )
+            cursor.execute(sql.SQL("ANALYZE {}").format(sql.Identifier(name)))
+    except DatabaseError:
+        # Dropped meanwhile for a newer run
+        if not _exists(name):
+            return False
+        raise
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Serializes concurrent swaps of the project, checked again as a
+        # newer run may have been swapped in meanwhile
+        active = _active_version(proyecto_pk, lock=True)
+        if active is None or version <= active:
+            _drop(cursor, name)
+            return False
+        if not _exists(name):
+            return False
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits h JOIN pg_class c ON c.oid = h.inhrelid "
+            "WHERE h.inhparent = to_regclass(%s) AND starts_with(c.relname, %s)",
+            [f"public.{TARGET_TABLE}", _prefix(proyecto_pk)],
+        )
+        for (attached,) in cursor.fetchall():
+            cursor.execute(
+                sql.SQL("ALTER TABLE {} DETACH PARTITION {}").format(
+                    sql.Identifier(TARGET_TABLE), sql.Identifier(attached)
+                )
+            )
+        # The index is adopted as the partition of the parent's unique index
+        cursor.execute(
+            sql.SQL("ALTER TABLE {} ATTACH PARTITION {} FOR VALUES IN ({})").format(
+                sql.Identifier(TARGET_TABLE),
+                sql.Identifier(name),
+                sql.Literal(str(proyecto_pk)),
+            )
+        )
+        Proyecto.objects.filter(pk=proyecto_pk).update(scenarios_version=version)
+    return True
+
+
+def drop_result_sets(proyecto_pk, keep: int = None):
+    """
+    Drops the project's result sets older than version ``keep`` (all of them
+    when None). Newer ones may still be being written; an older run still
+    writing loses its table and is refused by activate_result_set.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT relname FROM pg_class WHERE relnamespace = 'public'::regnamespace "
+            "AND relkind = 'r' AND starts_with(relname, %s)",
+            [_prefix(proyecto_pk)],
+        )
+        names = [name for (name,) in cursor.fetchall()]
+    for name in names:
+        version = name[len(_prefix(proyecto_pk)):]
+        if keep is not None and (not version.isdigit() or int(version) >= keep):
+            continue
+        with transaction.atomic(), connection.cursor() as cursor:
+            _drop(cursor, name)
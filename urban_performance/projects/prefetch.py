@@ -0,0 +1,74 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from urban_performance.projects.evaluator_cache import get_evaluator
+from urban_performance.projects.lookup import evaluate_keys, fetch_by_keys
+from urban_performance.projects.result_cache import cached_results, result_version
+
+# Optional prefetch of the scenarios next to the ones users look up
+# (SCENARIO_PREFETCH_BUDGET > 0). Users move one control at a time, so after
+# a lookup the scenarios that differ from it in a single control (nearest
+# options first, at most the budget) are evaluated in the background into
+# the result cache, unless they are stored already.
+
+
+def neighbour_keys(radices, scenario_key: int, budget: int) -> list:
+    """
+    Returns the keys of the scenarios that differ from ``scenario_key`` in
+    one control, options closest to the current one first, at most
+    ``budget``.
+    """
+    radices = [int(radix) for radix in radices]
+    weights = [1] * len(radices)
+    for d in range(len(radices) - 2, -1, -1):
+        weights[d] = weights[d + 1] * radices[d + 1]
+    candidates = []
+    for d, (radix, weight) in enumerate(zip(radices, weights, strict=True)):
+        digit = scenario_key // weight % radix
+        for code in range(radix):
+            if code != digit:
+                candidates.append(
+                    (abs(code - digit), d, scenario_key + (code - digit) * weight)
+                )
+    candidates.sort()
+    return [key for _, _, key in candidates[:budget]]
+
+
+def should_prefetch(proyecto_pk, scenario_key: int, version: int = None) -> bool:
+    """
+    Whether to schedule the prefetch around a scenario: only once per
+    project version and scenario while the results stay cached.
+    """
+    if settings.SCENARIO_PREFETCH_BUDGET <= 0:
+        return False
+    if version is None:
+        version = result_version(proyecto_pk)
+    return cache.add(
+        f"projects:prefetch:{proyecto_pk}:{version}:{scenario_key}",
+        1,
+        settings.SCENARIO_RESULT_CACHE_TIMEOUT,
+    )
+
+
+def prefetch_neighbours(proyecto_pk, scenario_key: int) -> int:
+    """
+    Evaluates the neighbours of a scenario into the result cache, in one
+    pass. Returns how many were not stored nor cached yet.
+    """
+    evaluator = get_evaluator(proyecto_pk)
+    keys = neighbour_keys(
+        evaluator.radices, scenario_key, settings.SCENARIO_PREFETCH_BUDGET
+    )
+    if not keys:
+        return 0
+    stored = fetch_by_keys(proyecto_pk, keys, ["scenario_key"])
+    keys = [key for key in keys if key not in stored]
+    computed = []
+
+    def compute(missing):
+        computed.extend(missing)
+        return evaluate_keys(proyecto_pk, missing)
+
+    if keys:
+        cached_results(proyecto_pk, keys, compute, prefetch=True)
+    return len(computed)
@@ -0,0 +1,443 @@
+import os
+
+import geopandas as gpd
+import numpy as np
+from django.conf import settings
+
+from urban_performance.projects.geometry import (
+    ArealWeights,
+    dissolved_buffer,
+    keep_polygonal,
+)
+from urban_performance.projects.graph import Graph
+from urban_performance.projects.incremental import Reuse
+from urban_performance.projects.instrumentation import buffer, overlay, sjoin, span
+from urban_performance.projects.layers import read_layer
+
+# The preprocessing is a dependency graph (see urban_performance.projects.graph)
+# of the module-level functions below, built by build_graph from the picklable
+# ``context`` dict of process_project_controls:
+#
+#     root         -> project folder
+#     path         -> list of option folders (population/, footprints/, ...)
+#     files        -> option filenames per folder key
+#     base         -> paths of the base layers
+#     fingerprints -> content hash of every input file, by relative path
+#     previous     -> partial_processing of the previous run
+#
+# Intermediate nodes (population weights, hazard exposure, the population
+# base x NBS intersection, 800m facility buffers, 10m line buffers...) only
+# depend on the files they are built from, so each one is computed once per
+# run and shared by every entry that needs it instead of being rebuilt inside
+# the option loops. Entry nodes are the values stored in
+# ``partial_processing``; those whose input files did not change are taken
+# from the previous run.
+#
+# Nodes only produce geometric measurements (areas, lengths, counts and
+# population shares). Everything derived from assumptions_SP.csv (costs,
+# solar generation, lighting and water consumption) is applied when a
+# scenario is evaluated, so editing the assumptions needs no geometry work.
+
+PARTIAL_KEYS = ["partial_pop", "partial_fp", "partial_tr", "partial_perm"]
+
+
+# INTERMEDIATE NODES ¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬
+def population_total(pop_file):
+    # Get population
+    return round(read_layer(pop_file)["Pop_total"].sum(), 0)  # future population
+
+
+def population_weights(pop_file):
+    # Population blocks indexed once; every coverage metric is an
+    # areal-weighted sum of Pop_total over the covered share of each block.
+    pop_projected = read_layer(pop_file)
+    with span("index", pop_projected):
+        return ArealWeights(pop_projected, pop_projected["Pop_total"])
+
+
+def hazard_exposure(hazard_file, pop_weights, pop_2050):
+    exposure_polygon_projected = read_layer(hazard_file)
+
+    # Intersect population with hazards
+    with span(
+        "intersection", pop_weights.polygons, exposure_polygon_projected
+    ) as current:
+        hazard_index, hazard_pieces, hazard_areas = pop_weights.intersections(
+            exposure_polygon_projected
+        )
+        hazard_pieces = current.output(keep_polygonal(hazard_pieces[hazard_areas > 0]))
+    inter = gpd.GeoDataFrame(
+        geometry=hazard_pieces, crs=exposure_polygon_projected.crs
+    )
+
+    # Calculate area
+    exposed_area = hazard_areas.sum() / 1e4
+    hazard_pop = np.nansum(pop_weights.piece_values(hazard_index, hazard_areas))
+    exposed_pop = round(hazard_pop, 0)  # total population exposed to hazards
+    pc_exposed_pop = (
+        hazard_pop * 100 / pop_2050
+    )  # percentage of population exposed to hazards
+    if pc_exposed_pop > 100:
+        pc_exposed_pop = 100
+    return inter, exposed_area, exposed_pop, pc_exposed_pop
+
+
+def nbs_base_intersection(pop_base_file, nbs_file):
+    # Intersect population base with nbs_projected
+    return overlay(read_layer(pop_base_file), read_layer(nbs_file), how="intersection")
+
+
+def exposed_zones(exposure, inter_NBS):
+    inter = exposure[0]
+    return overlay(
+        inter, inter_NBS, how="difference", keep_geom_type=False
+    )  # Remove nbs
+
+
+def line_buffer(line_file):
+    # Create a buffer
+    buffered = buffer(read_layer(line_file), 10)  # change buffer i.e. 10m
+    return buffered, buffered.area.sum() / 1e6
+
+
+def facility_cover(facility_file):
+    # Dissolved 800m buffer
+    facilities = read_layer(facility_file)
+    with span("dissolve", facilities, detail="800m") as current:
+        return current.output(dissolved_buffer(facilities, 800))
+
+
+def transit_base_buffer(tr_base_file):
+    return buffer(read_layer(tr_base_file), 400)
+
+
+# ENTRY NODES ¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬
+# The {} slots of tuple entries are filled with their child entries.
+def population_values(pop_2050):
+    return (pop_2050, {}, {}, {}, {}, {}, {}, {}, {})
+
+
+def nbs_values(nbs_file, exposure):
+    _, exposed_area, exposed_pop, pc_exposed_pop = exposure
+    # Calculate area
+    nbs_area = read_layer(nbs_file).area.sum() / 1e6
+    return (exposed_area, exposed_pop, {}, {}, {}, {}, pc_exposed_pop, nbs_area)
+
+
+def exposed_line_share(buffered_lines, inter_exp):
+    buffered, buffered_area = buffered_lines
+    # Lines exposed to hazards
+    exposed = overlay(buffered, inter_exp, how="intersection")
+    # Count the number of intersecting points
+    count_exposed = exposed.area.sum() / 1e6
+    return (count_exposed * 100) / buffered_area  # percentage exposed to hazards
+
+
+def exposed_point_share(point_file, inter_exp):
+    points_projected = read_layer(point_file)
+    total = len(points_projected)
+    # exposed
+    exposed = sjoin(
+        points_projected, inter_exp, how="inner", predicate="intersects"
+    )
+    # Count the number of intersecting points
+    return (len(exposed) * 100) / total  # percentage exposed to hazards
+
+
+def population_near(pop_weights, cover, pop_2050):
+    with span("areal_weighting", pop_weights.polygons, cover):
+        pc_pop_near = pop_weights.weighted_sum(cover) * 100 / pop_2050
+    if pc_pop_near > 100:
+        pc_pop_near = 100
+    return pc_pop_near
+
+
+def green_area_values(uga_file, pop_weights, cover, pop_2050):
+    # green areas exposed to hazards
+    uga_area = read_layer(uga_file).area.sum() / 1e6
+    uga_per_capita = (uga_area / pop_2050) * 1e6  # green area per capita
+    # percentage of population near a green area
+    pc_pop_near_uga = population_near(pop_weights, cover, pop_2050)
+    return (
+        uga_area,
+        uga_per_capita,
+        pc_pop_near_uga,
+    )
+
+
+def housing_values(pop_file):
+    housing_types = read_layer(pop_file).melt(
+        id_vars=["CVEGEO"],  # Columns to keep as identifiers
+        value_vars=[
+            "Residencial_hu",
+            "Media_hu",
+            "Popular_hu",
+        ],  # Columns to unpivot
+        var_name="Housing_Type",  # Name for the new column containing the original column names
+        value_name="Value",  # Name for the new column containing the corresponding values
+    )
+    housing_types = housing_types.groupby(["Housing_Type"])["Value"].sum()
+    housing_types_pct = housing_types / housing_types.sum() * 100
+    # partial_ht
+    partial_ht = housing_types_pct.to_dict()  # Proportion of housing types
+    # Housing units per type, for the water consumption
+    partial_ht["units"] = housing_types.to_dict()
+    return partial_ht
+
+
+def facility_count(facility_file):
+    return len(read_layer(facility_file))
+
+
+def footprint_values(fp_file, fp_base_file, veg_cover_base_file, roads_base_file):
+    fp_base_projected = read_layer(fp_base_file)
+    veg_cover_base_projected = read_layer(veg_cover_base_file)
+    roads_base_projected = read_layer(roads_base_file)
+
+    # Read file
+    fp_projected = read_layer(fp_file)
+    # Footprint area
+    fp_area = fp_projected.area.sum() / 1e6
+
+    # URBAN EXPANSION |||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||
+    # Also the area charged with the expansion capital cost
+    urban_exp_poly = overlay(fp_projected, fp_base_projected, how="difference")
+    urban_expansion_area = urban_exp_poly.area.sum() / 1e6  # Urban expansion area
+
+    # VEGETAL COVER LOSS ||||||||||||||||||||||||||||||||||||||||||||||||||||||||||
+    vg_area_base = veg_cover_base_projected.area.sum() / 1e6
+    vg_loss = overlay(veg_cover_base_projected, fp_projected, how="difference")
+    vg_area_remain = vg_loss.area.sum() / 1e6
+    vg_area_loss = vg_area_base - vg_area_remain
+
+    # ROADS DENSITY |||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||
+    # density
+    roads_fp = overlay(roads_base_projected, fp_projected, how="intersection")
+    roads_length = roads_fp.length.sum() / 1e3
+    # roads_density = (roads_length/fp_area)
+
+    return (
+        fp_area,
+        {},
+        {},
+        {},
+        {},
+        {},
+        urban_expansion_area,
+        {},
+        vg_area_loss,
+        roads_length,
+    )
+
+
+def jobs_density(fp_file, jobs_file, footprint):
+    fp_area = footprint[0]
+    # Jobs density
+    fp_jobs = sjoin(
+        read_layer(jobs_file), read_layer(fp_file), how="inner", predicate="intersects"
+    )
+    total_jobs = len(fp_jobs)
+    return total_jobs / fp_area
+
+
+def transit_values(tr_file, tr_base_buffer):
+    tr_projected = read_layer(tr_file)
+    tr_buffer = buffer(tr_projected, 10)  # cambiar buffer i.e. 10m
+    tr_buffer_area = tr_buffer.area.sum() / 1e6
+    tr_length = tr_projected.length.sum() / 1e3
+
+    # Get the new extension of the transit lines
+    dif_tr = overlay(tr_buffer, tr_base_buffer, how="difference")
+    dif_tr_length = dif_tr.length.sum() / 1e3
+    dif_tr_buffer = buffer(dif_tr, 800)
+    dif_tr_buffer_area = dif_tr_buffer.area.sum() / 1e6
+
+    return (
+        dif_tr_buffer_area,
+        tr_buffer_area,
+        tr_length,
+        dif_tr_length,
+    )
+
+
+def permeable_values(perm_file):
+    # Get permeable area
+    return read_layer(perm_file).area.sum() / 1e6
+
+
+# GRAPH ¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬
+def build_graph(context) -> Graph:
+    """
+    Declares the nodes and entries of every option file.
+    """
+    path = context["path"]
+    files = context["files"]
+    base = context["base"]
+    graph = Graph(root=context["root"])
+    node = graph.node
+
+    def option_files(files_key, folder):
+        return [(filename, path[folder] + filename) for filename in files[files_key]]
+
+    transit = option_files("transit", 2)
+    nbs = option_files("nbs", 3)
+    hospitals = option_files("hospitals", 4)
+    schools = option_files("schools", 5)
+    # (position in partial_pop, position in partial_fp, files)
+    amenities = [
+        (2, 2, hospitals),
+        (3, 1, schools),
+        (4, 3, option_files("sports", 6)),
+        (5, 4, option_files("clinics", 7)),
+        (6, 5, option_files("daycare", 8)),
+    ]
+    UGA = option_files("UGA", 9)
+    infra = option_files("infra", 10)
+
+    # POPULATION ¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬
+    for pop_filename, pop_file in option_files("population", 0):
+        pop_key = ("partial_pop", pop_filename)
+        pop_2050 = node(population_total, pop_file)
+        pop_weights = node(population_weights, pop_file)
+        graph.entry(pop_key, node(population_values, deps=[pop_2050]))
+
+        # HAZARDS/NBS
+        exposure = node(hazard_exposure, base["hazard"], deps=[pop_weights, pop_2050])
+        for nbs_filename, nbs_file in nbs:
+            nbs_key = (*pop_key, 1, nbs_filename)
+            inter_NBS = node(nbs_base_intersection, base["population"], nbs_file)
+            inter_exp = node(exposed_zones, deps=[exposure, inter_NBS])
+            graph.entry(nbs_key, node(nbs_values, nbs_file, deps=[exposure]))
+            for position, lines in [(2, transit), (5, infra)]:
+                for line_filename, line_file in lines:
+                    buffered_lines = node(line_buffer, line_file)
+                    graph.entry(
+                        (*nbs_key, position, line_filename),
+                        node(exposed_line_share, deps=[buffered_lines, inter_exp]),
+                    )
+            for position, points in [(3, hospitals), (4, schools)]:
+                for point_filename, point_file in points:
+                    graph.entry(
+                        (*nbs_key, position, point_filename),
+                        node(exposed_point_share, point_file, deps=[inter_exp]),
+                    )
+
+        # AMENITIES
+        for position, _, facilities in amenities:
+            for facility_filename, facility_file in facilities:
+                cover = node(facility_cover, facility_file)
+                graph.entry(
+                    (*pop_key, position, facility_filename),
+                    node(population_near, deps=[pop_weights, cover, pop_2050]),
+                )
+
+        # UGA
+        for uga_filename, uga_file in UGA:
+            cover = node(facility_cover, uga_file)
+            graph.entry(
+                (*pop_key, 7, uga_filename),
+                node(
+                    green_area_values,
+                    uga_file,
+                    deps=[pop_weights, cover, pop_2050],
+                ),
+            )
+
+        # HOUSING TYPOLOGIES
+        graph.entry((*pop_key, 8), node(housing_values, pop_file))
+
+    # FOOTPRINTS ¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬
+    for fp_filename, fp_file in option_files("footprint", 1):
+        fp_key = ("partial_fp", fp_filename)
+        footprint = node(
+            footprint_values,
+            fp_file,
+            base["footprint"],
+            base["vegetal_cover"],
+            base["roads"],
+        )
+        graph.entry(fp_key, footprint)
+        # Count the total of facilities
+        for _, position, facilities in amenities:
+            for facility_filename, facility_file in facilities:
+                graph.entry(
+                    (*fp_key, position, facility_filename),
+                    node(facility_count, facility_file),
+                )
+        for jobs_filename, jobs_file in option_files("jobs", 11):
+            graph.entry(
+                (*fp_key, 7, jobs_filename),
+                node(jobs_density, fp_file, jobs_file, deps=[footprint]),
+            )
+
+    # TRANSIT ¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬
+    tr_base_buffer = node(transit_base_buffer, base["transit"])
+    for tr_filename, tr_file in transit:
+        graph.entry(
+            ("partial_tr", tr_filename),
+            node(transit_values, tr_file, deps=[tr_base_buffer]),
+        )
+
+    # PERMEABLE AREAS ¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬¬
+    for perm_filename, perm_file in option_files("perm", 12):
+        graph.entry(("partial_perm", perm_filename), node(permeable_values, perm_file))
+
+    return graph
+
+
+def assemble(entries: dict) -> dict:
+    """
+    Nests the entry values into ``partial_pop``, ``partial_fp``, ... .
+
+    Parents are placed before their children. The dict slots of a parent
+    (possibly reused from the previous run) are emptied, so only the
+    current option files are listed.
+    """
+    partials = {key: {} for key in PARTIAL_KEYS}
+    for key in sorted(entries, key=len):
+        value = entries[key]
+        if isinstance(value, (list, tuple)):
+            value = [{} if isinstance(item, dict) else item for item in value]
+        container = partials
+        for part in key[:-1]:
+            container = container[part]
+        container[key[-1]] = value
+    return partials
+
+
+def parallel_workers():
+    return settings.PREPROCESSING_WORKERS or os.cpu_count() or 1
+
+
+def run_partial_units(context, mode=None, on_node_done=None):
+    """
+    Evaluates the preprocessing graph.
+
+    Args:
+        context: Shared preprocessing context (see the module comment).
+        mode: ``"serial"``, ``"process"`` (billiard pool, safe inside Celery
+            workers) or ``"thread"`` (Shapely 2 releases the GIL in its
+            vectorized operations). Defaults to PREPROCESSING_PARALLEL_MODE.
+        on_node_done: Optional callback receiving (done, total) after each
+            evaluated node, used to report progress.
+
+    Returns:
+        A dict with ``partial_pop``, ``partial_fp``, ``partial_tr`` and
+        ``partial_perm``, each keyed by filename, plus the ``dependencies``
+        of every entry, the number of ``reused`` and ``computed`` entries and
+        the ``timings`` (wall, CPU and spans) of every evaluated node.
+    """
+    mode = mode or settings.PREPROCESSING_PARALLEL_MODE
+    graph = build_graph(context)
+    reuse = Reuse(context)
+    entries = graph.run(
+        reuse, mode=mode, workers=parallel_workers(), on_node_done=on_node_done
+    )
+    partials = assemble(entries)
+    partials.update(
+        dependencies=reuse.dependencies,
+        reused=reuse.reused,
+        computed=reuse.computed,
+        timings=graph.timings,
+    )
+    return partials
@@ -0,0 +1,143 @@
+import time
+from contextlib import contextmanager
+
+from django.core.cache import cache
+
+from urban_performance.projects.models import Proyecto, ProyectoStatus
+
+# Processing progress lives in the cache instead of Proyecto.progress, so
+# updates from parallel Celery tasks neither reload nor rewrite the project
+# row (and its partial_processing JSON). Workers and web processes must share
+# the cache backend (Redis in production).
+#
+# Within a run the percent only moves forward: late or out-of-order updates
+# (e.g. scenario chunks finishing in any order) are ignored. Updates read,
+# compare and write the state under a cache lock (cache.add), so concurrent
+# tasks cannot overwrite a higher percent with a lower one. A new run is
+# started with start_progress, and reset_progress clears the previous run as
+# soon as the project is queued (estatus set to PROCESSING), before a worker
+# starts it.
+
+PROGRESS_TIMEOUT = 60 * 60 * 24
+LOCK_TIMEOUT = 5
+LOCK_WAIT = 1
+POLL_INTERVAL = 0.01
+
+# Stages counted with step_progress
+STEP_STAGES = ["scenarios"]
+
+
+def _key(proyecto_pk) -> str:
+    return f"projects:progress:{proyecto_pk}"
+
+
+@contextmanager
+def _locked(proyecto_pk):
+    """
+    Holds the progress lock of a project, waiting up to LOCK_WAIT seconds.
+    Yields whether it was taken.
+    """
+    lock = f"{_key(proyecto_pk)}:lock"
+    deadline = time.monotonic() + LOCK_WAIT
+    while not (locked := cache.add(lock, 1, LOCK_TIMEOUT)):
+        if time.monotonic() > deadline:
+            break
+        time.sleep(POLL_INTERVAL)
+    try:
+        yield locked
+    finally:
+        if locked:
+            cache.delete(lock)
+
+
+def get_progress(proyecto_pk) -> dict:
+    """
+    Returns ``{"estatus", "stage", "percent", "updated"}`` for a project.
+
+    Falls back to the stored project row when the cache has no entry
+    (expired, or processed before this store existed).
+    """
+    state = cache.get(_key(proyecto_pk))
+    if state is None:
+        row = Proyecto.objects.filter(pk=proyecto_pk).values("estatus", "progress")
+        row = row.first() or {"estatus": ProyectoStatus.ERROR, "progress": 0}
+        state = {
+            "estatus": row["estatus"],
+            "stage": "",
+            "percent": row["progress"],
+            "updated": 0,
+        }
+    return state
+
+
+def _store(proyecto_pk, state: dict, persist: bool):
+    state["updated"] = time.time()
+    cache.set(_key(proyecto_pk), state, PROGRESS_TIMEOUT)
+    if persist:
+        # Single-column update, the project list still shows this value.
+        Proyecto.objects.filter(pk=proyecto_pk).update(progress=state["percent"])
+    return state
+
+
+def start_progress(proyecto_pk, stage: str) -> dict:
+    """
+    Starts a new processing run at 0%.
+    """
+    cache.delete_many([f"{_key(proyecto_pk)}:{step}" for step in STEP_STAGES])
+    state = {"estatus": ProyectoStatus.PROCESSING, "stage": stage, "percent": 0}
+    with _locked(proyecto_pk):
+        return _store(proyecto_pk, state, persist=True)
+
+
+def reset_progress(proyecto_pk) -> dict:
+    """
+    Starts a queued run at 0%, so readers do not report the final state of
+    the previous run until a worker calls start_progress.
+    """
+    return start_progress(proyecto_pk, stage="queued")
+
+
+def set_progress(proyecto_pk, percent, stage: str = None) -> dict:
+    """
+    Moves the progress of the current run forward to ``percent``.
+
+    Updates that would move it backwards are ignored, as are updates that
+    cannot take the lock in time (a later one will). The project row is only
+    written when the stage changes.
+    """
+    with _locked(proyecto_pk) as locked:
+        state = cache.get(_key(proyecto_pk))
+        if state is None:
+            state = {"estatus": ProyectoStatus.PROCESSING, "stage": "", "percent": 0}
+        percent = int(percent)
+        if not locked or percent <= state["percent"]:
+            return state
+        new_stage = stage is not None and stage != state["stage"]
+        state.update(percent=percent, stage=stage or state["stage"])
+        return _store(proyecto_pk, state, persist=new_stage)
+
+
+def step_progress(proyecto_pk, stage: str, total: int, start: int, end: int) -> dict:
+    """
+    Counts one finished step out of ``total`` (e.g. a scenario chunk) and
+    maps the steps done to the ``start``-``end`` percent range.
+    """
+    counter = f"{_key(proyecto_pk)}:{stage}"
+    cache.add(counter, 0, PROGRESS_TIMEOUT)
+    try:
+        done = cache.incr(counter)
+    except ValueError:
+        # The counter expired between add and incr
+        done = 1
+    return set_progress(proyecto_pk, start + (end - start) * done / total, stage)
+
+
+def finish_progress(proyecto_pk, estatus=ProyectoStatus.READY) -> dict:
+    """
+    Closes the current run with its final status.
+    """
+    with _locked(proyecto_pk):
+        state = cache.get(_key(proyecto_pk)) or {"stage": ""}
+        percent = 100 if estatus == ProyectoStatus.READY else state.get("percent", 0)
+        state.update(estatus=estatus, percent=percent)
+        return _store(proyecto_pk, state, persist=True)
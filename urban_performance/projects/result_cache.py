@@ -0,0 +1,195 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from urban_performance.projects.evaluator_cache import content_version
+
+# Scenario results evaluated by the lookups (scenarios not stored yet) live
+# in the shared cache backend (Redis in production), keyed by project,
+# content_version and scenario_key, so a new version of the project never
+# reads older results. The version itself is read from the shared cache too
+# (evaluator_cache.content_version), and lookups that already hold it pass it
+# along.
+#
+# Concurrent misses of one key are computed once: within a process the first
+# thread computes and the others wait for its result; across processes the
+# first to take the key's cache lock computes and the others poll the cache
+# for the value. Hits, misses, coalesced misses and prefetched results (see
+# prefetch.py) are counted, see cache_stats.
+
+LOCK_TIMEOUT = 30
+POLL_INTERVAL = 0.05
+COUNTERS = ["hit", "miss", "coalesced", "prefetched"]
+
+
+def _key(proyecto_pk, version: int, scenario_key: int) -> str:
+    return f"projects:scenario:{proyecto_pk}:{version}:{scenario_key}"
+
+
+def _count(name: str, amount: int = 1):
+    if not amount:
+        return
+    key = f"projects:scenario-cache:{name}"
+    if not cache.add(key, amount, timeout=None):
+        cache.incr(key, amount)
+
+
+def cache_stats() -> dict:
+    """
+    Returns the hit, miss, coalesced and prefetched counters.
+    """
+    values = cache.get_many([f"projects:scenario-cache:{name}" for name in COUNTERS])
+    return {
+        name: values.get(f"projects:scenario-cache:{name}", 0) for name in COUNTERS
+    }
+
+
+def result_version(proyecto_pk) -> int:
+    return content_version(proyecto_pk)
+
+
+def peek_result(proyecto_pk, scenario_key: int, version: int = None):
+    """
+    Returns the cached result of a scenario (counted as a hit), or ``None``
+    without computing it.
+    """
+    if version is None:
+        version = result_version(proyecto_pk)
+    value = cache.get(_key(proyecto_pk, version, scenario_key))
+    if value is not None:
+        _count("hit")
+    return value
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+
+
+_flights = {}
+_lock = threading.Lock()
+
+
+def _wait_for_process(key: str):
+    """
+    Takes the cross-process lock of ``key``, or waits for the process that
+    holds it.
+
+    Returns:
+        ``(value, locked)``: the value computed by another process (or
+        ``None``) and whether this process holds the lock.
+    """
+    lock = f"{key}:lock"
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while not cache.add(lock, 1, LOCK_TIMEOUT):
+        value = cache.get(key)
+        if value is not None:
+            return value, False
+        if time.monotonic() > deadline:
+            return None, False
+        time.sleep(POLL_INTERVAL)
+    # Finished just before the lock was released
+    value = cache.get(key)
+    if value is not None:
+        cache.delete(lock)
+        return value, False
+    return None, True
+
+
+def cached_result(proyecto_pk, scenario_key: int, compute, version: int = None):
+    """
+    Returns the result of a scenario, computing it once for concurrent
+    callers.
+
+    Args:
+        compute: Called on a miss, returns the result (``[]`` for rejected
+            scenarios is cached too, ``None`` is not).
+        version: The project's content_version, read when not given.
+    """
+    if version is None:
+        version = result_version(proyecto_pk)
+    key = _key(proyecto_pk, version, scenario_key)
+    value = cache.get(key)
+    if value is not None:
+        _count("hit")
+        return value
+
+    with _lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+    if not leader:
+        flight.done.wait(LOCK_TIMEOUT)
+        if flight.value is not None:
+            _count("coalesced")
+            return flight.value
+        # The computing thread failed or timed out
+        _count("miss")
+        return compute()
+
+    locked = False
+    try:
+        value, locked = _wait_for_process(key)
+        if value is not None:
+            _count("coalesced")
+        else:
+            _count("miss")
+            value = compute()
+            if value is not None:
+                cache.set(key, value, settings.SCENARIO_RESULT_CACHE_TIMEOUT)
+        flight.value = value
+        return value
+    finally:
+        if locked:
+            cache.delete(f"{key}:lock")
+        with _lock:
+            _flights.pop(key, None)
+        flight.done.set()
+
+
+def cached_results(
+    proyecto_pk,
+    scenario_keys: list,
+    compute_many,
+    prefetch: bool = False,
+    version: int = None,
+) -> dict:
+    """
+    Batch form of cached_result, without coalescing.
+
+    Args:
+        compute_many: Called with the keys missing from the cache, returns
+            their results by key (computed together).
+        prefetch: Count the computed results as prefetched instead of hits
+            and misses.
+        version: The project's content_version, read when not given.
+
+    Returns:
+        Results by scenario_key.
+    """
+    if version is None:
+        version = result_version(proyecto_pk)
+    keys = {_key(proyecto_pk, version, k): k for k in scenario_keys}
+    results = {keys[key]: value for key, value in cache.get_many(list(keys)).items()}
+    missing = [k for k in scenario_keys if k not in results]
+    if prefetch:
+        _count("prefetched", len(missing))
+    else:
+        _count("hit", len(results))
+        _count("miss", len(missing))
+    if missing:
+        computed = compute_many(missing)
+        cache.set_many(
+            {
+                _key(proyecto_pk, version, k): value
+                for k, value in computed.items()
+                if value is not None
+            },
+            settings.SCENARIO_RESULT_CACHE_TIMEOUT,
+        )
+        results.update(computed)
+    return results
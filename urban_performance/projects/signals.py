@@ -0,0 +1,21 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from urban_performance.projects.models import Control, Proyecto
+
+
+@receiver(post_delete, sender=Proyecto)
+def drop_scenarios_on_delete(sender, instance: Proyecto, **kwargs):
+    from urban_performance.projects.partitions import drop_result_sets
+
+    drop_result_sets(instance.pk)
+
+
+@receiver(post_save, sender=Control)
+@receiver(post_delete, sender=Control)
+def invalidate_lookups_on_control_change(sender, instance: Control, **kwargs):
+    # Lookups cache the project's controls per content_version
+    # (lookup.lookup_context)
+    from urban_performance.projects.evaluator_cache import invalidate_evaluator
+
+    invalidate_evaluator(instance.proyecto_id)
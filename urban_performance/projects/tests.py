@@ -1,2 +1,743 @@
+import gzip
+import importlib
+import itertools
+import json
+import os
+import random
+import tempfile
+import threading
+import uuid
+from http import HTTPStatus
+from pathlib import Path
 
-# Create your tests here.
+import geopandas as gpd
+import pytest
+from django.apps import apps
+from django.core.cache import cache
+from django.db import connection
+from django.http import Http404
+from shapely.geometry import Point
+
+from urban_performance.projects import layers
+from urban_performance.projects.bulk import COLUMNS
+from urban_performance.projects.bulk import copy_controls
+from urban_performance.projects.evaluator import CONTROL_COLUMNS
+from urban_performance.projects.evaluator import ENERGY_EFFICIENCY
+from urban_performance.projects.evaluator import RWH
+from urban_performance.projects.evaluator import SOLAR_ENERGY
+from urban_performance.projects.evaluator import CompiledEvaluator
+from urban_performance.projects.evaluator import base_values
+from urban_performance.projects.evaluator import indicators
+from urban_performance.projects.evaluator import scenario_measurements
+from urban_performance.projects.graph import Graph
+from urban_performance.projects.incremental import PARTIALS_VERSION
+from urban_performance.projects.incremental import Reuse
+from urban_performance.projects.incremental import fingerprint_files
+from urban_performance.projects.layers import DISPLAY_CRS
+from urban_performance.projects.layers import LayerRegistry
+from urban_performance.projects.layers import estimate_layer_size
+from urban_performance.projects.layers import load_layer
+from urban_performance.projects.layers import write_atomically
+from urban_performance.projects.lookup import InvalidLookup
+from urban_performance.projects.lookup import fetch_by_key
+from urban_performance.projects.lookup import fetch_by_keys
+from urban_performance.projects.lookup import resolve_scenarios
+from urban_performance.projects.lookup import typed_conditions
+from urban_performance.projects.models import Control
+from urban_performance.projects.models import ControlOpts
+from urban_performance.projects.models import ProyectoStatus
+from urban_performance.projects.partitions import activate_result_set
+from urban_performance.projects.partitions import create_result_set
+from urban_performance.projects.partitions import discard_result_set
+from urban_performance.projects.partitions import drop_result_sets
+from urban_performance.projects.partitions import partition_name
+from urban_performance.projects.progress import finish_progress
+from urban_performance.projects.progress import get_progress
+from urban_performance.projects.progress import reset_progress
+from urban_performance.projects.progress import set_progress
+from urban_performance.projects.progress import start_progress
+from urban_performance.projects.progress import step_progress
+from urban_performance.projects.result_cache import cache_stats
+from urban_performance.projects.result_cache import cached_result
+from urban_performance.projects.tasks import create_niveles
+from urban_performance.projects.tasks import ingest_and_process
+from urban_performance.projects.utils import get_scenario_key
+from urban_performance.projects.utils import save_control_options
+from urban_performance.projects.views import convert_geojson
+
+ASSUMPTION_CODES = [
+    "recontruction_cost",
+    "return_period",
+    "ga_c_cost",
+    "ga_m_cost",
+    "hp_c_cost",
+    "hp_m_cost",
+    "sc_c_cost",
+    "sc_m_cost",
+    "pk_c_cost",
+    "pk_m_cost",
+    "dc_c_cost",
+    "dc_m_cost",
+    "solar_panel_factor",
+    "solar_energy",
+    "mw_capacity",
+    "mw_cost",
+    "pv_incentive",
+    "distance_between_lamps",
+    "consumption_per_lamp",
+    "cost_per_kW",
+    "mantainance_expansion_cost_a",
+    "expansion_cost_a",
+    "mantainance_transit_cost_a",
+    "transit_cost_a",
+    "media_hu_water_cons",
+    "popular_hu_water_cons",
+    "residencial_hu_water_cons",
+    "water_energy",
+    "elasticity_energy",
+    "energy_consumption_base",
+    "energy_buildings_percentage",
+    "emissions_factor",
+    "elasticity_emissions",
+    "emissions_transport_percentage",
+    "kvr",
+    "vmt",
+    "md_elasticity",
+    "md_tr",
+    "md_w",
+    "md_b",
+]
+
+
+@pytest.fixture(autouse=True)
+def _cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
+def _partials():
+    """
+    Small partial results in the layout of process_project_controls, with a
+    neighbourhood missing for one population option (rejected scenarios).
+    """
+    rng = random.Random(1)
+    r = rng.random
+
+    def count():
+        return rng.randint(0, 3)
+
+    def by(names, value):
+        return {name: value() for name in names}
+
+    pop, fp, tr, nbs = ["P1", "P2"], ["F1", "F2"], ["T1", "T2"], ["N1", "N2"]
+    hp, sc, sp, cl, dc = ["H1", "H2"], ["S1"], ["K1", "K2"], ["C1"], ["D1"]
+    units, infra, jobs, perm = ["U1", "U2"], ["I1"], ["J1"], ["M1", "M2"]
+    partial_pop = {}
+    for p in pop:
+        neighbourhoods = {
+            n: [
+                r(),
+                r() * 100,
+                by(tr, r),
+                by(hp, count),
+                by(sc, count),
+                by(infra, r),
+                r(),
+                r(),
+            ]
+            for n in nbs
+        }
+        if p == "P2":
+            del neighbourhoods["N2"]
+        partial_pop[p] = [
+            r() * 1e5,
+            neighbourhoods,
+            by(hp, r),
+            by(sc, r),
+            by(sp, r),
+            by(cl, r),
+            by(dc, r),
+            {u: [r(), r(), r()] for u in units},
+            {
+                "Media_hu": r(),
+                "Popular_hu": r(),
+                "Residencial_hu": r(),
+                "units": {
+                    "Media_hu": r() * 100,
+                    "Popular_hu": r() * 100,
+                    "Residencial_hu": r() * 100,
+                },
+            },
+        ]
+    partial_fp = {
+        f: [
+            r() * 50,
+            by(sc, lambda: rng.randint(1, 5)),
+            {"H1": rng.randint(1, 5), "H2": 0 if f == "F2" else 3},
+            by(sp, lambda: rng.randint(0, 5)),
+            by(cl, lambda: rng.randint(0, 5)),
+            by(dc, lambda: rng.randint(0, 5)),
+            r(),
+            by(jobs, r),
+            r(),
+            r() * 1000,
+        ]
+        for f in fp
+    }
+    partial_processing = {
+        "partial_pop": partial_pop,
+        "partial_fp": partial_fp,
+        "partial_tr": {t: [r(), r(), r(), r()] for t in tr},
+        "partial_perm": by(perm, r),
+        "density_base": 1234.5,
+        "fp_base_area": 40.0,
+        "pop_base": 50000,
+        "base_counts": {
+            "hospitals": 2,
+            "schools": 1,
+            "sports": 1,
+            "clinics": 0,
+            "daycare": 1,
+        },
+        "options": [
+            pop,
+            fp,
+            tr,
+            nbs,
+            ENERGY_EFFICIENCY,
+            SOLAR_ENERGY,
+            RWH,
+            hp,
+            sc,
+            sp,
+            cl,
+            dc,
+            units,
+            infra,
+            jobs,
+            perm,
+        ],
+    }
+    assumptions = {code: r() * 10 + 0.5 for code in ASSUMPTION_CODES}
+    return partial_processing, assumptions
+
+
+@pytest.fixture(scope="module")
+def scalar_rows():
+    """
+    Keyed rows of every valid scenario, from the scalar indicators() path.
+    """
+    partial_processing, assumptions = _partials()
+    base = base_values(partial_processing)
+    rows = {}
+    scenarios = itertools.product(*partial_processing["options"])
+    for key, scenario in enumerate(scenarios):
+        try:
+            m = scenario_measurements(partial_processing, scenario)
+            rows[key] = [key, *scenario, *indicators(m, base, assumptions)]
+        except (KeyError, ZeroDivisionError):
+            pass
+    return rows
+
+
+@pytest.fixture(scope="module")
+def evaluator():
+    return CompiledEvaluator(*_partials())
+
+
+def test_block_matches_scalar_indicators(evaluator, scalar_rows):
+    rows = []
+    for start in range(0, evaluator.total, 777):
+        values, valid = evaluator.block(start, min(start + 777, evaluator.total))
+        rows += evaluator.block_rows(start, values, valid)
+    assert rows == list(scalar_rows.values())
+
+
+def test_key_rows_match_scalar_indicators(evaluator, scalar_rows):
+    keys = random.Random(2).sample(range(evaluator.total), 300)
+    expected = [scalar_rows[key] for key in keys if key in scalar_rows]
+    assert len(expected) < len(keys)
+    assert evaluator.key_rows(keys) == expected
+
+
+def test_progress_only_moves_forward(proyecto):
+    start_progress(proyecto.pk, "scenarios")
+    state = set_progress(proyecto.pk, 50)
+    assert set_progress(proyecto.pk, 30) == state
+
+    end = 80
+
+    def steps():
+        for _ in range(10):
+            step_progress(proyecto.pk, "scenarios", total=80, start=0, end=end)
+
+    threads = [threading.Thread(target=steps) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert get_progress(proyecto.pk)["percent"] == end
+
+
+def test_reset_progress_replaces_finished_run(proyecto):
+    start_progress(proyecto.pk, "preprocessing")
+    finish_progress(proyecto.pk)
+    assert get_progress(proyecto.pk)["estatus"] == ProyectoStatus.READY
+
+    reset_progress(proyecto.pk)
+    state = get_progress(proyecto.pk)
+    assert state["estatus"] == ProyectoStatus.PROCESSING
+    assert state["percent"] == 0
+
+
+def test_ingest_runs_before_processing():
+    signature = ingest_and_process("pk")
+    assert [task.task for task in signature.tasks] == [
+        "urban_performance.up_geo.tasks.ingest_project_files",
+        "urban_performance.projects.tasks.process_project_controls",
+    ]
+
+
+@pytest.fixture()
+def _result_sets(proyecto):
+    """
+    Drops the project's result sets, committed by transactional tests.
+    """
+    yield
+    drop_result_sets(proyecto.pk)
+
+
+@pytest.fixture(scope="module")
+def rows(evaluator):
+    values, valid = evaluator.block(0, 60)
+    return evaluator.block_rows(0, values, valid)
+
+
+def _stored(proyecto_pk, table: str = "urban_performance_controls") -> int:
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT count(*) FROM {table} WHERE project_id = %s",  # noqa: S608
+            [proyecto_pk],
+        )
+        return cursor.fetchone()[0]
+
+
+def _exists(table: str) -> bool:
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [table])
+        return cursor.fetchone()[0]
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.usefixtures("_result_sets")
+def test_redelivered_chunk_is_merged(proyecto, rows):
+    table = create_result_set(proyecto.pk, 1)
+    copy_controls(proyecto.pk, rows, table)
+    # The same chunk delivered again (acks_late, a lost worker)
+    copy_controls(proyecto.pk, rows[:10], table)
+
+    assert activate_result_set(proyecto.pk, 1)
+    proyecto.refresh_from_db()
+    assert proyecto.scenarios_version == 1
+    assert _stored(proyecto.pk) == len(rows)
+    keys = [row[0] for row in rows]
+    assert sorted(fetch_by_keys(proyecto.pk, keys, ["scenario_key"])) == keys
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.usefixtures("_result_sets")
+def test_copy_controls_updates_live_rows_in_place(proyecto, rows):
+    copy_controls(proyecto.pk, rows, create_result_set(proyecto.pk, 1))
+    activate_result_set(proyecto.pk, 1)
+    column = COLUMNS[-1][0]
+    changed = [[*row[:-1], row[-1] + 1] for row in rows[:5]]
+
+    stats = copy_controls(proyecto.pk, changed)
+
+    assert stats["rows"] == len(changed)
+    assert _stored(proyecto.pk) == len(rows)
+    row = changed[2]
+    assert fetch_by_key(proyecto.pk, row[0], [column]) == [{column: row[-1]}]
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.usefixtures("_result_sets")
+def test_newer_result_set_replaces_the_active_one(proyecto, rows):
+    old, active, writing = 1, 2, 3
+    copy_controls(proyecto.pk, rows, create_result_set(proyecto.pk, old))
+    activate_result_set(proyecto.pk, old)
+    copy_controls(proyecto.pk, rows[:5], create_result_set(proyecto.pk, active))
+
+    assert activate_result_set(proyecto.pk, active)
+    assert _stored(proyecto.pk) == len(rows[:5])
+    create_result_set(proyecto.pk, writing)
+    # The active set is never dropped, newer ones are still being written
+    discard_result_set(proyecto.pk, active)
+    drop_result_sets(proyecto.pk, keep=active)
+
+    assert not _exists(partition_name(proyecto.pk, old))
+    assert _exists(partition_name(proyecto.pk, active))
+    assert _exists(partition_name(proyecto.pk, writing))
+    assert _stored(proyecto.pk) == len(rows[:5])
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.usefixtures("_result_sets")
+def test_older_result_set_is_not_swapped_in(proyecto, rows):
+    older, newer = 1, 2
+    copy_controls(proyecto.pk, rows[:5], create_result_set(proyecto.pk, older))
+    copy_controls(proyecto.pk, rows, create_result_set(proyecto.pk, newer))
+
+    assert activate_result_set(proyecto.pk, newer)
+    # The older run finishing late
+    assert not activate_result_set(proyecto.pk, older)
+    assert not _exists(partition_name(proyecto.pk, older))
+    proyecto.refresh_from_db()
+    assert proyecto.scenarios_version == newer
+    assert _stored(proyecto.pk) == len(rows)
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.usefixtures("_result_sets")
+def test_result_set_failing_activation_ends_run_in_error(proyecto, rows):
+    table = create_result_set(proyecto.pk, 1)
+    # Rows of another project break the partition constraint
+    copy_controls(uuid.uuid4(), rows, table)
+
+    create_niveles([], proyecto_pk=proyecto.pk, stats={"count": 0}, result_set=1)
+
+    proyecto.refresh_from_db()
+    assert proyecto.estatus == ProyectoStatus.ERROR
+    assert proyecto.scenarios_version == 0
+    assert not _exists(partition_name(proyecto.pk, 1))
+
+
+def _scenario(row) -> dict:
+    return dict(zip(CONTROL_COLUMNS, row[1 : 1 + len(CONTROL_COLUMNS)], strict=True))
+
+
+def test_scenario_key_round_trip(proyecto, scalar_rows):
+    options = _partials()[0]["options"]
+    save_control_options(proyecto, options)
+
+    for key in random.Random(3).sample(sorted(scalar_rows), 50):
+        assert get_scenario_key(proyecto.pk, _scenario(scalar_rows[key])) == key
+    row = next(iter(scalar_rows.values()))
+    # Numbers may come as text in any notation
+    key = get_scenario_key(proyecto.pk, {**_scenario(row), "solar_energy": 8.4})
+    assert key is not None
+    assert (
+        get_scenario_key(proyecto.pk, {**_scenario(row), "solar_energy": "8.40"}) == key
+    )
+    assert get_scenario_key(proyecto.pk, {**_scenario(row), "nbs": "other"}) is None
+    assert get_scenario_key(proyecto.pk, {"nbs": row[4]}) is None
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.usefixtures("_result_sets")
+def test_backfill_keys_stored_rows(proyecto, rows):
+    migration = importlib.import_module(
+        "urban_performance.projects.migrations.0022_controloption_scenario_key",
+    )
+    proyecto.partial_processing = {
+        "version": migration.PARTIALS_VERSION,
+        "options": _partials()[0]["options"],
+    }
+    proyecto.save()
+    # Rows stored before the key existed (keys no scenario has)
+    unkeyed = [[-1 - i, *row[1:]] for i, row in enumerate(rows)]
+    copy_controls(proyecto.pk, unkeyed, create_result_set(proyecto.pk, 1))
+    activate_result_set(proyecto.pk, 1)
+
+    with connection.schema_editor() as schema_editor:
+        migration.backfill_scenario_keys(apps, schema_editor)
+
+    keys = [row[0] for row in rows]
+    assert sorted(fetch_by_keys(proyecto.pk, keys, ["scenario_key"])) == keys
+    assert _stored(proyecto.pk) == len(rows)
+
+
+def test_typed_conditions():
+    campos = {"energy_efficiency", "transit"}
+    data = {"energy_efficiency": "0.5", "transit": 3}
+    assert typed_conditions(None, data, campos) == [
+        ("energy_efficiency", 0.5),
+        ("transit", "3"),
+    ]
+    # Not a control of the project, not a control at all
+    for name in ["hospitals", "id; DROP TABLE x"]:
+        with pytest.raises(InvalidLookup):
+            typed_conditions(None, {name: "a"}, campos)
+    with pytest.raises(InvalidLookup) as error:
+        typed_conditions(None, {"energy_efficiency": "high"}, campos)
+    assert isinstance(error.value.__cause__, ValueError)
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.usefixtures("_result_sets")
+def test_fetch_by_key(proyecto, rows):
+    copy_controls(proyecto.pk, rows, create_result_set(proyecto.pk, 1))
+    activate_result_set(proyecto.pk, 1)
+    row = rows[3]
+
+    assert fetch_by_key(proyecto.pk, row[0], ["scenario_key", "transit"]) == [
+        {"scenario_key": row[0], "transit": row[3]},
+    ]
+    # Rows are in scenario_key order
+    assert fetch_by_key(proyecto.pk, rows[-1][0] + 1, ["scenario_key"]) == []
+
+
+def _layer_points() -> list:
+    return [Point(x, 0) for x in range(3)]
+
+
+def _layer(path) -> str:
+    gdf = gpd.GeoDataFrame(geometry=_layer_points(), crs=DISPLAY_CRS)
+    gdf.to_file(path, driver="GeoJSON")
+    return str(path)
+
+
+def test_layer_registry_evicts_least_recently_used(tmp_path):
+    first, second, third = (_layer(tmp_path / f"{i}.geojson") for i in range(3))
+    size = estimate_layer_size(load_layer(first, DISPLAY_CRS))
+    registry = LayerRegistry(max_bytes=2 * size)
+
+    registry.get(first, DISPLAY_CRS)
+    registry.get(second, DISPLAY_CRS)
+    registry.get(first, DISPLAY_CRS)
+    registry.get(third, DISPLAY_CRS)
+
+    kept = [Path(key[0]).name for key in registry._entries]  # noqa: SLF001
+    assert kept == ["0.geojson", "2.geojson"]
+    assert registry.current_bytes == 2 * size
+
+
+def test_layer_registry_releases_lock_when_loading_fails(tmp_path, monkeypatch):
+    path = _layer(tmp_path / "broken.geojson")
+
+    def broken(path, crs):
+        raise OSError(path)
+
+    monkeypatch.setattr(layers, "load_layer", broken)
+    registry = LayerRegistry(max_bytes=1 << 20)
+
+    with pytest.raises(OSError):  # noqa: PT011
+        registry.get(path, DISPLAY_CRS)
+    assert registry._key_locks == {}  # noqa: SLF001
+    assert registry.current_bytes == 0
+
+
+def test_write_atomically_leaves_no_temporary_files(tmp_path):
+    path = tmp_path / "layer.geojson"
+    path.write_bytes(b"old")
+
+    def broken(tmp_path):
+        raise OSError(tmp_path)
+
+    with pytest.raises(OSError):  # noqa: PT011
+        write_atomically(str(path), broken)
+    write_atomically(str(path), lambda tmp_path: Path(tmp_path).write_bytes(b"new"))
+
+    assert os.listdir(tmp_path) == ["layer.geojson"]
+    assert path.read_bytes() == b"new"
+
+
+@pytest.fixture()
+def evaluated_proyecto(proyecto, settings, tmp_path):
+    """
+    The project with the partial results, options, controls and assumptions
+    of _partials, so its scenarios can be evaluated.
+    """
+    partial_processing, assumptions = _partials()
+    settings.MEDIA_ROOT = str(tmp_path)
+    lines = ["code,value", *(f"{code},{value}" for code, value in assumptions.items())]
+    (tmp_path / "assumptions.csv").write_text("\n".join(lines))
+    proyecto.assumptions.name = "assumptions.csv"
+    proyecto.partial_processing = {**partial_processing, "version": PARTIALS_VERSION}
+    proyecto.save()
+    save_control_options(proyecto, partial_processing["options"])
+    Control.objects.bulk_create(
+        Control(proyecto=proyecto, nombre=campo, campo=campo, tipo=ControlOpts.LAYER)
+        for campo in CONTROL_COLUMNS
+    )
+    return proyecto
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.usefixtures("_result_sets")
+def test_resolve_scenarios(evaluated_proyecto, evaluator, rows, scalar_rows):
+    pk = evaluated_proyecto.pk
+    # Stored values differ from the evaluated ones to tell them apart
+    stored = [[*row[:-1], row[-1] + 1] for row in rows]
+    copy_controls(pk, stored, create_result_set(pk, 1))
+    activate_result_set(pk, 1)
+    column = COLUMNS[-1][0]
+    not_stored = next(key for key in scalar_rows if key > rows[-1][0])
+    rejected = next(key for key in itertools.count() if key not in scalar_rows)
+    scenarios = [
+        _scenario(stored[1]),
+        _scenario(scalar_rows[not_stored]),
+        {**_scenario(stored[1]), "nbs": "other"},
+        _scenario(stored[1]),
+    ]
+    # Rejected scenarios are not stored, their options come from the key
+    digits = evaluator.decode_keys([rejected])
+    scenarios.append(
+        {
+            campo: options[int(codes[0])]
+            for campo, options, codes in zip(
+                CONTROL_COLUMNS,
+                evaluator.options,
+                digits,
+                strict=True,
+            )
+        },
+    )
+
+    results, keys = resolve_scenarios(pk, scenarios, ["transit", column])
+
+    assert keys == [stored[1][0], not_stored, None, stored[1][0], rejected]
+    assert results == [
+        {"transit": stored[1][3], column: stored[1][-1]},
+        {"transit": scalar_rows[not_stored][3], column: scalar_rows[not_stored][-1]},
+        None,
+        {"transit": stored[1][3], column: stored[1][-1]},
+        None,
+    ]
+
+
+def test_concurrent_misses_compute_once():
+    callers = 8
+    calls = []
+
+    def compute():
+        calls.append(1)
+        # Keeps the other callers waiting on this flight
+        threading.Event().wait(0.2)
+        return [1, 2]
+
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(cached_result("p", 7, compute, version=1)),
+        )
+        for _ in range(callers)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [[1, 2]] * callers
+    stats = cache_stats()
+    assert stats["miss"] == 1
+    assert stats["hit"] + stats["coalesced"] == callers - 1
+
+
+def test_miss_waits_for_another_process():
+    # Another process holds the key's lock and stores the value shortly
+    key = "projects:scenario:p:1:7"
+    cache.add(f"{key}:lock", 1)
+    threading.Timer(0.1, lambda: cache.set(key, [3])).start()
+
+    def compute():
+        raise AssertionError
+
+    assert cached_result("p", 7, compute, version=1) == [3]
+    assert cache_stats()["coalesced"] == 1
+
+
+def _run_graph(root, paths, previous, calls) -> tuple:
+    def read(path):
+        calls.append(Path(path).name)
+        return Path(path).read_text()
+
+    def join(first, second):
+        calls.append("join")
+        return first + second
+
+    graph = Graph(root=str(root))
+    first, second = (graph.node(read, str(path)) for path in paths)
+    graph.entry(("partial", "first"), first)
+    graph.entry(("partial", "both"), graph.node(join, deps=[first, second]))
+    fingerprints = fingerprint_files(
+        str(root),
+        [str(path) for path in paths],
+        previous.get("fingerprints"),
+    )
+    reuse = Reuse(
+        {
+            "root": str(root),
+            "fingerprints": {name: value[2] for name, value in fingerprints.items()},
+            "previous": previous,
+        },
+    )
+    results = graph.run(reuse)
+    partial_processing = {
+        "version": PARTIALS_VERSION,
+        "partial": {key[1]: value for key, value in results.items()},
+        "dependencies": reuse.dependencies,
+        "fingerprints": fingerprints,
+    }
+    return partial_processing, reuse
+
+
+def test_reuse_recomputes_only_entries_of_changed_files(tmp_path):
+    paths = [tmp_path / "a.geojson", tmp_path / "b.geojson"]
+    paths[0].write_text("a")
+    paths[1].write_text("b")
+    calls = []
+    previous, _ = _run_graph(tmp_path, paths, {}, calls)
+
+    # Uploaded again: the same content for a, a new one for b
+    paths[0].write_text("a")
+    paths[1].write_text("c")
+    os.utime(paths[0], ns=(1, 1))
+    calls.clear()
+    partial_processing, reuse = _run_graph(tmp_path, paths, previous, calls)
+
+    assert partial_processing["partial"] == {"first": "a", "both": "ac"}
+    assert (reuse.reused, reuse.computed) == (1, 1)
+    assert calls == ["b.geojson", "join"]
+
+
+@pytest.fixture()
+def layer_path():
+    """
+    A layer inside the app folder, the only one convert_geojson serves, as
+    the path the view receives.
+    """
+    app_folder = Path(layers.__file__).resolve().parent.parent
+    with tempfile.TemporaryDirectory(dir=app_folder) as folder:
+        path = _layer(Path(folder) / "layer.geojson")
+        yield str(Path(path).relative_to(app_folder))
+
+
+def test_convert_geojson_serves_compressed_artifact(rf, layer_path):
+    request = rf.get("/", HTTP_ACCEPT_ENCODING="gzip;q=1, br;q=0")
+
+    response = convert_geojson(request, layer_path)
+
+    assert response["Content-Encoding"] == "gzip"
+    assert response["Vary"] == "Accept-Encoding"
+    features = json.loads(gzip.decompress(b"".join(response.streaming_content)))
+    assert len(features["features"]) == len(_layer_points())
+    plain = convert_geojson(rf.get("/"), layer_path)
+    assert not plain.has_header("Content-Encoding")
+    assert json.loads(b"".join(plain.streaming_content)) == features
+
+
+def test_convert_geojson_revalidates_with_etag(rf, layer_path):
+    etag = convert_geojson(rf.get("/"), layer_path)["ETag"]
+
+    response = convert_geojson(rf.get("/", HTTP_IF_NONE_MATCH=etag), layer_path)
+
+    assert response.status_code == HTTPStatus.NOT_MODIFIED
+    assert response["ETag"] == etag
+
+
+def test_convert_geojson_stays_in_the_app_folder(rf):
+    with pytest.raises(Http404):
+        convert_geojson(rf.get("/"), "../config/settings/base.py")
@@ -2,7 +2,12 @@ import json
 import os
 import pandas as pd
 from django.contrib import messages
-from urban_performance.projects.models import Proyecto, Escenario
+from urban_performance.projects.evaluator import (
+    CONTROL_COLUMNS,
+    encode_scenario,
+    option_codes,
+)
+from urban_performance.projects.models import ControlOption, Proyecto, Escenario
 from urban_performance.up_geo.models import SpatialOpts
 from django.db import connection
 
@@ -77,6 +82,42 @@ def get_min(prj_pk, campo):
         return float(cursor.fetchone()[0])
 
 
+def save_control_options(obj: Proyecto, options: list):
+    """
+    Replaces the option dictionary of a project with ``options`` (one list
+    per CONTROL_COLUMNS entry, as stored in partial_processing).
+    """
+    ControlOption.objects.filter(proyecto=obj).delete()
+    ControlOption.objects.bulk_create(
+        ControlOption(proyecto=obj, campo=campo, codigo=codigo, valor=str(valor))
+        for campo, values in zip(CONTROL_COLUMNS, options, strict=True)
+        for codigo, valor in enumerate(values)
+    )
+
+
+def get_control_options(prj_pk) -> list:
+    """
+    Returns the option lists of a project in CONTROL_COLUMNS order, as
+    stored by save_control_options.
+    """
+    options = {campo: [] for campo in CONTROL_COLUMNS}
+    for campo, valor in ControlOption.objects.filter(proyecto_id=prj_pk).values_list(
+        "campo", "valor"
+    ):
+        options[campo].append(valor)
+    return [options[campo] for campo in CONTROL_COLUMNS]
+
+
+def get_scenario_key(prj_pk, data: dict):
+    """
+    Returns the scenario_key of the scenario described by ``data`` (control
+    column -> option), or ``None`` when a control is missing or one of its
+    values is not an option of the project.
+    """
+    options = get_control_options(prj_pk)
+    return encode_scenario(options, option_codes(options), data)
+
+
 def get_indicators(obj: Proyecto, df_controls: pd.DataFrame):
     indicators_dict = {}
     ordering = "pk"
@@ -1,11 +1,10 @@
 import os
-import json
 import pandas as pd
 import shutil
-import geopandas as gpd
 import zipfile
 from . import utils
-from .tasks import process_project_controls, save_values, create_niveles
+from .layers import GEOJSON_ENCODINGS, display_geojson, geojson_variant
+from .tasks import ingest_and_process, save_values, create_niveles
 from .models import (
     Proyecto,
     create_defaults,
@@ -16,12 +15,14 @@ from .models import (
     Indicador,
     Escenario,
 )
-from celery import chain
 from django.core.exceptions import ValidationError
 from django.core.files.base import ContentFile
+from django.db import transaction
 from django.db.utils import IntegrityError
-from django.http import HttpResponse, HttpResponseRedirect, JsonResponse
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseRedirect
 from django.shortcuts import redirect, reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from django.views.generic import ListView, DetailView, DeleteView
 from django.contrib.auth.mixins import LoginRequiredMixin
 from urban_performance.up_geo.models import SpatialFile, spatial_path, SpatialOpts
@@ -303,9 +304,11 @@ class ProjectListView(ListView):
 
                     # Process project controls asynchronously
                     create_defaults(project_instance=proyecto_instance)
-                    chain(
-                        process_project_controls.s(proyecto_instance.pk)
-                    )()
+                    # Once the project and its files are committed, so the
+                    # ingest finds them
+                    transaction.on_commit(
+                        ingest_and_process(proyecto_instance.pk).delay
+                    )
                     messages.success(
                         request,
                         f"Project {proyecto_instance.nombre} has been created successfully.",
@@ -483,13 +486,59 @@ def download_project_files(request, pk):
     )
 
 
-def convert_geojson(request, path):
-    BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    geojson_path = f"{BASE_DIR}/{path}"
-    gdf = gpd.read_file(geojson_path)
+def _accepted_encodings(request) -> set:
+    accepted = set()
+    for item in request.headers.get("Accept-Encoding", "").split(","):
+        encoding, _, params = item.strip().partition(";")
+        quality = params.strip().removeprefix("q=") if params else "1"
+        try:
+            if float(quality) > 0:
+                accepted.add(encoding.strip().lower())
+        except ValueError:
+            continue
+    return accepted
 
-    if gdf.crs.to_string() != "EPSG:4326":
-        gdf = gdf.to_crs(epsg=4326)
 
-    geojson_converted = gdf.to_json()
-    return JsonResponse(json.loads(geojson_converted), safe=False)
+def convert_geojson(request, path):
+    """
+    Serves a layer as EPSG:4326 GeoJSON, streamed from its precomputed
+    artifact (gzip or brotli when the client accepts them) and revalidated
+    with ETag / Last-Modified.
+    """
+    BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    geojson_path = os.path.normpath(f"{BASE_DIR}/{path}")
+    if not geojson_path.startswith(BASE_DIR + os.sep) or not os.path.isfile(
+        geojson_path
+    ):
+        raise Http404
+    artifact = display_geojson(geojson_path)
+    stat = os.stat(artifact)
+    # Weak: the compressed variants are the same representation
+    etag = f'W/"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    headers = {
+        "ETag": etag,
+        "Last-Modified": http_date(stat.st_mtime),
+        "Cache-Control": "no-cache",
+        "Vary": "Accept-Encoding",
+    }
+    response = get_conditional_response(
+        request, etag=etag, last_modified=int(stat.st_mtime)
+    )
+    if response is not None:
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    served, encoding = artifact, None
+    accepted = _accepted_encodings(request)
+    for candidate in GEOJSON_ENCODINGS:
+        variant = geojson_variant(artifact, candidate)
+        if candidate in accepted and variant:
+            served, encoding = variant, candidate
+            break
+    response = FileResponse(open(served, "rb"), content_type="application/json")
+    if encoding:
+        response["Content-Encoding"] = encoding
+    for header, value in headers.items():
+        response[header] = value
+    return response
@@ -1,8 +1,28 @@
 from django.contrib import admin
 from .models import SpatialFile
+from .tasks import ingest_spatial_file_task
 
 # Register your models here.
 class SpatialFileAdmin(admin.ModelAdmin):
-    pass
+    list_display = ["nombre", "proyecto", "tipo", "feature_count", "geometry_error"]
+    readonly_fields = ["geometry_report"]
+    actions = ["rebuild_artifacts"]
 
-admin.site.register(SpatialFile, SpatialFileAdmin)
\ No newline at end of file
+    @admin.display(description="Area / length error")
+    def geometry_error(self, obj):
+        report = obj.geometry_report
+        if not report or not any(report["settings"].values()):
+            return "-"
+        return "{:.3%} / {:.3%} ({} -> {} vertices)".format(
+            report["area_error"],
+            report["length_error"],
+            report["vertices_before"],
+            report["vertices_after"],
+        )
+
+    @admin.action(description="Rebuild GeoParquet artifacts")
+    def rebuild_artifacts(self, request, queryset):
+        for spatial_file in queryset:
+            ingest_spatial_file_task.delay(spatial_file.pk, force=True)
+
+admin.site.register(SpatialFile, SpatialFileAdmin)
@@ -0,0 +1,203 @@
+import os
+
+import geopandas as gpd
+import numpy as np
+import shapely
+
+from urban_performance.projects.geometry import as_geometry_array
+from urban_performance.projects.layers import (
+    ANALYSIS_CRS,
+    DISPLAY_CRS,
+    artifact_path,
+    fresh_artifact,
+    write_atomically,
+    write_geojson_artifacts,
+)
+from urban_performance.up_geo.models import SpatialFile, SpatialOpts
+
+# Attribute columns read by process_project_controls, per layer type. Every
+# other column is dropped from the analysis artifact (the display artifact
+# keeps them all for map popups).
+ANALYSIS_COLUMNS = {
+    SpatialOpts.POPULATION_BASE: [
+        "CVEGEO",
+        "Pop_total",
+        "Residencial_hu",
+        "Media_hu",
+        "Popular_hu",
+    ],
+    SpatialOpts.ADDITIONAL_POPULATION: [
+        "CVEGEO",
+        "Pop_total",
+        "Residencial_hu",
+        "Media_hu",
+        "Popular_hu",
+    ],
+}
+
+POLYGONAL_TYPES = ("Polygon", "MultiPolygon")
+
+
+def _keep_polygonal(geometry):
+    # make_valid can turn a polygon into a collection with stray lines/points.
+    parts = shapely.get_parts(geometry)
+    polygons = [part for part in parts if part.geom_type in POLYGONAL_TYPES]
+    return shapely.union_all(polygons) if polygons else None
+
+
+def repair_geometries(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    """
+    Normalizes the geometries of a layer before it is used in overlays.
+
+    Drops the Z dimension, repairs invalid geometries with ``make_valid``
+    (keeping only polygonal parts for polygon layers) and removes empty or
+    missing geometries.
+
+    Args:
+        gdf: Layer as read from the uploaded file.
+
+    Returns:
+        A new GeoDataFrame with clean 2D geometries.
+    """
+    gdf = gdf[gdf.geometry.notna() & ~gdf.geometry.is_empty].copy()
+    geometries = shapely.force_2d(gdf.geometry.values)
+    invalid = ~shapely.is_valid(geometries)
+    if invalid.any():
+        type_ids = shapely.get_type_id(geometries[invalid])
+        polygonal = (type_ids == shapely.GeometryType.POLYGON) | (
+            type_ids == shapely.GeometryType.MULTIPOLYGON
+        )
+        repaired = shapely.make_valid(geometries[invalid])
+        for i, is_polygonal in enumerate(polygonal):
+            if is_polygonal and repaired[i].geom_type not in POLYGONAL_TYPES:
+                repaired[i] = _keep_polygonal(repaired[i])
+        geometries[invalid] = repaired
+    gdf.geometry = gpd.GeoSeries(geometries, index=gdf.index, crs=gdf.crs)
+    return gdf[gdf.geometry.notna() & ~gdf.geometry.is_empty]
+
+
+def _relative_error(before: float, after: float) -> float:
+    return abs(after - before) / before if before else 0.0
+
+
+def simplify_geometries(gdf: gpd.GeoDataFrame, tolerance=0, grid=0):
+    """
+    Reduces the vertex count of a projected layer before it is used in
+    overlays.
+
+    Applies a topology-preserving ``simplify`` with ``tolerance`` and snaps
+    the coordinates to a ``grid`` with ``set_precision``. Both are in CRS
+    units (meters in the analysis CRS); 0 disables the step. Features that
+    collapse to empty geometries keep their unsimplified geometry, so no
+    feature (and none of its population) is lost.
+
+    Returns:
+        A tuple ``(gdf, report)``. The report holds the settings, the vertex
+        counts and the relative error of the total area and length against
+        the unsimplified geometries, plus the largest per-feature area error.
+    """
+    before = as_geometry_array(gdf)
+    after = before
+    if tolerance:
+        after = shapely.simplify(after, tolerance, preserve_topology=True)
+    if grid:
+        after = shapely.set_precision(after, grid)
+
+    collapsed = (shapely.is_empty(after) | shapely.is_missing(after)) & ~(
+        shapely.is_empty(before) | shapely.is_missing(before)
+    )
+    after = np.where(collapsed, before, after)
+    polygonal = shapely.get_dimensions(before) == 2
+    area_before = shapely.area(before)
+    area_after = shapely.area(after)
+    length_before = shapely.length(before[~polygonal])
+    length_after = shapely.length(after[~polygonal])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        feature_area_error = np.abs(area_after - area_before) / area_before
+    feature_area_error = feature_area_error[polygonal & (area_before > 0)]
+
+    report = {
+        "settings": {"tolerance": tolerance, "grid": grid},
+        "vertices_before": int(shapely.get_num_coordinates(before).sum()),
+        "vertices_after": int(shapely.get_num_coordinates(after).sum()),
+        "restored_features": int(collapsed.sum()),
+        "area_error": _relative_error(area_before.sum(), area_after.sum()),
+        "max_feature_area_error": (
+            float(feature_area_error.max()) if len(feature_area_error) else 0.0
+        ),
+        "length_error": _relative_error(length_before.sum(), length_after.sum()),
+    }
+    gdf = gdf.copy()
+    gdf.geometry = gpd.GeoSeries(after, index=gdf.index, crs=gdf.crs)
+    return gdf, report
+
+
+def geometry_settings(spatial_file: SpatialFile) -> dict:
+    """
+    Returns the simplification settings of the project for the type of
+    ``spatial_file``, with missing values set to 0.
+    """
+    layer_settings = spatial_file.proyecto.geometry_settings.get(spatial_file.tipo, {})
+    return {
+        "tolerance": float(layer_settings.get("tolerance", 0)),
+        "grid": float(layer_settings.get("grid", 0)),
+    }
+
+
+def _write_parquet(gdf: gpd.GeoDataFrame, path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_atomically(path, lambda tmp_path: gdf.to_parquet(tmp_path, index=False))
+
+
+def ingest_spatial_file(spatial_file: SpatialFile, force: bool = False):
+    """
+    Builds the normalized artifacts of an uploaded spatial file.
+
+    Writes two GeoParquet files next to the GeoJSON: one in the analysis CRS
+    with only the columns the preprocessing needs, and one in EPSG:4326 for
+    the map endpoints, plus the EPSG:4326 GeoJSON (and its compressed
+    variants) served by the map layers. The analysis geometries are simplified with the
+    project ``geometry_settings`` of the layer type. The feature count,
+    EPSG:4326 bounding box and simplification report are stored on the
+    ``SpatialFile``.
+
+    Args:
+        spatial_file: The file to ingest.
+        force: Rebuild the artifacts even if they are up to date and the
+            geometry settings did not change.
+    """
+    source = spatial_file.archivo.path
+    if not os.path.exists(source):
+        return
+    layer_settings = geometry_settings(spatial_file)
+    applied = spatial_file.geometry_report.get("settings", {})
+    if (
+        not force
+        and fresh_artifact(source, ANALYSIS_CRS)
+        and fresh_artifact(source, DISPLAY_CRS)
+        and applied == layer_settings
+    ):
+        return
+
+    gdf = repair_geometries(gpd.read_file(source))
+
+    columns = [
+        column
+        for column in ANALYSIS_COLUMNS.get(spatial_file.tipo, [])
+        if column in gdf.columns
+    ]
+    analysis = gdf[[*columns, gdf.geometry.name]].to_crs(ANALYSIS_CRS)
+    # Only the analysis artifact is simplified, the map keeps the raw shapes
+    analysis, report = simplify_geometries(analysis, **layer_settings)
+    _write_parquet(analysis, artifact_path(source, ANALYSIS_CRS))
+
+    display = gdf if gdf.crs == DISPLAY_CRS else gdf.to_crs(DISPLAY_CRS)
+    _write_parquet(display, artifact_path(source, DISPLAY_CRS))
+    write_geojson_artifacts(display, source)
+
+    # update() instead of save() so the post_save ingest hook is not re-fired.
+    SpatialFile.objects.filter(pk=spatial_file.pk).update(
+        feature_count=len(display),
+        bbox=[float(x) for x in display.total_bounds] if len(display) else [],
+        geometry_report=report,
+    )
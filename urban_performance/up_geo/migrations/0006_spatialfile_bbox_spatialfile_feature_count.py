@@ -0,0 +1,23 @@
+# Generated by Django 4.2.11 on 2026-10-18 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('up_geo', '0005_alter_spatialfile_tipo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='spatialfile',
+            name='bbox',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='spatialfile',
+            name='feature_count',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.11 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('up_geo', '0006_spatialfile_bbox_spatialfile_feature_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='spatialfile',
+            name='geometry_report',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
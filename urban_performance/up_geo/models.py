@@ -96,6 +96,12 @@ class SpatialFile(models.Model):
     proyecto = models.ForeignKey(projects_models.Proyecto, on_delete=models.CASCADE)
     creado_el = models.DateTimeField(auto_now_add=True)
     ultima_actualizacion = models.DateTimeField(auto_now=True)
+    # Filled by the upload-time ingest (up_geo.ingest), EPSG:4326 bounds.
+    feature_count = models.IntegerField(null=True, blank=True)
+    bbox = models.JSONField(default=list, blank=True)
+    # Settings and area/length error of the simplification, see
+    # up_geo.ingest.simplify_geometries
+    geometry_report = models.JSONField(default=dict, blank=True)
 
     def __str__(self):
         return f"{self.proyecto.nombre} - {self.tipo}: {self.nombre}"
@@ -8,7 +8,16 @@ from django.utils.translation import gettext_lazy as _
 class SpatialFileSerializer(serializers.ModelSerializer):
     class Meta:
         model = SpatialFile
-        fields = ["pk", "proyecto", "nombre", "tipo", "descripcion", "archivo"]
+        fields = [
+            "pk",
+            "proyecto",
+            "nombre",
+            "tipo",
+            "descripcion",
+            "archivo",
+            "geometry_report",
+        ]
+        read_only_fields = ["geometry_report"]
 
     def is_valid(self, raise_exception=False):
         # Call the parent class's is_valid method
@@ -0,0 +1,13 @@
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from urban_performance.up_geo.models import SpatialFile
+
+
+@receiver(post_save, sender=SpatialFile)
+def ingest_on_save(sender, instance: SpatialFile, **kwargs):
+    from urban_performance.up_geo.tasks import ingest_spatial_file_task
+
+    if instance.archivo:
+        transaction.on_commit(lambda: ingest_spatial_file_task.delay(instance.pk))
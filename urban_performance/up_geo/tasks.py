@@ -0,0 +1,18 @@
+from celery import shared_task
+
+from urban_performance.up_geo.ingest import ingest_spatial_file
+from urban_performance.up_geo.models import SpatialFile
+
+
+@shared_task(soft_time_limit=3600, time_limit=3601)
+def ingest_spatial_file_task(spatial_file_pk: int, force: bool = False):
+    spatial_file = SpatialFile.objects.filter(pk=spatial_file_pk).first()
+    if spatial_file:
+        ingest_spatial_file(spatial_file, force=force)
+
+
+@shared_task(soft_time_limit=3600, time_limit=3601)
+def ingest_project_files(proyecto_pk):
+    # Rebuilds only the artifacts whose geometry settings changed
+    for spatial_file in SpatialFile.objects.filter(proyecto__pk=proyecto_pk):
+        ingest_spatial_file(spatial_file)